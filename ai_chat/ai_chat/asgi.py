@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ai_chat.settings")
 
 application = get_asgi_application()
+
+from qa.storage_check import start_periodic_storage_check  # noqa: E402
+
+start_periodic_storage_check()
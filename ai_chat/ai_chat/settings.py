@@ -12,7 +12,9 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 
 from pathlib import Path
+from corsheaders.defaults import default_headers
 from dotenv import load_dotenv
+import importlib.util
 import os
 load_dotenv()
 
@@ -51,6 +53,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "qa.middleware.RequestMetricsMiddleware",
+    "qa.middleware.ReplicaReadsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -80,6 +84,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "ai_chat.wsgi.application"
+ASGI_APPLICATION = "ai_chat.asgi.application"
 
 
 # Database
@@ -96,6 +101,48 @@ DATABASES = {
     }
 }
 
+# Connections are reused instead of opened per request. With psycopg 3 and psycopg-pool installed
+# each process keeps a pool of DB_POOL_MIN_SIZE..DB_POOL_MAX_SIZE connections (the right choice
+# under ASGI, where persistent connections are not reused across requests); otherwise
+# connections persist for DB_CONN_MAX_AGE seconds.
+if importlib.util.find_spec("psycopg_pool"):
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+            "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+            "timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        },
+    }
+else:
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("DB_CONN_MAX_AGE", "60"))
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+
+# Optional streaming replica: GET requests and the QA views' document and history reads use it
+# (qa.db_router); writes, read-then-write paths, token lookups and the polled history and status
+# views stay on the primary.
+if os.getenv("POSTGRES_REPLICA_HOST"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "HOST": os.getenv("POSTGRES_REPLICA_HOST"),
+        "PORT": os.getenv("POSTGRES_REPLICA_PORT", os.getenv("POSTGRES_PORT")),
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_READ_REPLICA = "replica" if "replica" in DATABASES else None
+DATABASE_ROUTERS = ["qa.db_router.ReplicaRouter"]
+
+# Answered questions are saved by a background thread in batches instead of before the response
+# (qa.history); off by default because a crashed worker loses up to one flush interval of rows.
+CHAT_HISTORY_WRITE_BEHIND = os.getenv("CHAT_HISTORY_WRITE_BEHIND", "").lower() in ("1", "true", "yes")
+CHAT_HISTORY_BATCH_SIZE = 100
+CHAT_HISTORY_FLUSH_INTERVAL = 0.5
+
+# qa.storage_check: remove uploads and index data without a document row and rebuild missing
+# indexes (manage.py check_storage). With STORAGE_CHECK_INTERVAL set (seconds), server
+# processes also run it in the background, one process per host at a time. Unreferenced uploads
+# younger than STORAGE_CHECK_MIN_AGE seconds are kept, as they may belong to an upload in progress.
+STORAGE_CHECK_INTERVAL = None
+STORAGE_CHECK_MIN_AGE = 3600
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -138,13 +185,31 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    # Token lookups are cached (see TOKEN_AUTH_* below). BasicAuthentication is not enabled: it
+    # would run password hashing on every request that sends a Basic header.
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'qa.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
     ],
+    # Per client IP; counted in the default cache.
+    'DEFAULT_THROTTLE_RATES': {
+        'login': '10/minute',
+        'register': '5/minute',
+    },
 }
 
+# Resolved API tokens are cached per process for TOKEN_AUTH_LOCAL_TTL seconds, which is also how
+# long a logged-out token keeps working in other worker processes. TOKEN_AUTH_CACHE optionally
+# names a cache shared by all workers (CACHES with Redis or Memcached; process-local backends are
+# refused) that keeps tokens for TOKEN_AUTH_CACHE_TTL seconds. Logout deletes the token and its
+# cache entries. At most PASSWORD_HASH_MAX_CONCURRENCY logins/registrations hash passwords at
+# once per process; others wait up to PASSWORD_HASH_WAIT seconds, then get 429.
+TOKEN_AUTH_CACHE = os.getenv("TOKEN_AUTH_CACHE") or None
+TOKEN_AUTH_CACHE_TTL = 60
+TOKEN_AUTH_LOCAL_TTL = 5
+PASSWORD_HASH_MAX_CONCURRENCY = 2
+PASSWORD_HASH_WAIT = 2
+
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -153,6 +218,9 @@ CORS_ALLOWED_ORIGINS = [
     "http://127.0.0.1:5173",
 ]
 CORS_ALLOW_CREDENTIALS = True
+# The chat UI revalidates its history with If-None-Match and reads the ETag it gets back.
+CORS_ALLOW_HEADERS = (*default_headers, "if-none-match")
+CORS_EXPOSE_HEADERS = ["ETag"]
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -164,3 +232,130 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 MAX_UPLOAD_SIZE = 10 * 1024 * 1024
 ALLOWED_UPLOAD_EXTENSIONS = ['.pdf', '.docx', '.txt']
+
+# Bulk upload (upload/bulk/): files per request, counting zip archive members, and documents per
+# ingestion job; the chunks of a job's documents are embedded together.
+BULK_UPLOAD_MAX_FILES = 200
+DATA_UPLOAD_MAX_NUMBER_FILES = BULK_UPLOAD_MAX_FILES
+BULK_INGESTION_BATCH_SIZE = 16
+
+# In-process cache of loaded FAISS indexes (approximate bytes, LRU eviction)
+FAISS_INDEX_CACHE_MAX_BYTES = int(os.getenv("FAISS_INDEX_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Background document ingestion. Any class with submit(document_id) and queue_depth() can be plugged in;
+# an optional submit_many(document_ids) lets bulk uploads embed several documents per job.
+INGESTION_BACKEND = os.getenv("INGESTION_BACKEND", "qa.ingestion.InProcessIngestionBackend")
+INGESTION_BACKEND_OPTIONS = {
+    "max_workers": int(os.getenv("INGESTION_MAX_WORKERS", 2)),
+    "use_processes": os.getenv("INGESTION_USE_PROCESSES", "False") == "True",
+}
+
+# Embeddings. EMBEDDING_PROVIDER is a callable taking the model name and returning a LangChain
+# Embeddings instance; use "qa.embeddings.fake_embeddings" for offline tests and benchmarks.
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "qa.embeddings.google_embeddings")
+EMBEDDING_MODEL = "models/embedding-001"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", str(BASE_DIR / "embedding_cache.sqlite3"))
+EMBEDDING_BATCH_SIZE = 64
+EMBEDDING_MAX_CONCURRENCY = 4
+EMBEDDING_MAX_RETRIES = 3
+# Question embeddings are cached by normalized text: this many in memory (LRU), all in EMBEDDING_CACHE_PATH.
+QUERY_EMBEDDING_CACHE_SIZE = 4096
+
+# Chat model. LLM_PROVIDER is a callable taking the model name and returning a chat model with
+# invoke/ainvoke/astream; use "qa.llm.fake_llm" for offline tests and benchmarks. The FAKE_*
+# latencies (seconds) only apply to the fake providers.
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "qa.llm.gemini_llm")
+LLM_MODEL = "gemini-2.5-flash"
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", 0))
+FAKE_LLM_TOKEN_LATENCY = float(os.getenv("FAKE_LLM_TOKEN_LATENCY", 0))
+FAKE_EMBEDDING_LATENCY = float(os.getenv("FAKE_EMBEDDING_LATENCY", 0))
+
+# Answer cache for repeated questions per document, kept in each worker process. Entries are
+# keyed by the document's content hash, so a replaced document misses in every worker. Set a
+# cosine similarity threshold (e.g. 0.95) to also serve near-duplicate questions; this costs
+# one question embedding.
+ANSWER_CACHE_MAX_ENTRIES = 1000
+ANSWER_CACHE_TTL = 60 * 60
+ANSWER_CACHE_SIMILARITY_THRESHOLD = None
+
+# Chunking: paragraphs and headings from extraction are packed into chunks of at most this many
+# approximate tokens. Chunk ids are content hashes, so replacing a document re-embeds only changed chunks.
+CHUNK_MAX_TOKENS = 150
+
+# Hybrid retrieval: BM25 keyword indexes (built at ingest time) are searched alongside FAISS and
+# merged by reciprocal-rank fusion. When the best keyword match reaches
+# KEYWORD_FAST_PATH_CONFIDENCE (0-1, None disables) the query embedding is skipped entirely.
+HYBRID_RETRIEVAL = True
+KEYWORD_INDEX_ROOT = BASE_DIR / "keyword_indexes"
+KEYWORD_FAST_PATH_CONFIDENCE = 0.8
+RRF_K = 60
+
+# Optional second stage (qa.reranking): QA retrieval fetches RERANK_CANDIDATES chunks and reranks
+# them locally by vector similarity blended with question-term coverage (RERANK_LEXICAL_WEIGHT),
+# drops chunks below RERANK_MIN_SCORE and keeps k by maximal marginal relevance
+# (RERANK_MMR_LAMBDA: 1 = relevance only). Questions with no chunk above the cutoff get the
+# "not found" answer without an LLM call. Calibrate RERANK_MIN_SCORE for the embedding model.
+RERANKING = False
+RERANK_CANDIDATES = 30
+RERANK_MIN_SCORE = 0.3
+RERANK_LEXICAL_WEIGHT = 0.3
+RERANK_MMR_LAMBDA = 0.7
+
+# Prompt assembly: the prompt is filled up to PROMPT_TOKEN_BUDGET (approximate tokens) with the
+# question, then the best context chunks, then recent turns. Older turns are folded into a stored
+# per-conversation summary by HISTORY_SUMMARIZER ("qa.prompting.llm_summary" asks the chat model).
+PROMPT_TOKEN_BUDGET = 3000
+HISTORY_SUMMARY_MAX_TOKENS = 300
+HISTORY_SUMMARIZER = "qa.prompting.extractive_summary"
+
+# Suggested questions per document, generated at ingest time with their context retrieved up front
+# (GET documents/<id>/suggestions/). SUGGESTED_QUESTIONS_GENERATOR takes the chunks and returns
+# question strings; None disables suggestions.
+SUGGESTED_QUESTIONS_GENERATOR = "qa.suggestions.template_questions"
+SUGGESTED_QUESTIONS_MAX = 6
+
+# Batch QA (qa/batch/ and `manage.py batch_qa`): questions per batch, concurrent LLM calls and
+# LLM requests per second (None = unlimited).
+BATCH_QA_MAX_QUESTIONS = 500
+BATCH_QA_MAX_CONCURRENCY = 8
+BATCH_QA_REQUESTS_PER_SECOND = None
+
+# PDF text extraction: PDFs longer than PDF_PAGES_PER_TASK pages are extracted in ranges on a
+# process pool owned by each extraction; shorter ones (or all, with 0 workers) in the calling
+# thread. Any single page exceeding PDF_PAGE_TIMEOUT seconds is skipped where timeouts can fire.
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", 2))
+PDF_PAGES_PER_TASK = 16
+PDF_PAGE_TIMEOUT = 30
+
+# Vector storage. The sharded store keeps every document's chunk vectors in a few shared FAISS
+# shards; "qa.vector_store.PerDocumentFaissStore" keeps the legacy one-directory-per-document layout.
+# Existing per-document indexes can be imported with `python manage.py import_faiss_indexes`.
+# "quantization" stores vectors as "sq8" (4x smaller) or "pq" (~32x, large IVF shards only) codes and
+# "mmap" maps shard files instead of loading them; `python manage.py rebuild_vector_indexes`
+# converts existing shards and reports the size and recall change.
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "qa.vector_store.ShardedFaissStore")
+VECTOR_STORE_OPTIONS = {
+    "root": os.getenv("VECTOR_STORE_ROOT", str(BASE_DIR / "faiss_indexes" / "shared")),
+    "shards": 4,
+    "ivf_min_vectors": 50000,
+    "nprobe": 16,
+    "quantization": os.getenv("VECTOR_STORE_QUANTIZATION") or None,
+    "mmap": os.getenv("VECTOR_STORE_MMAP", "False") == "True",
+}
+
+# Observability. Every request gets an X-Request-ID that is attached to its log lines along with
+# per-stage timings; /metrics serves Prometheus histograms, token counters and cache/index gauges
+# (per process). METRICS_ENABLED=True turns on timing and the endpoint, which then requires
+# METRICS_TOKEN and answers only "Authorization: Bearer <token>" from the scraper.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "False") == "True"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Application log lines go through the "qa" loggers as "[LEVEL] message key=value ..."; the
+# key/value fields are also on each record as `record.fields` for structured handlers.
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {"key_value": {"()": "qa.metrics.KeyValueFormatter"}},
+    "handlers": {"console": {"class": "logging.StreamHandler", "formatter": "key_value"}},
+    "loggers": {"qa": {"handlers": ["console"], "level": os.getenv("QA_LOG_LEVEL", "INFO")}},
+}
@@ -0,0 +1,30 @@
+"""Settings for running the test suite without PostgreSQL:
+
+    python manage.py test --settings=ai_chat.test_settings
+
+``replica`` simulates a read replica as a test mirror of ``default``; it is only routed to by
+tests that enable ``DATABASE_READ_REPLICA``. Uploads, vector shards, keyword indexes and the
+embedding cache go to a temporary directory removed when the run ends, never into the checkout.
+"""
+import atexit
+import shutil
+import tempfile
+from pathlib import Path
+
+from .settings import *  # noqa: F401,F403
+
+SECRET_KEY = SECRET_KEY or "test"  # noqa: F405
+
+DATABASES = {
+    "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": BASE_DIR / "db.sqlite3"},  # noqa: F405
+    "replica": {"ENGINE": "django.db.backends.sqlite3", "NAME": BASE_DIR / "db.sqlite3", "TEST": {"MIRROR": "default"}},  # noqa: F405
+}
+DATABASE_READ_REPLICA = None
+CHAT_HISTORY_WRITE_BEHIND = False
+
+DATA_DIR = Path(tempfile.mkdtemp(prefix="ai_chat-tests-"))
+atexit.register(shutil.rmtree, DATA_DIR, ignore_errors=True)
+MEDIA_ROOT = DATA_DIR / "media"
+EMBEDDING_CACHE_PATH = str(DATA_DIR / "embedding_cache.sqlite3")
+KEYWORD_INDEX_ROOT = DATA_DIR / "keyword_indexes"
+VECTOR_STORE_OPTIONS = {**VECTOR_STORE_OPTIONS, "root": str(DATA_DIR / "faiss_indexes" / "shared")}  # noqa: F405
@@ -17,7 +17,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from qa.views import MetricsView
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/qa/", include("qa.urls")),
+    path("metrics", MetricsView.as_view(), name="metrics"),
 ]
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ai_chat.settings")
 
 application = get_wsgi_application()
+
+from qa.storage_check import start_periodic_storage_check  # noqa: E402
+
+start_periodic_storage_check()
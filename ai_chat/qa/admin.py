@@ -1,7 +1,8 @@
 
 from django.contrib import admin
-from .models import Document, ChatHistory, UserProfile
+from .models import Document, ChatHistory, ConversationSummary, UserProfile
 
 admin.site.register(UserProfile)
 admin.site.register(Document)
 admin.site.register(ChatHistory)
+admin.site.register(ConversationSummary)
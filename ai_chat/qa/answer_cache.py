@@ -0,0 +1,156 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_question(question):
+	return _WHITESPACE.sub(' ', _PUNCTUATION.sub(' ', question.lower())).strip()
+
+
+def _scope_ids(scope):
+	items = scope if isinstance(scope, tuple) else (scope,)
+	return tuple(item[0] if isinstance(item, tuple) else item for item in items)
+
+
+class AnswerCache:
+	"""Per-document answer cache with TTL, global LRU size bound and optional near-duplicate matching.
+
+	Exact lookups use the normalized question text. When ``similarity_threshold`` is set and a
+	question vector is supplied, a miss falls back to the most similar cached question of the
+	same document if its cosine similarity reaches the threshold.
+
+	Entries are scoped by a document id, or by a tuple of ids for questions asked across several
+	documents; invalidating any document drops every entry whose scope includes it. An id may be
+	paired with the document's revision as ``(id, revision)``: the cache lives in one process and
+	``invalidate`` reaches only that process, so other workers rely on a changed revision never
+	matching their stale entries.
+	"""
+
+	def __init__(self, max_entries=1000, ttl=3600, similarity_threshold=None):
+		self.max_entries = max_entries
+		self.ttl = ttl
+		self.similarity_threshold = similarity_threshold
+		self._entries = OrderedDict()
+		self._by_document = {}
+		self._lock = threading.Lock()
+		self.exact_hits = 0
+		self.semantic_hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.expirations = 0
+
+	def get(self, scope, question, question_vector=None):
+		"""Return ``(answer, 'exact' | 'semantic')`` or ``None``."""
+		key = (scope, normalize_question(question))
+		now = time.monotonic()
+		with self._lock:
+			entry = self._live_entry(key, now)
+			if entry:
+				self._entries.move_to_end(key)
+				self.exact_hits += 1
+				return entry['answer'], 'exact'
+			if self.similarity_threshold is not None and question_vector is not None:
+				match = self._nearest(scope, question_vector, now)
+				if match:
+					self._entries.move_to_end(match)
+					self.semantic_hits += 1
+					return self._entries[match]['answer'], 'semantic'
+			self.misses += 1
+		return None
+
+	def put(self, scope, question, answer, question_vector=None):
+		key = (scope, normalize_question(question))
+		vector = None
+		if question_vector is not None:
+			vector = np.asarray(question_vector, dtype=np.float32)
+			norm = np.linalg.norm(vector)
+			vector = vector / norm if norm else None
+		with self._lock:
+			self._remove(key)
+			self._entries[key] = {'answer': answer, 'expires': time.monotonic() + self.ttl, 'vector': vector}
+			for document_id in _scope_ids(scope):
+				self._by_document.setdefault(document_id, set()).add(key)
+			while len(self._entries) > self.max_entries:
+				self._remove(next(iter(self._entries)))
+				self.evictions += 1
+
+	def invalidate(self, document_id):
+		with self._lock:
+			for key in list(self._by_document.get(document_id, ())):
+				self._remove(key)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._by_document.clear()
+
+	def stats(self):
+		with self._lock:
+			hits = self.exact_hits + self.semantic_hits
+			lookups = hits + self.misses
+			return {
+				'entries': len(self._entries),
+				'max_entries': self.max_entries,
+				'exact_hits': self.exact_hits,
+				'semantic_hits': self.semantic_hits,
+				'misses': self.misses,
+				'evictions': self.evictions,
+				'expirations': self.expirations,
+				'hit_rate': hits / lookups if lookups else 0.0,
+			}
+
+	def _live_entry(self, key, now):
+		entry = self._entries.get(key)
+		if entry and entry['expires'] <= now:
+			self._remove(key)
+			self.expirations += 1
+			return None
+		return entry
+
+	def _nearest(self, scope, question_vector, now):
+		candidates = [key for key in list(self._by_document.get(_scope_ids(scope)[0], ())) if key[0] == scope]
+		keys = [key for key in candidates if self._live_entry(key, now) and self._entries[key]['vector'] is not None]
+		if not keys:
+			return None
+		query = np.asarray(question_vector, dtype=np.float32)
+		norm = np.linalg.norm(query)
+		if not norm:
+			return None
+		matrix = np.stack([self._entries[key]['vector'] for key in keys])
+		scores = matrix @ (query / norm)
+		best = int(np.argmax(scores))
+		return keys[best] if scores[best] >= self.similarity_threshold else None
+
+	def _remove(self, key):
+		if self._entries.pop(key, None) is not None:
+			for document_id in _scope_ids(key[0]):
+				keys = self._by_document.get(document_id)
+				if keys is not None:
+					keys.discard(key)
+					if not keys:
+						del self._by_document[document_id]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+	global _cache
+	if _cache is None:
+		with _cache_lock:
+			if _cache is None:
+				_cache = AnswerCache(
+					max_entries=getattr(settings, 'ANSWER_CACHE_MAX_ENTRIES', 1000),
+					ttl=getattr(settings, 'ANSWER_CACHE_TTL', 3600),
+					similarity_threshold=getattr(settings, 'ANSWER_CACHE_SIMILARITY_THRESHOLD', None),
+				)
+	return _cache
@@ -0,0 +1,363 @@
+import asyncio
+import functools
+import os
+import threading
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .answer_cache import get_answer_cache, normalize_question
+from .embeddings import get_embeddings
+from .keyword_index import keyword_search
+from .metrics import NOT_FOUND_EARLY_EXITS, log, span
+from .models import Document, SuggestedQuestion
+from .prompting import conversation_history, count_tokens, format_turn
+from .reranking import candidate_count, rerank, reranking_enabled
+from .vector_store import _as_langchain_document, store_for
+
+
+CONTEXT_SEPARATOR = "\n---\n"
+NOT_FOUND_ANSWER = 'Sorry, this information is not found in the uploaded document. Please upload a relevant text document.'
+
+
+def document_not_ready_error(document):
+	"""Return an error payload if ``document`` cannot be queried yet, else None."""
+	if document.status == Document.Status.FAILED:
+		return {'error': f'Document processing failed: {document.error}', 'status': document.status}
+	if document.status != Document.Status.READY:
+		return {'error': 'Document is still being processed. Please try again shortly.', 'status': document.status}
+	return None
+
+
+def document_label(document):
+	return os.path.basename(document.file.name) if document.file else f"Document {document.id}"
+
+
+def _cite(chunk, sources=None):
+	labels = []
+	if sources:
+		source = sources.get(chunk.metadata.get('document_id'))
+		if source:
+			labels.append(source)
+	page = chunk.metadata.get('page')
+	if page:
+		labels.append(f"Page {page}")
+	return f"[{', '.join(labels)}] {chunk.page_content}" if labels else chunk.page_content
+
+
+def format_prompt(question, context_chunks=None, history=(), sources=None, summary=''):
+	"""Build the LLM prompt; ``sources`` maps document id to a label when several documents are searched."""
+	if context_chunks is None:
+		return (
+			"You are a helpful assistant. The user hasn't uploaded any document yet. "
+			"Please ask them to upload a document first so you can answer questions about it. "
+			f"User question: {question}\n\nAnswer:"
+		)
+
+	context = CONTEXT_SEPARATOR.join([_cite(chunk, sources) for chunk in context_chunks])
+	history_text = "".join(format_turn(chat) for chat in history)
+	if summary:
+		history_text = f"Summary of earlier conversation:\n{summary}\n{history_text}"
+	if sources:
+		citation = "Each passage is marked with its source document; cite it with the page number when given, e.g. (contract.pdf, page 3).\n"
+	else:
+		citation = "When a passage is marked with a page number, cite it, e.g. (page 3).\n"
+	return (
+		"You are an expert Q&A assistant. Only answer questions using the provided Document Context below. "
+		f"If the answer is not present in the context, reply: '{NOT_FOUND_ANSWER}' "
+		f"Do not use any outside knowledge. {citation}"
+		f"Document Context:\n{context}\n\nChat History:\n{history_text}\n\nCurrent Question: {question}\n\nAnswer:"
+	)
+
+
+def _sources(documents):
+	return {document.index_id: document_label(document) for document in documents} if len(documents) > 1 else None
+
+
+def _search_targets(documents):
+	"""Return ``(store, search kwargs)`` per index to query.
+
+	Documents in the shared store are searched with a single filtered query per store, so
+	selecting more of them does not add searches; legacy per-document indexes get one each.
+	"""
+	targets = []
+	shared = {}
+	for document in documents:
+		store = store_for(document)
+		if document.faiss_index_path:
+			targets.append((store, {'document_ids': [document.id], 'index_paths': {document.id: document.faiss_index_path}}))
+		else:
+			shared.setdefault(store, []).append(document.index_id)
+	targets.extend((store, {'document_ids': ids}) for store, ids in shared.items())
+	return targets
+
+
+def _searches(documents, question_vector, k):
+	"""Return one search callable per index to query."""
+	return [functools.partial(store.search, question_vector, k, **kwargs) for store, kwargs in _search_targets(documents)]
+
+
+def _merge(result_lists, k):
+	results = [result for results in result_lists for result in results]
+	results.sort(key=lambda item: item[1], reverse=True)
+	return results[:k]
+
+
+def reciprocal_rank_fusion(result_lists, k, with_scores=False):
+	"""Merge ranked ``[(chunk, score)]`` lists by summing ``1 / (RRF_K + rank)`` per chunk.
+
+	Returns the best ``k`` chunks, or ``(chunk, fused score)`` pairs with ``with_scores``.
+	"""
+	rrf_k = getattr(settings, 'RRF_K', 60)
+	scores = {}
+	chunks = {}
+	for results in result_lists:
+		for rank, (chunk, _) in enumerate(results, start=1):
+			key = (chunk.metadata.get('document_id'), chunk.page_content)
+			scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+			chunks.setdefault(key, chunk)
+	ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+	if with_scores:
+		return [(chunks[key], scores[key]) for key in ranked]
+	return [chunks[key] for key in ranked]
+
+
+def _keyword_search(documents, question, k):
+	if not getattr(settings, 'HYBRID_RETRIEVAL', True):
+		return [], 0.0
+	return keyword_search(documents, question, k)
+
+
+def _keyword_only(keyword_results, confidence):
+	threshold = getattr(settings, 'KEYWORD_FAST_PATH_CONFIDENCE', 0.8)
+	if threshold is None or not keyword_results or confidence < threshold:
+		return False
+	log('INFO', 'Keyword fast path, skipping query embedding', confidence=confidence)
+	return True
+
+
+def _suggested_context(documents, question):
+	"""Queryset of the precomputed suggestion matching a single-document question (may be empty)."""
+	if len(documents) != 1:
+		return SuggestedQuestion.objects.none()
+	return SuggestedQuestion.objects.filter(
+		document_id=documents[0].index_id, normalized=normalize_question(question)[:255],
+	).only('context')
+
+
+def _stored_chunks(suggestion, k):
+	log('INFO', 'Suggested question, using precomputed context', suggestion_id=suggestion.id)
+	return [
+		_as_langchain_document(item['text'], {'document_id': item['document_id'], 'chunk_id': item['chunk_id'], 'page': item['page']})
+		for item in suggestion.context[:k]
+	]
+
+
+def _rank(question, vector_results, keyword_results, k):
+	"""Final ranking: the local reranker when enabled (see ``qa.reranking``), else reciprocal-rank fusion."""
+	if not reranking_enabled():
+		return reciprocal_rank_fusion([vector_results, keyword_results], k)
+	candidates = {}
+	for chunk, score in vector_results:
+		candidates.setdefault((chunk.metadata.get('document_id'), chunk.page_content), (chunk, score))
+	for chunk, _ in keyword_results:
+		candidates.setdefault((chunk.metadata.get('document_id'), chunk.page_content), (chunk, None))
+	with span('rerank'):
+		return rerank(question, list(candidates.values()), k)
+
+
+def retrieve(documents, question, k=5, question_vector=None):
+	suggestion = _suggested_context(documents, question).first()
+	if suggestion:
+		return _stored_chunks(suggestion, k)
+	candidates = candidate_count(k)
+	with span('keyword_search'):
+		keyword_results, confidence = _keyword_search(documents, question, candidates)
+	if question_vector is None and _keyword_only(keyword_results, confidence):
+		return [chunk for chunk, _ in keyword_results[:k]]
+	if question_vector is None:
+		with span('embed_query'):
+			question_vector = get_embeddings().embed_query(question)
+	with span('vector_search'):
+		vector_results = _merge([search() for search in _searches(documents, question_vector, candidates)], candidates)
+	return _rank(question, vector_results, keyword_results, k)
+
+
+async def aretrieve(documents, question, k=5, question_vector=None):
+	# Keyword and FAISS searches are CPU/disk bound and thread-safe, so they run off the event
+	# loop. The keyword search goes first: when it is confident the query embedding is skipped.
+	suggestion = await _suggested_context(documents, question).afirst()
+	if suggestion:
+		return _stored_chunks(suggestion, k)
+	candidates = candidate_count(k)
+	with span('keyword_search'):
+		keyword_results, confidence = await sync_to_async(_keyword_search, thread_sensitive=False)(documents, question, candidates)
+	if question_vector is None and _keyword_only(keyword_results, confidence):
+		return [chunk for chunk, _ in keyword_results[:k]]
+	if question_vector is None:
+		with span('embed_query'):
+			question_vector = await get_embeddings().aembed_query(question)
+	# One thread per index; the vector results are merged by score, then fused with (or reranked against) the keyword ranking.
+	with span('vector_search'):
+		result_lists = await asyncio.gather(*[
+			sync_to_async(search, thread_sensitive=False)() for search in _searches(documents, question_vector, candidates)
+		])
+	return _rank(question, _merge(result_lists, candidates), keyword_results, k)
+
+
+def retrieve_many(documents, questions, k=5):
+	"""Retrieve for many questions over the same documents; returns ``[(chunk, fused score)]`` per question.
+
+	All questions are embedded in one batched call and each index is searched once with the
+	whole query matrix. The keyword fast path is not used, so every question gets fused scores.
+	"""
+	with span('keyword_search'):
+		keyword_results = [_keyword_search(documents, question, k)[0] for question in questions]
+	with span('embed_query'):
+		question_vectors = get_embeddings().embed_queries(list(questions))
+	with span('vector_search'):
+		vector_results = [[] for _ in questions]
+		for store, kwargs in _search_targets(documents):
+			for results, found in zip(vector_results, store.search_many(question_vectors, k, **kwargs)):
+				results.append(found)
+	return [
+		reciprocal_rank_fusion([_merge(vectors, k), keywords], k, with_scores=True)
+		for vectors, keywords in zip(vector_results, keyword_results)
+	]
+
+
+def fit_prompt(question, context_chunks, history, summary='', sources=None):
+	"""Assemble the prompt within ``PROMPT_TOKEN_BUDGET`` approximate tokens.
+
+	The question is always kept; then context chunks best first, then recent turns newest
+	first, then the summary of older turns, each only while it still fits.
+	"""
+	budget = getattr(settings, 'PROMPT_TOKEN_BUDGET', 3000)
+	used = count_tokens(format_prompt(question, [], (), sources))
+	counts = {'question': used}
+
+	chunks = []
+	for chunk in context_chunks:
+		cost = count_tokens(_cite(chunk, sources)) + count_tokens(CONTEXT_SEPARATOR)
+		if used + cost > budget:
+			break
+		chunks.append(chunk)
+		used += cost
+	counts['context'] = used - counts['question']
+
+	turns = []
+	for chat in reversed(list(history)):
+		cost = count_tokens(format_turn(chat))
+		if used + cost > budget:
+			break
+		turns.insert(0, chat)
+		used += cost
+	counts['history'] = used - counts['question'] - counts['context']
+
+	summary_cost = count_tokens(summary) + 5 if summary else 0
+	if summary_cost and used + summary_cost > budget:
+		summary, summary_cost = '', 0
+	counts['summary'] = summary_cost
+	counts['total'] = used + summary_cost
+	log(
+		'INFO', 'Prompt tokens', total=counts['total'], budget=budget, question=counts['question'],
+		context=counts['context'], chunks=f"{len(chunks)}/{len(context_chunks)}",
+		history=counts['history'], turns=len(turns), summary=summary_cost,
+	)
+	return format_prompt(question, chunks, turns, sources, summary)
+
+
+def _traced_history(user, documents):
+	with span('history'):
+		return conversation_history(user, documents)
+
+
+def _nothing_relevant(context_chunks):
+	# With reranking, no chunk passing the relevance cutoff means the documents do not answer the question.
+	if context_chunks or not reranking_enabled():
+		return False
+	NOT_FOUND_EARLY_EXITS.inc()
+	log('INFO', 'No chunk passed the rerank cutoff, answering without the LLM')
+	return True
+
+
+def build_prompt(user, documents, question, question_vector=None):
+	"""Return the LLM prompt, or None when reranking found nothing relevant (answer ``NOT_FOUND_ANSWER``)."""
+	if not documents:
+		return format_prompt(question)
+	context_chunks = retrieve(documents, question, question_vector=question_vector)
+	if _nothing_relevant(context_chunks):
+		return None
+	summary, history = _traced_history(user, documents)
+	return fit_prompt(question, context_chunks, history, summary, _sources(documents))
+
+
+async def abuild_prompt(user, documents, question, question_vector=None):
+	if not documents:
+		return format_prompt(question)
+	context_chunks, (summary, history) = await asyncio.gather(
+		aretrieve(documents, question, question_vector=question_vector),
+		sync_to_async(_traced_history)(user, documents),
+	)
+	if _nothing_relevant(context_chunks):
+		return None
+	return fit_prompt(question, context_chunks, history, summary, _sources(documents))
+
+
+def answer_scope(documents):
+	"""Answer cache scope: sorted ``(document id, content hash)`` pairs, so a replaced document misses in every worker."""
+	return tuple(sorted((document.id, document.content_hash) for document in documents))
+
+
+async def alookup_cached_answer(documents, question):
+	"""Return ``(hit, question_vector)``; ``hit`` is ``(answer, kind)`` or None.
+
+	The question vector is only computed when near-duplicate matching is enabled, and is
+	returned so the caller can store it alongside the fresh answer on a miss.
+	"""
+	cache = get_answer_cache()
+	question_vector = None
+	if cache.similarity_threshold is not None:
+		with span('embed_query'):
+			question_vector = await get_embeddings().aembed_query(question)
+	with span('answer_cache'):
+		return cache.get(answer_scope(documents), question, question_vector), question_vector
+
+
+def _build_llm():
+	provider = import_string(getattr(settings, 'LLM_PROVIDER', 'qa.llm.gemini_llm'))
+	return provider(getattr(settings, 'LLM_MODEL', 'gemini-2.5-flash'))
+
+
+_llm = None
+_loop_llms = weakref.WeakKeyDictionary()
+_llm_lock = threading.Lock()
+
+
+def get_llm():
+	"""Return the process-wide chat model.
+
+	The Gemini async client is bound to the event loop it was first used on, so inside a
+	running loop one instance is kept per loop: a single shared client under an ASGI server,
+	and a fresh one per request when async views are driven through ``async_to_sync``.
+	"""
+	global _llm
+	try:
+		loop = asyncio.get_running_loop()
+	except RuntimeError:
+		loop = None
+	with _llm_lock:
+		if loop is None:
+			if _llm is None:
+				_llm = _build_llm()
+			return _llm
+		llm = _loop_llms.get(loop)
+		if llm is None:
+			llm = _loop_llms[loop] = _build_llm()
+		return llm
+
+
+def response_text(response):
+	return response.content if hasattr(response, 'content') else str(response)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class QaConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "qa"
+
+    def ready(self):
+        # Connects the signals that revoke cached tokens.
+        from . import authentication  # noqa: F401
@@ -0,0 +1,168 @@
+"""Token authentication with cached token lookups, and limits on password hashing.
+
+DRF's ``TokenAuthentication`` joins ``authtoken_token`` with ``auth_user`` on every request.
+``CachedTokenAuthentication`` keeps resolved tokens in a per-process LRU for
+``TOKEN_AUTH_LOCAL_TTL`` seconds, so most requests never reach the database. Deleting a token
+(logout) or saving its user drops the entry in this process; other processes keep serving a
+revoked token until their entry expires, which bounds how long logout takes to apply everywhere.
+
+``TOKEN_AUTH_CACHE`` optionally names a Django cache shared by every process (Redis, Memcached,
+database) as a second tier kept for ``TOKEN_AUTH_CACHE_TTL`` seconds; revocation deletes its
+entry too. Process-local backends are refused there, since a revoked token would keep
+authenticating in other workers for the whole TTL.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import router
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .db_router import replica_reads
+
+
+# Only these user columns are cached; anything else is loaded from the database on access.
+USER_FIELDS = ('id', 'username', 'is_active', 'is_staff', 'is_superuser')
+
+
+class LocalTokenCache:
+	"""Thread-safe LRU of token key -> user with a per-entry expiry."""
+
+	def __init__(self, max_entries=10000):
+		self.max_entries = max_entries
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key):
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				return None
+			user, expires = entry
+			if expires < time.monotonic():
+				del self._entries[key]
+				return None
+			self._entries.move_to_end(key)
+			return user
+
+	def set(self, key, user, ttl):
+		with self._lock:
+			self._entries[key] = (user, time.monotonic() + ttl)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+
+	def discard(self, key):
+		with self._lock:
+			self._entries.pop(key, None)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+
+_local_tokens = LocalTokenCache()
+
+
+# Backends that keep entries in the process that wrote them; revocations would not reach other workers.
+LOCAL_CACHE_BACKENDS = (LocMemCache, DummyCache)
+
+
+def _shared_cache():
+	alias = getattr(settings, 'TOKEN_AUTH_CACHE', None)
+	if not alias:
+		return None
+	cache = caches[alias]
+	if isinstance(cache, LOCAL_CACHE_BACKENDS):
+		raise ImproperlyConfigured(f"TOKEN_AUTH_CACHE {alias!r} is not shared between processes; use a shared cache backend or None.")
+	return cache
+
+
+def _shared_key(key):
+	# Raw tokens are never used as cache keys.
+	return 'qa:token:' + hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _cached_user(fields):
+	User = get_user_model()
+	# from_db takes the loaded values in model field order and defers the rest.
+	names = [field.attname for field in User._meta.concrete_fields if field.attname in fields]
+	return User.from_db(router.db_for_read(User), names, [fields[name] for name in names])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+	"""``TokenAuthentication`` with cached lookups; ``request.auth`` is the token key."""
+
+	def authenticate_credentials(self, key):
+		user = _local_tokens.get(key)
+		if user is not None:
+			return user, key
+		shared = _shared_cache()
+		fields = shared.get(_shared_key(key)) if shared else None
+		if fields is not None:
+			user = _cached_user(fields)
+		else:
+			# A token created a moment ago may not have reached the replica yet.
+			with replica_reads(False):
+				user, _ = super().authenticate_credentials(key)
+			if shared:
+				shared.set(_shared_key(key), {field: getattr(user, field) for field in USER_FIELDS}, getattr(settings, 'TOKEN_AUTH_CACHE_TTL', 60))
+		_local_tokens.set(key, user, getattr(settings, 'TOKEN_AUTH_LOCAL_TTL', 5))
+		return user, key
+
+
+def revoke_token(key):
+	_local_tokens.discard(key)
+	shared = _shared_cache()
+	if shared:
+		shared.delete(_shared_key(key))
+
+
+@receiver(post_delete, sender=Token)
+def _token_deleted(sender, instance, **kwargs):
+	revoke_token(instance.key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def _user_saved(sender, instance, created, **kwargs):
+	# A deactivated user or changed permissions must not be served from the cache.
+	if not created:
+		for key in Token.objects.filter(user_id=instance.pk).values_list('key', flat=True):
+			revoke_token(key)
+
+
+_hashing_slots = None
+_hashing_slots_lock = threading.Lock()
+
+
+@contextmanager
+def password_hashing_slot():
+	"""Bound the threads hashing passwords at once (``PASSWORD_HASH_MAX_CONCURRENCY``).
+
+	Login and registration run PBKDF2, which takes a worker for a noticeable time; a request
+	that cannot get a slot within ``PASSWORD_HASH_WAIT`` seconds is throttled instead of queueing.
+	"""
+	global _hashing_slots
+	if _hashing_slots is None:
+		with _hashing_slots_lock:
+			if _hashing_slots is None:
+				_hashing_slots = threading.BoundedSemaphore(getattr(settings, 'PASSWORD_HASH_MAX_CONCURRENCY', 2))
+	wait = getattr(settings, 'PASSWORD_HASH_WAIT', 2)
+	if not _hashing_slots.acquire(timeout=wait):
+		raise exceptions.Throttled(wait=wait, detail='Too many sign-in attempts in progress. Please retry shortly.')
+	try:
+		yield
+	finally:
+		_hashing_slots.release()
@@ -0,0 +1,95 @@
+"""Batch question answering: a list of questions against the same documents in one job.
+
+Used by the ``qa/batch/`` endpoint and the ``batch_qa`` management command. Retrieval for every
+question runs up front (one batched query embedding, one FAISS search per index); LLM calls then
+run concurrently, bounded by ``BATCH_QA_MAX_CONCURRENCY`` and ``BATCH_QA_REQUESTS_PER_SECOND``,
+and results are yielded as they finish. Batch questions are not added to the chat history.
+"""
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .answer_cache import get_answer_cache
+from .answering import _sources, answer_scope, fit_prompt, get_llm, response_text, retrieve_many
+from .metrics import LLM_TOKENS, log, span
+from .prompting import count_tokens
+
+
+class RateLimiter:
+	"""Spaces calls at least ``1 / rate`` seconds apart across coroutines; a falsy rate disables it."""
+
+	def __init__(self, rate):
+		self.interval = 1.0 / rate if rate else 0.0
+		self._next = 0.0
+		self._lock = asyncio.Lock()
+
+	async def wait(self):
+		if not self.interval:
+			return
+		async with self._lock:
+			now = time.monotonic()
+			delay = self._next - now
+			self._next = max(now, self._next) + self.interval
+		if delay > 0:
+			await asyncio.sleep(delay)
+
+
+def chunk_result(chunk, score):
+	return {
+		'document_id': chunk.metadata.get('document_id'),
+		'page': chunk.metadata.get('page'),
+		'text': chunk.page_content,
+		'score': round(float(score), 6),
+	}
+
+
+async def run_batch(documents, questions, k=5, retrieve_only=False, concurrency=None, rate=None):
+	"""Yield one result per question as it completes; ``index`` is the question's position.
+
+	Results carry ``chunks`` (ranked, with fused scores) in ``retrieve_only`` mode, otherwise
+	``answer`` and ``cached``, or ``error`` if the LLM call for that question failed.
+	"""
+	with span('retrieve'):
+		retrieved = await sync_to_async(retrieve_many, thread_sensitive=False)(documents, questions, k)
+	if retrieve_only:
+		for index, (question, results) in enumerate(zip(questions, retrieved)):
+			yield {'index': index, 'question': question, 'chunks': [chunk_result(chunk, score) for chunk, score in results]}
+		return
+
+	semaphore = asyncio.Semaphore(concurrency or getattr(settings, 'BATCH_QA_MAX_CONCURRENCY', 8))
+	limiter = RateLimiter(rate if rate is not None else getattr(settings, 'BATCH_QA_REQUESTS_PER_SECOND', None))
+	cache = get_answer_cache()
+	scope = answer_scope(documents)
+	sources = _sources(documents)
+	llm = get_llm()
+
+	async def answer(index, question, results):
+		result = {'index': index, 'question': question}
+		cached = cache.get(scope, question)
+		if cached:
+			return {**result, 'answer': cached[0], 'cached': cached[1]}
+		prompt = fit_prompt(question, [chunk for chunk, _ in results], [], sources=sources)
+		async with semaphore:
+			await limiter.wait()
+			try:
+				with span('llm'):
+					text = response_text(await llm.ainvoke(prompt))
+			except Exception as e:
+				log('ERROR', 'Batch question failed', index=index, error=e)
+				return {**result, 'error': 'Failed to generate an answer.'}
+		LLM_TOKENS.inc(count_tokens(prompt), kind='prompt')
+		LLM_TOKENS.inc(count_tokens(text), kind='completion')
+		if text:
+			cache.put(scope, question, text)
+		return {**result, 'answer': text, 'cached': None}
+
+	tasks = [asyncio.ensure_future(answer(index, question, results)) for index, (question, results) in enumerate(zip(questions, retrieved))]
+	try:
+		for task in asyncio.as_completed(tasks):
+			yield await task
+	finally:
+		# The consumer went away (e.g. the client disconnected): stop the remaining LLM calls.
+		for task in tasks:
+			task.cancel()
@@ -0,0 +1,468 @@
+"""End-to-end load benchmark: generated corpus, in-process ASGI client, fake LLM and embeddings.
+
+Driven by ``python manage.py benchmark``; see that command for the settings it overrides.
+"""
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+try:
+	import resource
+except ImportError:  # Windows: without procfs either, peak RSS is reported as unknown.
+	resource = None
+
+
+SIZES = {'small': 2, 'medium': 12, 'large': 48}
+FORMATS = ('pdf', 'docx', 'txt')
+WORDS_PER_PAGE = 300
+# Metrics compared across runs; True when a higher value is better.
+COMPARED_METRICS = {'p50_ms': False, 'p95_ms': False, 'p99_ms': False, 'throughput_per_s': True, 'peak_rss_mb': False}
+
+VOCABULARY = (
+	'agreement payment invoice delivery supplier customer warranty liability termination notice '
+	'period schedule service level availability response incident report audit record retention '
+	'policy security access control encryption backup recovery storage network server license '
+	'renewal fee discount penalty credit refund dispute arbitration jurisdiction confidential '
+	'information disclosure obligation party contractor subcontractor employee training safety '
+	'inspection maintenance repair replacement equipment vehicle warehouse inventory shipment '
+	'customs tariff tax rate quarter annual budget forecast revenue expense margin capital asset '
+	'depreciation insurance claim coverage premium deductible exclusion amendment clause appendix '
+	'approval signature representative manager director committee meeting minutes resolution vote'
+).split()
+
+
+def _sentence(rng):
+	words = [rng.choice(VOCABULARY) for _ in range(rng.randint(8, 18))]
+	if rng.random() < 0.15:
+		words.insert(rng.randrange(len(words)), f"INV-{rng.randint(2020, 2025)}-{rng.randint(1, 999):03d}")
+	return ' '.join(words).capitalize() + '.'
+
+
+def generate_pages(rng, page_count, words_per_page=WORDS_PER_PAGE):
+	"""Return ``page_count`` page texts of numbered sections with blank-line separated paragraphs."""
+	pages = []
+	section = 0
+	for _ in range(page_count):
+		blocks, words = [], 0
+		while words < words_per_page:
+			if not blocks or rng.random() < 0.3:
+				section += 1
+				blocks.append(f"{section}. {rng.choice(VOCABULARY).title()} {rng.choice(VOCABULARY).title()}")
+			paragraph = ' '.join(_sentence(rng) for _ in range(rng.randint(3, 6)))
+			blocks.append(paragraph)
+			words += len(paragraph.split())
+		pages.append('\n\n'.join(blocks))
+	return pages
+
+
+def _pdf_string(line):
+	return line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_pdf(path, pages):
+	"""Write a minimal text-only PDF (Helvetica, one content stream per page)."""
+	objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+	kids = []
+	for page_text in pages:
+		lines = []
+		for block in page_text.split('\n\n'):
+			lines.extend(textwrap.wrap(block, 95) + [''])
+		content = 'BT /F1 10 Tf 13 TL 56 800 Td\n' + ''.join(f"({_pdf_string(line)}) Tj T*\n" for line in lines) + 'ET'
+		content = content.encode('latin-1')
+		kids.append(len(objects) + 1)
+		objects.append(
+			f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> "
+			f"/Contents {len(objects) + 2} 0 R >>".encode()
+		)
+		objects.append(b'<< /Length %d >>\nstream\n' % len(content) + content + b'\nendstream')
+	objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {len(kids)} >>".encode()
+
+	out = bytearray(b'%PDF-1.4\n')
+	offsets = []
+	for number, body in enumerate(objects, start=1):
+		offsets.append(len(out))
+		out += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+	xref = len(out)
+	out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+	out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+	out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+	with open(path, 'wb') as f:
+		f.write(out)
+
+
+def write_docx(path, pages):
+	import docx
+	document = docx.Document()
+	for page_number, page_text in enumerate(pages):
+		if page_number:
+			document.add_page_break()
+		for block in page_text.split('\n\n'):
+			if len(block.split()) <= 3:
+				document.add_heading(block, level=2)
+			else:
+				document.add_paragraph(block)
+	document.save(path)
+
+
+def write_txt(path, pages):
+	with open(path, 'w', encoding='utf-8') as f:
+		f.write('\n\n'.join(pages))
+
+
+WRITERS = {'pdf': write_pdf, 'docx': write_docx, 'txt': write_txt}
+
+
+def generate_corpus(directory, count, sizes=tuple(SIZES), formats=FORMATS, seed=0):
+	"""Write ``count`` documents cycling through ``formats`` and ``sizes``; returns their paths."""
+	rng = random.Random(seed)
+	os.makedirs(directory, exist_ok=True)
+	paths = []
+	for i in range(count):
+		file_format = formats[i % len(formats)]
+		size = sizes[(i // len(formats)) % len(sizes)]
+		path = os.path.join(directory, f"doc_{i:03d}_{size}.{file_format}")
+		WRITERS[file_format](path, generate_pages(rng, SIZES[size]))
+		paths.append(path)
+	return paths
+
+
+def _current_rss_bytes():
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except (OSError, ValueError, IndexError, AttributeError):
+		# No procfs: fall back to the process-wide high-water mark (kilobytes on Linux, bytes on macOS).
+		if resource is None:
+			return None
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RssSampler:
+	"""Track peak resident memory while a stage runs by sampling on a background thread."""
+
+	def __init__(self, interval=0.01):
+		self.interval = interval
+		self.peak = None
+		self._stop = threading.Event()
+		self._thread = None
+
+	def _sample(self):
+		rss = _current_rss_bytes()
+		if rss is not None:
+			self.peak = rss if self.peak is None else max(self.peak, rss)
+
+	def _run(self):
+		while not self._stop.is_set():
+			self._sample()
+			self._stop.wait(self.interval)
+
+	def __enter__(self):
+		self.peak = None
+		self._sample()
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+		return self
+
+	def __exit__(self, *exc_info):
+		self._stop.set()
+		self._thread.join()
+		self._sample()
+
+
+def summarize(latencies, errors, wall_time, peak_rss):
+	"""Stage report: latency percentiles in milliseconds, completed operations per second, peak RSS (``None`` if unknown)."""
+	values = np.array(latencies, dtype=np.float64) * 1000
+	percentiles = np.percentile(values, [50, 95, 99]) if len(values) else [None] * 3
+	return {
+		'count': len(latencies),
+		'errors': errors,
+		'p50_ms': _round(percentiles[0]),
+		'p95_ms': _round(percentiles[1]),
+		'p99_ms': _round(percentiles[2]),
+		'mean_ms': _round(values.mean()) if len(values) else None,
+		'max_ms': _round(values.max()) if len(values) else None,
+		'wall_s': round(wall_time, 3),
+		'throughput_per_s': round(len(latencies) / wall_time, 3) if wall_time else None,
+		'peak_rss_mb': round(peak_rss / (1024 * 1024), 1) if peak_rss is not None else None,
+	}
+
+
+def _round(value):
+	return None if value is None else round(float(value), 3)
+
+
+def git_commit():
+	try:
+		return subprocess.run(
+			['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, timeout=10,
+		).stdout.strip()
+	except (OSError, subprocess.SubprocessError):
+		return None
+
+
+def compare(baseline, current, threshold=10.0):
+	"""Compare two result files; returns rows ``(stage, metric, old, new, change_pct, regressed)``.
+
+	A metric regresses when it got worse by more than ``threshold`` percent.
+	"""
+	rows = []
+	for stage, new_stats in current['stages'].items():
+		old_stats = baseline.get('stages', {}).get(stage)
+		if not old_stats:
+			continue
+		for metric, higher_is_better in COMPARED_METRICS.items():
+			old, new = old_stats.get(metric), new_stats.get(metric)
+			if not old or new is None:
+				continue
+			change = (new - old) / old * 100
+			worse = -change if higher_is_better else change
+			rows.append((stage, metric, old, new, round(change, 1), worse > threshold))
+	return rows
+
+
+class Benchmark:
+	"""Run the load scenarios through Django's in-process ``AsyncClient``.
+
+	Requests to the native async views (upload, QA, streaming) run concurrently on one event
+	loop; DRF views such as history listing are serialized onto Django's sync thread, as they
+	would be per worker under an ASGI server.
+	"""
+
+	def __init__(self, corpus, users=4, concurrency=8, followups=5, seed=0, ingest_timeout=300):
+		self.corpus = corpus
+		self.users = users
+		self.concurrency = concurrency
+		self.followups = followups
+		self.ingest_timeout = ingest_timeout
+		self.rng = random.Random(seed)
+		self.stages = {}
+		self.tokens = []
+		self.documents = {}
+
+	def _headers(self, token):
+		return {'Authorization': f'Token {token}'}
+
+	async def _stage(self, name, operations):
+		"""Run ``operations`` (coroutine factories returning a list of ``(latency, ok)``) with bounded concurrency."""
+		semaphore = asyncio.Semaphore(self.concurrency)
+		latencies, errors = [], 0
+
+		async def run(operation):
+			async with semaphore:
+				return await operation()
+
+		with RssSampler() as rss:
+			start = time.perf_counter()
+			results = await asyncio.gather(*(run(operation) for operation in operations))
+			wall_time = time.perf_counter() - start
+		for samples in results:
+			for latency, ok in samples:
+				if ok:
+					latencies.append(latency)
+				else:
+					errors += 1
+		self.stages[name] = summarize(latencies, errors, wall_time, rss.peak)
+		return results
+
+	async def setup_users(self):
+		from asgiref.sync import sync_to_async
+		from django.contrib.auth.models import User
+		from rest_framework.authtoken.models import Token
+
+		def create():
+			tokens = []
+			for i in range(self.users):
+				user = User.objects.create_user(username=f'bench{i}', password='bench')
+				tokens.append(Token.objects.create(user=user).key)
+			return tokens
+
+		self.tokens = await sync_to_async(create)()
+
+	async def authentication(self, client, requests_per_user=50):
+		"""Authenticated requests that do no other database work, to isolate token authentication."""
+		def session(token):
+			async def operation():
+				samples = []
+				for _ in range(requests_per_user):
+					start = time.perf_counter()
+					response = await client.get('/api/qa/documents/status/?ids=', headers=self._headers(token))
+					samples.append((time.perf_counter() - start, response.status_code == 200))
+				return samples
+			return operation
+
+		await self._stage('auth', [session(token) for token in self.tokens])
+
+	async def uploads(self, client):
+		uploaded = {}
+
+		def upload(token, path):
+			async def operation():
+				with open(path, 'rb') as f:
+					start = time.perf_counter()
+					response = await client.post('/api/qa/upload/', {'file': f}, headers=self._headers(token))
+				latency = time.perf_counter() - start
+				if response.status_code == 202:
+					uploaded[response.json()['id']] = (token, time.perf_counter())
+				return [(latency, response.status_code == 202)]
+			return operation
+
+		files = [(self.tokens[i % self.users], path) for i, path in enumerate(self.corpus)]
+		await self._stage('upload', [upload(token, path) for token, path in files])
+		return uploaded
+
+	async def ingestion(self, uploaded):
+		"""Poll document status until every upload is ready; latency is accept-to-ready."""
+		from qa.models import Document
+
+		pending = dict(uploaded)
+		latencies, errors = [], 0
+		with RssSampler() as rss:
+			start = time.perf_counter()
+			while pending and time.perf_counter() - start < self.ingest_timeout:
+				rows = Document.objects.filter(id__in=list(pending)).values_list('id', 'status')
+				async for document_id, status in rows:
+					if status not in (Document.Status.READY, Document.Status.FAILED):
+						continue
+					token, accepted = pending.pop(document_id)
+					if status == Document.Status.READY:
+						latencies.append(time.perf_counter() - accepted)
+						self.documents.setdefault(token, []).append(document_id)
+					else:
+						errors += 1
+				await asyncio.sleep(0.02)
+			wall_time = time.perf_counter() - start
+		errors += len(pending)
+		self.stages['ingest'] = summarize(latencies, errors, wall_time, rss.peak)
+
+	def _questions(self):
+		first = f"What does the agreement say about {self.rng.choice(VOCABULARY)} and {self.rng.choice(VOCABULARY)}?"
+		followups = [
+			self.rng.choice([
+				"Can you tell me more about the {}?",
+				"How does that affect the {}?",
+				"Which section covers {}?",
+				"What is the {} period?",
+			]).format(self.rng.choice(VOCABULARY))
+			for _ in range(self.followups - 1)
+		]
+		return [first] + followups
+
+	async def questions(self, client):
+		"""Each user asks a burst of follow-up questions about one document; users run concurrently."""
+		def conversation(token, document_id, questions):
+			async def operation():
+				samples = []
+				for question in questions:
+					start = time.perf_counter()
+					response = await client.post(
+						'/api/qa/qa/', {'document_id': document_id, 'question': question},
+						content_type='application/json', headers=self._headers(token),
+					)
+					samples.append((time.perf_counter() - start, response.status_code == 200))
+				return samples
+			return operation
+
+		await self._stage('qa', [
+			conversation(token, documents[0], self._questions()) for token, documents in self.documents.items()
+		])
+
+	async def streaming(self, client):
+		"""Like ``questions`` over the SSE endpoint; records time to first token and full response time."""
+		first_tokens = []
+
+		def conversation(token, document_id, questions):
+			async def operation():
+				samples = []
+				for question in questions:
+					start = time.perf_counter()
+					response = await client.post(
+						'/api/qa/qa/stream/', {'document_id': document_id, 'question': question},
+						content_type='application/json', headers=self._headers(token),
+					)
+					first_token = None
+					body = b''
+					async for chunk in response.streaming_content:
+						if first_token is None:
+							first_token = time.perf_counter() - start
+						body += chunk
+					ok = response.status_code == 200 and b'event: done' in body
+					first_tokens.append((first_token or 0.0, ok))
+					samples.append((time.perf_counter() - start, ok))
+				return samples
+			return operation
+
+		await self._stage('qa_stream', [
+			conversation(token, documents[-1], self._questions()) for token, documents in self.documents.items()
+		])
+		stats = self.stages['qa_stream']
+		self.stages['qa_stream_first_token'] = summarize(
+			[latency for latency, ok in first_tokens if ok],
+			stats['errors'],
+			stats['wall_s'],
+			stats['peak_rss_mb'] * 1024 * 1024 if stats['peak_rss_mb'] is not None else None,
+		)
+
+	async def history(self, client):
+		"""Each user pages through their whole history, then revalidates the first page by ETag."""
+		etags = {}
+
+		def listing(token):
+			async def operation():
+				samples = []
+				url = '/api/qa/history/?page_size=20'
+				while url:
+					start = time.perf_counter()
+					response = await client.get(url, headers=self._headers(token))
+					samples.append((time.perf_counter() - start, response.status_code == 200))
+					if response.status_code != 200:
+						break
+					etags.setdefault(token, response.get('ETag'))
+					url = response.json().get('next')
+				return samples
+			return operation
+
+		def revalidate(token):
+			async def operation():
+				start = time.perf_counter()
+				response = await client.get(
+					'/api/qa/history/?page_size=20', headers={**self._headers(token), 'If-None-Match': etags.get(token) or ''},
+				)
+				return [(time.perf_counter() - start, response.status_code == 304)]
+			return operation
+
+		await self._stage('history', [listing(token) for token in self.tokens])
+		await self._stage('history_not_modified', [revalidate(token) for token in self.tokens])
+
+	async def run(self):
+		from django.test import AsyncClient
+
+		client = AsyncClient()
+		await self.setup_users()
+		await self.authentication(client)
+		uploaded = await self.uploads(client)
+		await self.ingestion(uploaded)
+		if self.documents:
+			await self.questions(client)
+			await self.streaming(client)
+		await self.history(client)
+		return self.stages
+
+
+def results(stages, config):
+	return {
+		'schema': 1,
+		'commit': git_commit(),
+		'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+		'python': sys.version.split()[0],
+		'config': config,
+		'stages': stages,
+	}
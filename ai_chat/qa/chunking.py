@@ -0,0 +1,118 @@
+import hashlib
+import re
+from collections import Counter
+
+from django.conf import settings
+
+from .prompting import count_tokens
+
+
+_MARKDOWN_HEADING = re.compile(r'^#{1,6}\s+(\S.*)$')
+_NUMBERED_HEADING = re.compile(
+	r'^(?:(?:section|article|chapter|part|schedule|appendix|annex)\s+[\w.]+|\d+\.(?:\d+\.?)*)(?:\s+\S|$)',
+	re.IGNORECASE,
+)
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def _heading(line):
+	"""Return the heading text if ``line`` looks like a heading, else None."""
+	match = _MARKDOWN_HEADING.match(line)
+	if match:
+		return match.group(1).strip()
+	words = line.split()
+	if len(words) > 12 or line[-1] in '.,;!?':
+		return None
+	if _NUMBERED_HEADING.match(line) or (line.isupper() and len(line) > 3):
+		return line
+	return None
+
+
+def _blocks(text):
+	"""Yield ``('heading' | 'paragraph', text)``; wrapped lines are rejoined, blank lines end paragraphs."""
+	paragraph = []
+	for raw_line in text.split('\n'):
+		line = raw_line.strip()
+		heading = _heading(line) if line else None
+		if paragraph and (not line or heading):
+			yield 'paragraph', ' '.join(paragraph)
+			paragraph = []
+		if heading:
+			yield 'heading', heading
+		elif line:
+			paragraph.append(line)
+	if paragraph:
+		yield 'paragraph', ' '.join(paragraph)
+
+
+def _pieces(paragraph, max_tokens):
+	"""Yield a paragraph whole if it fits, else sentence runs, else word runs of at most ``max_tokens``."""
+	if count_tokens(paragraph) <= max_tokens:
+		yield paragraph
+		return
+	for sentence in _SENTENCE_END.split(paragraph):
+		if count_tokens(sentence) <= max_tokens:
+			yield sentence
+			continue
+		words = []
+		for word in sentence.split():
+			if words and count_tokens(' '.join(words + [word])) > max_tokens:
+				yield ' '.join(words)
+				words = []
+			words.append(word)
+		if words:
+			yield ' '.join(words)
+
+
+def chunk_id(text):
+	return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def assign_ids(chunks):
+	"""Set each chunk's ``id`` to a hash of its text, suffixed ``-2``, ``-3``... for repeated text."""
+	seen = Counter()
+	for chunk in chunks:
+		digest = chunk_id(chunk['text'])
+		seen[digest] += 1
+		chunk['id'] = digest if seen[digest] == 1 else f"{digest}-{seen[digest]}"
+	return chunks
+
+
+def chunk_pages(pages, max_tokens=None):
+	"""Turn ``(page_number, text)`` items into token-sized chunks that follow the document structure.
+
+	Paragraphs are kept whole and packed together up to ``max_tokens`` (``CHUNK_MAX_TOKENS``);
+	longer ones are split at sentence boundaries. Chunks never span a page or a heading, and
+	headings are prefixed to the chunk that follows them (on the next page if they end one).
+	Every chunk gets a content-hash ``id`` (suffixed for repeated text), so an edited version
+	of a document yields the same ids for every unchanged chunk.
+	"""
+	max_tokens = max_tokens or getattr(settings, 'CHUNK_MAX_TOKENS', 150)
+	chunks = []
+	section = None
+	headings = []
+
+	def flush(parts, page_number):
+		chunks.append({'text': '\n'.join(headings + parts), 'page': page_number, 'section': section})
+		headings.clear()
+
+	for page_number, page_text in pages:
+		parts, size = [], 0
+		for kind, block in _blocks(page_text):
+			if kind == 'heading':
+				if parts:
+					flush(parts, page_number)
+					parts, size = [], 0
+				headings.append(block)
+				section = block
+				continue
+			for piece in _pieces(block, max_tokens):
+				cost = count_tokens(piece)
+				if parts and size + cost > max_tokens:
+					flush(parts, page_number)
+					parts, size = [], 0
+				parts.append(piece)
+				size += cost
+		if parts:
+			flush(parts, page_number)
+	return assign_ids(chunks)
@@ -0,0 +1,73 @@
+"""Send chat history and document reads to a read replica.
+
+``DATABASE_READ_REPLICA`` names a ``DATABASES`` alias that the database keeps in sync with
+``default`` (streaming replication); it is never written to or migrated. Reads of the models in
+``DATABASE_REPLICA_MODELS`` go there only inside ``replica_reads()``, which is opened for GET/HEAD
+requests by ``ReplicaReadsMiddleware`` and while the QA views load documents and history. Code
+that reads and then writes (uploads, deletes, ingestion) keeps reading the primary, so replica lag
+cannot make it act on stale rows.
+
+Token lookups and the views in ``DATABASE_REPLICA_EXEMPT_VIEWS`` always read the primary: a
+lagging replica would reject a token issued a moment ago, keep reporting a finished upload as
+queued, and answer a history poll with 304 before the question just asked has arrived.
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+REPLICA_MODELS = ('qa.chathistory', 'qa.document', 'qa.documentchunk', 'qa.suggestedquestion')
+
+# URL names of GET views that clients poll for their own recent writes.
+EXEMPT_VIEWS = ('chat-history', 'document-status', 'document-batch-status')
+
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+	"""Let reads in this context (and threads started from it by ``sync_to_async``) use the replica."""
+	token = _replica_reads.set(enabled)
+	try:
+		yield
+	finally:
+		_replica_reads.reset(token)
+
+
+def _replica():
+	return getattr(settings, 'DATABASE_READ_REPLICA', None)
+
+
+class ReplicaRouter:
+	def db_for_read(self, model, **hints):
+		replica = _replica()
+		if not replica:
+			return None
+		enabled = _replica_reads.get()
+		if enabled and model._meta.label_lower in getattr(settings, 'DATABASE_REPLICA_MODELS', REPLICA_MODELS):
+			return replica
+		# Related lookups from a replica row follow it only while replica reads are allowed.
+		instance = hints.get('instance')
+		if instance is not None and instance._state.db == replica:
+			return replica if enabled else DEFAULT_DB_ALIAS
+		return None
+
+	def db_for_write(self, model, **hints):
+		instance = hints.get('instance')
+		if instance is not None and instance._state.db == _replica():
+			return DEFAULT_DB_ALIAS
+		return None
+
+	def allow_relation(self, obj1, obj2, **hints):
+		# The replica holds the primary's rows, so objects loaded from either can be related.
+		aliases = {DEFAULT_DB_ALIAS, _replica()}
+		if obj1._state.db in aliases and obj2._state.db in aliases:
+			return True
+		return None
+
+	def allow_migrate(self, db, app_label, model_name=None, **hints):
+		if db == _replica():
+			return False
+		return None
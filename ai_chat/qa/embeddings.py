@@ -0,0 +1,254 @@
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+from langchain_core.embeddings import Embeddings
+
+from .answer_cache import normalize_question
+from .metrics import EMBEDDING_TEXTS, EMBEDDING_TOKENS, log
+from .prompting import count_tokens
+
+
+def google_embeddings(model):
+	from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+	class GeminiEmbeddings(GoogleGenerativeAIEmbeddings):
+		def embed_queries(self, texts):
+			# One batched request with the query task type instead of an embed_query call per text.
+			return self.embed_documents(texts, task_type='retrieval_query')
+
+	return GeminiEmbeddings(google_api_key=os.getenv("GEMINI_API_KEY"), model=model)
+
+
+class FakeEmbeddings(Embeddings):
+	"""Deterministic local embeddings for tests and benchmarks.
+
+	Vectors are derived from hashed word counts, so texts sharing words land close together
+	and FAISS retrieval behaves plausibly without any network calls.
+	"""
+
+	def __init__(self, model='fake', dimensions=256, latency=0.0):
+		self.model = model
+		self.dimensions = dimensions
+		self.latency = latency
+		self.calls = 0
+
+	def _embed(self, text):
+		vector = np.zeros(self.dimensions, dtype=np.float32)
+		for word in text.lower().split():
+			digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+			vector[int.from_bytes(digest, 'little') % self.dimensions] += 1.0
+		norm = np.linalg.norm(vector)
+		if norm:
+			vector /= norm
+		return vector.tolist()
+
+	def embed_documents(self, texts):
+		self.calls += 1
+		if self.latency:
+			time.sleep(self.latency)
+		return [self._embed(text) for text in texts]
+
+	def embed_query(self, text):
+		self.calls += 1
+		if self.latency:
+			time.sleep(self.latency)
+		return self._embed(text)
+
+	def embed_queries(self, texts):
+		self.calls += 1
+		if self.latency:
+			time.sleep(self.latency)
+		return [self._embed(text) for text in texts]
+
+
+def fake_embeddings(model):
+	return FakeEmbeddings(model=model, latency=getattr(settings, 'FAKE_EMBEDDING_LATENCY', 0.0))
+
+
+class EmbeddingCache:
+	"""Persistent (model, sha256(text)) -> vector store backed by a local sqlite file."""
+
+	def __init__(self, path):
+		self.path = str(path)
+		if self.path != ':memory:':
+			os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+		self._conn = sqlite3.connect(self.path, check_same_thread=False)
+		self._lock = threading.Lock()
+		with self._lock, self._conn:
+			self._conn.execute('PRAGMA journal_mode=WAL')
+			self._conn.execute(
+				'CREATE TABLE IF NOT EXISTS embeddings ('
+				'model TEXT NOT NULL, digest TEXT NOT NULL, vector BLOB NOT NULL, '
+				'PRIMARY KEY (model, digest))'
+			)
+
+	@staticmethod
+	def digest(text):
+		return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+	def get_many(self, model, digests):
+		found = {}
+		unique = list(dict.fromkeys(digests))
+		# Stay well below sqlite's bound-parameter limit.
+		for start in range(0, len(unique), 500):
+			batch = unique[start:start + 500]
+			placeholders = ','.join('?' * len(batch))
+			with self._lock:
+				rows = self._conn.execute(
+					f'SELECT digest, vector FROM embeddings WHERE model = ? AND digest IN ({placeholders})',
+					[model, *batch],
+				).fetchall()
+			for digest, blob in rows:
+				found[digest] = np.frombuffer(blob, dtype=np.float32).tolist()
+		return found
+
+	def set_many(self, model, items):
+		rows = [(model, digest, np.asarray(vector, dtype=np.float32).tobytes()) for digest, vector in items]
+		with self._lock, self._conn:
+			self._conn.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)', rows)
+
+
+class CachedBatchEmbeddings(Embeddings):
+	"""Wraps an embedding provider with a content-hash cache, batching, bounded concurrency and retries.
+
+	Question embeddings are keyed by normalized question text, kept in an in-memory LRU of
+	``query_cache_size`` entries and stored in the persistent cache under a separate model key.
+	"""
+
+	def __init__(self, provider, model, cache=None, batch_size=64, max_concurrency=4, max_retries=3, backoff=1.0, query_cache_size=4096):
+		self.provider = provider
+		self.model = model
+		self.cache = cache
+		self.batch_size = batch_size
+		self.max_concurrency = max_concurrency
+		self.max_retries = max_retries
+		self.backoff = backoff
+		self.query_cache_size = query_cache_size
+		self._queries = OrderedDict()
+		self._queries_lock = threading.Lock()
+
+	def _with_retries(self, func, *args):
+		for attempt in range(self.max_retries + 1):
+			try:
+				return func(*args)
+			except Exception as e:
+				if attempt == self.max_retries:
+					raise
+				delay = self.backoff * (2 ** attempt) + random.uniform(0, self.backoff)
+				log('WARNING', 'Embedding call failed, retrying', error=e, retry_in_s=delay)
+				time.sleep(delay)
+
+	def embed_documents(self, texts):
+		digests = [EmbeddingCache.digest(text) for text in texts]
+		vectors = self.cache.get_many(self.model, digests) if self.cache else {}
+
+		missing = {}
+		for digest, text in zip(digests, texts):
+			if digest not in vectors:
+				missing.setdefault(digest, text)
+		EMBEDDING_TEXTS.inc(len(texts) - len(missing), source='cache')
+		EMBEDDING_TEXTS.inc(len(missing), source='provider')
+		EMBEDDING_TOKENS.inc(sum(count_tokens(text) for text in missing.values()))
+		if missing:
+			pending = list(missing.items())
+			batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+
+			def embed_batch(batch):
+				result = self._with_retries(self.provider.embed_documents, [text for _, text in batch])
+				return list(zip((digest for digest, _ in batch), result))
+
+			if len(batches) == 1 or self.max_concurrency <= 1:
+				results = [embed_batch(batch) for batch in batches]
+			else:
+				with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+					results = list(executor.map(embed_batch, batches))
+			for items in results:
+				vectors.update(items)
+				if self.cache:
+					self.cache.set_many(self.model, items)
+
+		return [vectors[digest] for digest in digests]
+
+	def embed_query(self, text):
+		return self.embed_queries([text])[0]
+
+	def embed_queries(self, texts):
+		"""Embed several questions, serving repeats from the query caches.
+
+		Uncached questions are sent in ``batch_size`` provider calls, or one call each if the
+		provider cannot batch queries.
+		"""
+		keys = [EmbeddingCache.digest(normalize_question(text)) for text in texts]
+		with self._queries_lock:
+			vectors = {key: self._queries[key] for key in keys if key in self._queries}
+		unknown = [key for key in dict.fromkeys(keys) if key not in vectors]
+		if unknown and self.cache:
+			vectors.update(self.cache.get_many(self._query_model(), unknown))
+		pending = {}
+		for key, text in zip(keys, texts):
+			if key not in vectors:
+				pending.setdefault(key, text)
+		EMBEDDING_TEXTS.inc(len(texts) - len(pending), source='cache')
+		EMBEDDING_TEXTS.inc(len(pending), source='provider')
+		EMBEDDING_TOKENS.inc(sum(count_tokens(text) for text in pending.values()))
+		if pending:
+			items = list(pending.items())
+			batch_embed = getattr(self.provider, 'embed_queries', None)
+			if batch_embed is None or len(items) == 1:
+				fresh = [self._with_retries(self.provider.embed_query, text) for _, text in items]
+			else:
+				fresh = []
+				for i in range(0, len(items), self.batch_size):
+					fresh.extend(self._with_retries(batch_embed, [text for _, text in items[i:i + self.batch_size]]))
+			fresh = list(zip(pending, fresh))
+			vectors.update(fresh)
+			if self.cache:
+				self.cache.set_many(self._query_model(), fresh)
+		with self._queries_lock:
+			for key in keys:
+				self._queries[key] = vectors[key]
+				self._queries.move_to_end(key)
+			while len(self._queries) > self.query_cache_size:
+				self._queries.popitem(last=False)
+		return [vectors[key] for key in keys]
+
+	def _query_model(self):
+		# Providers embed questions differently from documents, so they are cached apart.
+		return f"{self.model}#query"
+
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+
+def build_embeddings():
+	model = getattr(settings, 'EMBEDDING_MODEL', 'models/embedding-001')
+	provider = import_string(getattr(settings, 'EMBEDDING_PROVIDER', 'qa.embeddings.google_embeddings'))(model)
+	cache_path = getattr(settings, 'EMBEDDING_CACHE_PATH', None)
+	return CachedBatchEmbeddings(
+		provider,
+		model,
+		cache=EmbeddingCache(cache_path) if cache_path else None,
+		batch_size=getattr(settings, 'EMBEDDING_BATCH_SIZE', 64),
+		max_concurrency=getattr(settings, 'EMBEDDING_MAX_CONCURRENCY', 4),
+		max_retries=getattr(settings, 'EMBEDDING_MAX_RETRIES', 3),
+		query_cache_size=getattr(settings, 'QUERY_EMBEDDING_CACHE_SIZE', 4096),
+	)
+
+
+def get_embeddings():
+	global _embeddings
+	if _embeddings is None:
+		with _embeddings_lock:
+			if _embeddings is None:
+				_embeddings = build_embeddings()
+	return _embeddings
@@ -0,0 +1,166 @@
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from .metrics import log
+
+
+class PageTimeout(Exception):
+	pass
+
+
+def _on_alarm(signum, frame):
+	raise PageTimeout()
+
+
+def _extract_page_range(path, start, stop, page_timeout):
+	"""Worker entry point: extract pages ``[start, stop)`` of a PDF, skipping pages that time out.
+
+	Runs in the main thread of a pool process, so a per-page SIGALRM can interrupt pdfminer.
+	"""
+	import pdfplumber
+	use_alarm = page_timeout and hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+	if use_alarm:
+		signal.signal(signal.SIGALRM, _on_alarm)
+	results = []
+	with pdfplumber.open(path) as pdf:
+		# pdf.pages is built lazily; build it before any alarm can interrupt it half-way.
+		pages = pdf.pages
+		for index in range(start, stop):
+			text = ''
+			try:
+				if use_alarm:
+					signal.setitimer(signal.ITIMER_REAL, page_timeout)
+				try:
+					page = pages[index]
+					text = page.extract_text() or ''
+				finally:
+					if use_alarm:
+						signal.setitimer(signal.ITIMER_REAL, 0)
+				page.close()
+			except PageTimeout:
+				log('WARNING', 'PDF page timed out, skipping', path=path, page=index + 1, timeout=page_timeout)
+			except Exception as e:
+				log('ERROR', 'Failed to extract PDF page', path=path, page=index + 1, error=e)
+			results.append((index + 1, text))
+	return results
+
+
+def _new_pool(workers):
+	import multiprocessing
+	return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _kill_pool(pool):
+	# A wedged worker would otherwise keep running after the pool is dropped.
+	for process in list((getattr(pool, '_processes', None) or {}).values()):
+		process.terminate()
+	pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_pdf_pages(path):
+	"""Yield ``(page_number, text)`` for a PDF, extracting page ranges on a pool owned by this call.
+
+	PDFs of at most ``PDF_PAGES_PER_TASK`` pages are extracted in the calling thread. Otherwise
+	each extraction gets its own pool, so a wedged or crashed worker only costs this document a
+	restart. A range whose worker died is resubmitted once on a fresh pool; a range that times
+	out, or breaks the pool twice, yields empty pages.
+	"""
+	import pdfplumber
+	with pdfplumber.open(path) as pdf:
+		page_count = len(pdf.pages)
+
+	pages_per_task = getattr(settings, 'PDF_PAGES_PER_TASK', 16)
+	page_timeout = getattr(settings, 'PDF_PAGE_TIMEOUT', 30)
+	workers = getattr(settings, 'PDF_EXTRACTION_WORKERS', 2)
+	if not workers:
+		yield from _extract_page_range(path, 0, page_count, None)
+		return
+	if page_count <= pages_per_task:
+		# One range gains nothing from a pool and would pay for starting an interpreter; per-page
+		# alarms still apply when this runs in the main thread.
+		yield from _extract_page_range(path, 0, page_count, page_timeout)
+		return
+
+	ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+	pool = _new_pool(min(workers, len(ranges)))
+	try:
+		futures = [pool.submit(_extract_page_range, path, start, stop, page_timeout) for start, stop in ranges]
+		retried = set()
+		i = 0
+		while i < len(ranges):
+			start, stop = ranges[i]
+			try:
+				# Per-page alarms normally fire first; this only guards against a wedged worker.
+				pages = futures[i].result(timeout=page_timeout * (stop - start) + 30)
+			except (FutureTimeoutError, BrokenProcessPool) as e:
+				_kill_pool(pool)
+				pool = _new_pool(min(workers, len(ranges) - i))
+				if isinstance(e, BrokenProcessPool) and i not in retried:
+					# Any range in flight fails with the pool, not just the one that broke it.
+					retried.add(i)
+					log('WARNING', 'PDF extraction worker died, retrying', path=path, pages=f"{start + 1}-{stop}")
+					futures[i:] = [pool.submit(_extract_page_range, path, a, b, page_timeout) for a, b in ranges[i:]]
+					continue
+				log('ERROR', 'PDF pages could not be extracted', path=path, pages=f"{start + 1}-{stop}", error=repr(e))
+				pages = [(index + 1, '') for index in range(start, stop)]
+				futures[i + 1:] = [pool.submit(_extract_page_range, path, a, b, page_timeout) for a, b in ranges[i + 1:]]
+			yield from pages
+			i += 1
+	finally:
+		pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _docx_paragraph(paragraph):
+	# Heading styles become markdown headings so the chunker can follow the document outline.
+	style = paragraph.style.name if paragraph.style is not None else ''
+	if style == 'Title' or style.startswith('Heading'):
+		level = style.rsplit(' ', 1)[-1]
+		return f"{'#' * (int(level) if level.isdigit() else 1)} {paragraph.text.strip()}"
+	return paragraph.text
+
+
+def iter_pages(source, filename):
+	"""Yield ``(page_number, text)`` for a document, streaming from its path or file object.
+
+	PDFs yield one item per page (fanned out across a process pool when ``source`` is a path);
+	DOCX and TXT have no pages and yield a single item with ``page_number`` None; DOCX paragraphs
+	are separated by blank lines and headings are marked with ``#``.
+	"""
+	ext = filename.lower().split('.')[-1]
+	try:
+		if ext == 'pdf':
+			try:
+				if isinstance(source, (str, os.PathLike)):
+					yield from iter_pdf_pages(source)
+				else:
+					import pdfplumber
+					with pdfplumber.open(source) as pdf:
+						for number, page in enumerate(pdf.pages, start=1):
+							yield number, page.extract_text() or ''
+			except Exception as e:
+				log('ERROR', 'pdfplumber failed to parse PDF', filename=filename, error=e)
+		elif ext == 'docx':
+			try:
+				import docx
+				doc = docx.Document(source)
+				yield None, '\n\n'.join([_docx_paragraph(para) for para in doc.paragraphs if para.text.strip()])
+			except Exception as e:
+				log('ERROR', 'python-docx failed to parse DOCX', filename=filename, error=e)
+		elif ext == 'txt':
+			try:
+				if isinstance(source, (str, os.PathLike)):
+					with open(source, 'r', encoding='utf-8') as fh:
+						yield None, fh.read()
+				else:
+					yield None, source.read().decode('utf-8')
+			except Exception as e:
+				log('ERROR', 'Failed to parse TXT', filename=filename, error=e)
+		else:
+			log('ERROR', 'Unsupported file type', filename=filename)
+	except Exception as e:
+		log('CRITICAL', 'Unexpected error parsing file', filename=filename, error=e)
@@ -0,0 +1,99 @@
+"""Chat history writes, optionally taken out of the response path.
+
+With ``CHAT_HISTORY_WRITE_BEHIND`` enabled, answered questions are queued and a background
+thread inserts them with one ``bulk_create`` per ``CHAT_HISTORY_BATCH_SIZE`` rows or
+``CHAT_HISTORY_FLUSH_INTERVAL`` seconds. A clean shutdown flushes the queue; rows still queued
+when a worker is killed are lost, and a follow-up asked within the flush interval does not see
+the previous turn yet.
+"""
+import atexit
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .metrics import log
+from .models import ChatHistory
+from .prompting import conversation_scope
+
+
+class ChatHistoryWriter:
+	def __init__(self, batch_size=100, interval=0.5):
+		self.batch_size = batch_size
+		self.interval = interval
+		self._queue = queue.Queue()
+		self._thread = None
+		self._lock = threading.Lock()
+
+	def add(self, chat):
+		if self._thread is None:
+			with self._lock:
+				if self._thread is None:
+					self._thread = threading.Thread(target=self._run, name='chat-history-writer', daemon=True)
+					self._thread.start()
+		self._queue.put(chat)
+
+	def pending(self):
+		return self._queue.qsize()
+
+	def flush(self):
+		"""Block until every queued row has been written."""
+		if self._thread is not None:
+			self._queue.join()
+
+	def _run(self):
+		while True:
+			rows = [self._queue.get()]
+			deadline = time.monotonic() + self.interval
+			while len(rows) < self.batch_size:
+				try:
+					rows.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+				except queue.Empty:
+					break
+			try:
+				ChatHistory.objects.bulk_create(rows)
+			except Exception as e:
+				log('ERROR', 'Failed to save chat history', rows=len(rows), error=e)
+			finally:
+				close_old_connections()
+				for _ in rows:
+					self._queue.task_done()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_history_writer():
+	global _writer
+	if _writer is None:
+		with _writer_lock:
+			if _writer is None:
+				_writer = ChatHistoryWriter(
+					batch_size=getattr(settings, 'CHAT_HISTORY_BATCH_SIZE', 100),
+					interval=getattr(settings, 'CHAT_HISTORY_FLUSH_INTERVAL', 0.5),
+				)
+				atexit.register(_writer.flush)
+	return _writer
+
+
+async def asave_chat(user, documents, question, answer):
+	"""Save one question and answer about ``documents``; returns the row, or None if it was queued for a write-behind insert.
+
+	The row links to a document only when exactly one was asked about; ``scope`` ties it to the
+	conversation over all of them, which is what ``conversation_history`` reads.
+	"""
+	chat = ChatHistory(
+		user=user,
+		document=documents[0] if len(documents) == 1 else None,
+		scope=conversation_scope(documents),
+		question=question,
+		answer=answer,
+	)
+	if getattr(settings, 'CHAT_HISTORY_WRITE_BEHIND', False):
+		get_history_writer().add(chat)
+		return None
+	await chat.asave()
+	return chat
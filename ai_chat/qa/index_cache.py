@@ -0,0 +1,120 @@
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .metrics import span
+
+
+def _index_signature(index_path):
+	"""Return (mtime, size_in_bytes) for a saved FAISS index directory."""
+	mtime = 0.0
+	size = 0
+	with os.scandir(index_path) as entries:
+		for entry in entries:
+			if entry.is_file():
+				stat = entry.stat()
+				mtime = max(mtime, stat.st_mtime)
+				size += stat.st_size
+	return mtime, size
+
+
+class VectorStoreCache:
+	"""Thread-safe LRU cache of loaded vectorstores, bounded by an approximate memory budget.
+
+	Entries are keyed by document id and revalidated against the index mtime, so a
+	re-indexed document is reloaded even if nobody called ``invalidate``.
+	"""
+
+	def __init__(self, max_bytes):
+		self.max_bytes = max_bytes
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+		self._load_locks = {}
+		self.current_bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def get(self, document_id, index_path, loader):
+		mtime, size = _index_signature(index_path)
+		signature = (index_path, mtime)
+		with self._lock:
+			entry = self._entries.get(document_id)
+			if entry and entry[0] == signature:
+				self._entries.move_to_end(document_id)
+				self.hits += 1
+				return entry[1]
+			# [lock, threads using it]; the last thread out removes it, whether or not the load worked.
+			load_lock = self._load_locks.setdefault(document_id, [threading.Lock(), 0])
+			load_lock[1] += 1
+
+		# Only one thread loads a given document; the others wait and reuse its result.
+		try:
+			with load_lock[0]:
+				with self._lock:
+					entry = self._entries.get(document_id)
+					if entry and entry[0] == signature:
+						self._entries.move_to_end(document_id)
+						self.hits += 1
+						return entry[1]
+					self.misses += 1
+				with span('index_load'):
+					vectorstore = loader(index_path)
+				with self._lock:
+					self._discard(document_id)
+					if size <= self.max_bytes:
+						self._entries[document_id] = (signature, vectorstore, size)
+						self.current_bytes += size
+						while self.current_bytes > self.max_bytes:
+							oldest = next(iter(self._entries))
+							self._discard(oldest)
+							self.evictions += 1
+			return vectorstore
+		finally:
+			with self._lock:
+				load_lock[1] -= 1
+				if not load_lock[1]:
+					self._load_locks.pop(document_id, None)
+
+	def invalidate(self, document_id):
+		with self._lock:
+			self._discard(document_id)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self.current_bytes = 0
+
+	def stats(self):
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				'entries': len(self._entries),
+				'bytes': self.current_bytes,
+				'max_bytes': self.max_bytes,
+				'hits': self.hits,
+				'misses': self.misses,
+				'evictions': self.evictions,
+				'hit_rate': self.hits / lookups if lookups else 0.0,
+			}
+
+	def _discard(self, document_id):
+		entry = self._entries.pop(document_id, None)
+		if entry:
+			self.current_bytes -= entry[2]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_index_cache():
+	global _cache
+	if _cache is None:
+		with _cache_lock:
+			if _cache is None:
+				max_bytes = getattr(settings, 'FAISS_INDEX_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+				_cache = VectorStoreCache(max_bytes)
+	return _cache
@@ -0,0 +1,362 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .chunking import chunk_pages
+from .extraction import iter_pages
+from .models import Document, DocumentChunk, SuggestedQuestion
+from .answer_cache import get_answer_cache
+from .keyword_index import build_keyword_index, move_keyword_index, remove_keyword_index
+from .metrics import DOCUMENTS_INGESTED, current_request_id, current_spans, format_spans, log, request_context, span
+from .suggestions import build_suggestions
+from .vector_store import get_legacy_store, get_vector_store, store_for
+
+
+def _update_document(document_id, **fields):
+	# Queryset updates so a document deleted mid-ingestion is a no-op instead of an error.
+	return Document.objects.filter(id=document_id).update(**fields)
+
+
+def _unembedded(document, chunks):
+	"""Positions of ``chunks`` that need a vector: all of them, except content ids already stored."""
+	if document.faiss_index_path:
+		get_legacy_store().remove_document(document.id, document.faiss_index_path)
+		return list(range(len(chunks)))
+	stored = get_vector_store().chunk_hashes(document.id)
+	return [i for i, chunk in enumerate(chunks) if chunk['id'] not in stored]
+
+
+def _write_index(document, chunks, new, vectors):
+	log('INFO', 'Embedded chunks', document_id=document.id, chunks=len(chunks), embedded=len(new), reused=len(chunks) - len(new))
+	with span('index_write'):
+		index_path = get_vector_store().update_document(document.id, document.user_id, chunks, dict(zip(new, vectors)))
+		build_keyword_index(document.id, chunks)
+	get_answer_cache().invalidate(document.id)
+	return index_path
+
+
+def build_index(document, chunks):
+	"""Embed new ``chunks`` and sync them into the vector and keyword indexes; returns the legacy index path, if any.
+
+	Chunks whose content id is already stored for the document (an unchanged part of a
+	replaced file) keep their vectors and are not embedded again.
+	"""
+	from .embeddings import get_embeddings
+
+	new = _unembedded(document, chunks)
+	with span('embed_documents'):
+		vectors = get_embeddings().embed_documents([chunks[i]['text'] for i in new]) if new else []
+	return _write_index(document, chunks, new, vectors)
+
+
+def save_chunks(document_id, chunks):
+	DocumentChunk.objects.filter(document_id=document_id).delete()
+	DocumentChunk.objects.bulk_create([
+		DocumentChunk(
+			document_id=document_id,
+			position=position,
+			content_hash=chunk['id'],
+			page=chunk['page'],
+			section=(chunk.get('section') or '')[:255],
+			text=chunk['text'],
+		)
+		for position, chunk in enumerate(chunks)
+	], batch_size=500)
+
+
+def reuse_index(document):
+	"""Point ``document`` at the indexes of a ready upload with the same content hash, if any.
+
+	Returns True when the document was linked (and is now ready) so ingestion can stop.
+	Only documents in the shared vector store are shared; legacy per-document indexes are not.
+	"""
+	if not document.content_hash:
+		return False
+	owner = (
+		Document.objects.filter(content_hash=document.content_hash, status=Document.Status.READY, index_owner__isnull=True)
+		.filter(Q(faiss_index_path__isnull=True) | Q(faiss_index_path=''))
+		.exclude(id=document.id).order_by('id').only('id', 'chunk_count').first()
+	)
+	if owner is None:
+		return False
+	if document.chunk_count:
+		# A replaced document that had indexes of its own no longer needs them.
+		discard_index(document)
+	updated = _update_document(
+		document.id, status=Document.Status.READY, error='', index_owner=owner, faiss_index_path=None, chunk_count=owner.chunk_count,
+	)
+	get_answer_cache().invalidate(document.id)
+	if updated:
+		DOCUMENTS_INGESTED.inc(status='reused')
+		log('INFO', 'Document shares an existing index', document_id=document.id, owner_id=owner.id)
+	return True
+
+
+def release_index(document):
+	"""Stop ``document`` from using shared indexes; returns True if its own indexes are now unused.
+
+	A document reading another's indexes just drops the link. A document whose indexes other
+	uploads share hands them, with its chunk rows, to the oldest of those, which becomes the
+	owner; only a document nobody shares with leaves indexes for the caller to remove.
+	"""
+	if document.index_owner_id:
+		_update_document(document.id, index_owner=None)
+		document.index_owner_id = None
+		return False
+	heir = Document.objects.filter(index_owner=document).order_by('id').only('id', 'user_id').first()
+	if heir is None:
+		return True
+	with transaction.atomic():
+		Document.objects.filter(index_owner=document).exclude(id=heir.id).update(index_owner=heir)
+		_update_document(heir.id, index_owner=None)
+		DocumentChunk.objects.filter(document_id=document.id).update(document=heir)
+		SuggestedQuestion.objects.filter(document_id=document.id).update(document=heir)
+	get_vector_store().reassign_document(document.id, heir.id, heir.user_id)
+	move_keyword_index(document.id, heir.id)
+	log('INFO', 'Shared index handed over', document_id=document.id, owner_id=heir.id)
+	return False
+
+
+def discard_index(document):
+	"""Remove a document's own vectors, keyword index, chunk rows and suggested questions."""
+	store_for(document).remove_document(document.id, document.faiss_index_path)
+	remove_keyword_index(document.id)
+	DocumentChunk.objects.filter(document_id=document.id).delete()
+	SuggestedQuestion.objects.filter(document_id=document.id).delete()
+
+
+def _iter_document_pages(document):
+	# Read straight from the stored upload when it is on local disk; no temp copy needed.
+	try:
+		path = document.file.path
+	except NotImplementedError:
+		path = None
+	if path:
+		yield from iter_pages(path, document.file.name)
+		return
+	with document.file.open('rb') as file_obj:
+		yield from iter_pages(file_obj, document.file.name)
+
+
+def _fail(document_id, error):
+	log('ERROR', 'Ingestion failed', document_id=document_id, error=error)
+	DOCUMENTS_INGESTED.inc(status='failed')
+	_update_document(document_id, status=Document.Status.FAILED, error=str(error))
+
+
+def run_ingestion(document_id, request_id=None):
+	"""Extract, chunk, embed and index one document, recording progress on ``Document.status``.
+
+	``request_id`` is the id of the upload request, so the job's log lines can be matched to it.
+	"""
+	close_old_connections()
+	with request_context(request_id):
+		try:
+			prepared = _prepare(document_id)
+			if prepared:
+				document, chunks = prepared
+				_finish(document, chunks, build_index(document, chunks))
+		except Exception as e:
+			_fail(document_id, e)
+		finally:
+			close_old_connections()
+
+
+def run_batch_ingestion(document_ids, request_id=None):
+	"""Ingest several documents with one embedding pass over all of their new chunks.
+
+	A document that fails extraction or indexing is marked failed on its own; if the shared
+	embedding call fails, each document is retried with its own call. Should the batch itself
+	fail, every document not finished by then is marked failed rather than left in progress.
+	"""
+	close_old_connections()
+	with request_context(request_id):
+		finished = set()
+		try:
+			batch = []
+			for document_id in document_ids:
+				try:
+					prepared = _prepare(document_id)
+					if prepared:
+						document, chunks = prepared
+						batch.append((document, chunks, _unembedded(document, chunks)))
+					else:
+						finished.add(document_id)
+				except Exception as e:
+					_fail(document_id, e)
+					finished.add(document_id)
+			vectors = _embed_batch(batch)
+			remaining = iter(vectors or [])
+			for document, chunks, new in batch:
+				try:
+					if vectors is None:
+						index_path = build_index(document, chunks)
+					else:
+						index_path = _write_index(document, chunks, new, [next(remaining) for _ in new])
+					_finish(document, chunks, index_path)
+				except Exception as e:
+					_fail(document.id, e)
+				finished.add(document.id)
+		except Exception as e:
+			for document_id in document_ids:
+				if document_id not in finished:
+					_fail(document_id, e)
+		finally:
+			close_old_connections()
+
+
+def _embed_batch(batch):
+	from .embeddings import get_embeddings
+
+	texts = [chunks[i]['text'] for _, chunks, new in batch for i in new]
+	if not texts:
+		return []
+	try:
+		with span('embed_documents'):
+			return get_embeddings().embed_documents(texts)
+	except Exception as e:
+		log('WARNING', 'Batched embedding failed, embedding documents one by one', documents=len(batch), error=e)
+		return None
+
+
+def _prepare(document_id):
+	"""Extract and chunk a document; returns ``(document, chunks)``, or None if it was deleted or shares an index."""
+	document = Document.objects.filter(id=document_id).first()
+	if document is None or reuse_index(document):
+		return None
+	_update_document(document_id, status=Document.Status.EXTRACTING, error='')
+	with span('extract'):
+		pages = list(_iter_document_pages(document))
+	if not any(page_text.strip() for _, page_text in pages):
+		raise ValueError('No text could be extracted from the document.')
+
+	_update_document(document_id, status=Document.Status.EMBEDDING)
+	with span('chunk'):
+		chunks = chunk_pages(pages)
+	return document, chunks
+
+
+def _finish(document, chunks, index_path):
+	# Suggestions are stored before the document is ready, so a replaced version never serves stale ones.
+	document.faiss_index_path = index_path
+	try:
+		with span('suggestions'):
+			build_suggestions(document, chunks)
+	except Exception as e:
+		# The document is usable without suggestions; questions then go through normal retrieval.
+		log('WARNING', 'Suggested questions failed', document_id=document.id, error=e)
+	with span('save_chunks'), transaction.atomic():
+		updated = _update_document(
+			document.id,
+			status=Document.Status.READY,
+			faiss_index_path=index_path,
+			chunk_count=len(chunks),
+		)
+		if updated:
+			save_chunks(document.id, chunks)
+	if not updated:
+		# The document was deleted while it was being indexed.
+		get_vector_store().remove_document(document.id, index_path)
+		remove_keyword_index(document.id)
+		return
+	DOCUMENTS_INGESTED.inc(status='ready')
+	log('INFO', 'Document ingested', document_id=document.id, chunks=len(chunks), spans=format_spans(current_spans()))
+
+
+def _init_process_worker():
+	import django
+	django.setup()
+
+
+class InProcessIngestionBackend:
+	"""Default backend: runs ingestion on a local thread or process pool, no broker required."""
+
+	def __init__(self, max_workers=2, use_processes=False):
+		if use_processes:
+			import multiprocessing
+			self._executor = ProcessPoolExecutor(
+				max_workers=max_workers,
+				mp_context=multiprocessing.get_context('spawn'),
+				initializer=_init_process_worker,
+			)
+		else:
+			self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ingestion')
+		self._pending = 0
+		self._lock = threading.Lock()
+
+	def submit(self, document_id):
+		return self._submit(1, run_ingestion, document_id, current_request_id())
+
+	def submit_many(self, document_ids):
+		"""Queue documents in groups of ``BULK_INGESTION_BATCH_SIZE``, each embedded in one pass."""
+		size = getattr(settings, 'BULK_INGESTION_BATCH_SIZE', 16)
+		return [
+			self._submit(len(group), run_batch_ingestion, group, current_request_id())
+			for group in (document_ids[i:i + size] for i in range(0, len(document_ids), size))
+		]
+
+	def _submit(self, count, func, *args):
+		with self._lock:
+			self._pending += count
+		future = self._executor.submit(func, *args)
+		future.add_done_callback(lambda _: self._done(count))
+		return future
+
+	def _done(self, count):
+		with self._lock:
+			self._pending -= count
+
+	def queue_depth(self):
+		with self._lock:
+			return self._pending
+
+
+class SyncIngestionBackend:
+	"""Runs ingestion inline in the calling thread; useful for tests and management commands."""
+
+	def __init__(self, **options):
+		pass
+
+	def submit(self, document_id):
+		run_ingestion(document_id, current_request_id())
+
+	def submit_many(self, document_ids):
+		run_batch_ingestion(document_ids, current_request_id())
+
+	def queue_depth(self):
+		return 0
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_ingestion_backend():
+	global _backend
+	if _backend is None:
+		with _backend_lock:
+			if _backend is None:
+				backend_class = import_string(getattr(settings, 'INGESTION_BACKEND', 'qa.ingestion.InProcessIngestionBackend'))
+				_backend = backend_class(**getattr(settings, 'INGESTION_BACKEND_OPTIONS', {}))
+	return _backend
+
+
+def enqueue_ingestion(document_id):
+	# Wait for the upload transaction so workers never see an uncommitted row.
+	transaction.on_commit(lambda: get_ingestion_backend().submit(document_id))
+
+
+def enqueue_ingestion_batch(document_ids):
+	"""Queue several documents; backends without ``submit_many`` get one job per document."""
+	def submit():
+		backend = get_ingestion_backend()
+		if hasattr(backend, 'submit_many'):
+			backend.submit_many(list(document_ids))
+		else:
+			for document_id in document_ids:
+				backend.submit(document_id)
+	transaction.on_commit(submit)
@@ -0,0 +1,199 @@
+import math
+import os
+import re
+import shutil
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+
+from .index_cache import get_index_cache
+from .metrics import log
+
+
+_WORD = re.compile(r'\w+(?:[-./]\w+)*')
+_SEPARATOR = re.compile(r'[-./]')
+STOPWORDS = frozenset(
+	'a an and are as at be but by can did do does for from had has have how i if in into is it its '
+	'me my not of on or our so than that the their them then there these they this to was we were '
+	'what when where which who whom why will with you your'.split()
+)
+
+
+def tokenize(text):
+	"""Lowercased non-stopword terms; identifiers like ``INV-2024-07`` or ``4.2.1`` are kept whole and also split."""
+	tokens = []
+	for match in _WORD.finditer(text.lower()):
+		word = match.group()
+		if word not in STOPWORDS:
+			tokens.append(word)
+		if _SEPARATOR.search(word):
+			tokens.extend(part for part in _SEPARATOR.split(word) if part and part not in STOPWORDS)
+	return tokens
+
+
+class KeywordIndex:
+	"""BM25 over one document's chunks, held in flat numpy arrays.
+
+	The postings of term ``i`` are ``chunk_ids[offsets[i]:offsets[i + 1]]`` with matching term
+	frequencies in ``freqs``; chunk texts are one UTF-8 blob sliced by ``text_offsets``.
+	"""
+
+	k1 = 1.5
+	b = 0.75
+
+	def __init__(self, terms, offsets, chunk_ids, freqs, lengths, pages, text_blob, text_offsets):
+		self.terms = terms
+		self.vocabulary = {term: i for i, term in enumerate(terms)}
+		self.offsets = offsets
+		self.chunk_ids = chunk_ids
+		self.freqs = freqs
+		self.lengths = lengths
+		self.pages = pages
+		self.text_blob = text_blob
+		self.text_offsets = text_offsets
+		self.avg_length = float(lengths.mean()) if len(lengths) else 0.0
+
+	@classmethod
+	def build(cls, chunks):
+		postings = {}
+		lengths = []
+		for chunk_id, chunk in enumerate(chunks):
+			tokens = tokenize(chunk['text'])
+			lengths.append(len(tokens))
+			for term, count in Counter(tokens).items():
+				postings.setdefault(term, []).append((chunk_id, count))
+
+		terms = sorted(postings)
+		offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+		chunk_ids, freqs = [], []
+		for i, term in enumerate(terms):
+			for chunk_id, count in postings[term]:
+				chunk_ids.append(chunk_id)
+				freqs.append(min(count, np.iinfo(np.uint16).max))
+			offsets[i + 1] = len(chunk_ids)
+
+		encoded = [chunk['text'].encode('utf-8') for chunk in chunks]
+		return cls(
+			terms,
+			offsets,
+			np.array(chunk_ids, dtype=np.int32),
+			np.array(freqs, dtype=np.uint16),
+			np.array(lengths, dtype=np.int32),
+			np.array([chunk.get('page') or 0 for chunk in chunks], dtype=np.int32),
+			b''.join(encoded),
+			np.cumsum([0] + [len(text) for text in encoded], dtype=np.int64),
+		)
+
+	def save(self, path):
+		os.makedirs(path, exist_ok=True)
+		tmp_path = os.path.join(path, 'bm25.tmp.npz')
+		np.savez(
+			tmp_path,
+			terms=np.frombuffer('\n'.join(self.terms).encode('utf-8'), dtype=np.uint8),
+			offsets=self.offsets,
+			chunk_ids=self.chunk_ids,
+			freqs=self.freqs,
+			lengths=self.lengths,
+			pages=self.pages,
+			texts=np.frombuffer(self.text_blob, dtype=np.uint8),
+			text_offsets=self.text_offsets,
+		)
+		os.replace(tmp_path, os.path.join(path, 'bm25.npz'))
+
+	@classmethod
+	def load(cls, path):
+		with np.load(os.path.join(path, 'bm25.npz')) as data:
+			terms = data['terms'].tobytes().decode('utf-8')
+			return cls(
+				terms.split('\n') if terms else [],
+				data['offsets'],
+				data['chunk_ids'],
+				data['freqs'],
+				data['lengths'],
+				data['pages'],
+				data['texts'].tobytes(),
+				data['text_offsets'],
+			)
+
+	def search(self, query, k):
+		"""Return ``(hits, confidence)``; hits are ``(chunk_id, score)`` best first.
+
+		``confidence`` (0-1) compares the best score with a chunk containing every query term
+		once; query terms missing from the document count as unmatched rare terms, so only
+		keyword-like queries that the document fully covers score near 1.
+		"""
+		count = len(self.lengths)
+		scores = np.zeros(count, dtype=np.float32)
+		ideal = 0.0
+		for term in set(tokenize(query)):
+			i = self.vocabulary.get(term)
+			frequency = int(self.offsets[i + 1] - self.offsets[i]) if i is not None else 0
+			idf = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+			ideal += idf
+			if not frequency:
+				continue
+			ids = self.chunk_ids[self.offsets[i]:self.offsets[i + 1]]
+			tf = self.freqs[self.offsets[i]:self.offsets[i + 1]].astype(np.float32)
+			norm = self.k1 * (1 - self.b + self.b * self.lengths[ids] / self.avg_length)
+			scores[ids] += idf * tf * (self.k1 + 1) / (tf + norm)
+		if not count or not ideal:
+			return [], 0.0
+		k = min(k, count)
+		top = np.argpartition(-scores, k - 1)[:k]
+		top = top[np.argsort(-scores[top])]
+		hits = [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+		return hits, (min(1.0, hits[0][1] / ideal) if hits else 0.0)
+
+	def chunk(self, chunk_id, document_id):
+		from langchain_core.documents import Document as LangchainDocument
+		text = self.text_blob[self.text_offsets[chunk_id]:self.text_offsets[chunk_id + 1]].decode('utf-8')
+		page = int(self.pages[chunk_id]) or None
+		return LangchainDocument(page_content=text, metadata={'document_id': document_id, 'chunk_id': chunk_id, 'page': page})
+
+
+def keyword_index_path(document_id):
+	return os.path.join(str(getattr(settings, 'KEYWORD_INDEX_ROOT', 'keyword_indexes')), f"document_{document_id}")
+
+
+def build_keyword_index(document_id, chunks):
+	KeywordIndex.build(chunks).save(keyword_index_path(document_id))
+	get_index_cache().invalidate(('bm25', document_id))
+
+
+def remove_keyword_index(document_id):
+	get_index_cache().invalidate(('bm25', document_id))
+	path = keyword_index_path(document_id)
+	if os.path.exists(path):
+		try:
+			shutil.rmtree(path)
+		except OSError as e:
+			log('ERROR', 'Failed to remove keyword index', path=path, error=e)
+
+
+def move_keyword_index(document_id, new_document_id):
+	"""Re-key a document's keyword index, e.g. when a shared index changes owner."""
+	path = keyword_index_path(document_id)
+	if os.path.exists(path):
+		os.replace(path, keyword_index_path(new_document_id))
+	get_index_cache().invalidate(('bm25', document_id))
+
+
+def keyword_search(documents, question, k):
+	"""BM25 search over each document's keyword index; returns ``([(chunk, score)], confidence)``.
+
+	Documents indexed before keyword indexes existed have none until
+	``manage.py build_keyword_indexes`` runs, and only contribute vector results.
+	"""
+	results = []
+	confidence = 0.0
+	for document in documents:
+		path = keyword_index_path(document.index_id)
+		if not os.path.exists(os.path.join(path, 'bm25.npz')):
+			continue
+		index = get_index_cache().get(('bm25', document.index_id), path, KeywordIndex.load)
+		hits, document_confidence = index.search(question, k)
+		confidence = max(confidence, document_confidence)
+		results.extend((index.chunk(chunk_id, document.index_id), score) for chunk_id, score in hits)
+	results.sort(key=lambda item: item[1], reverse=True)
+	return results[:k], confidence
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import re
+import time
+
+from django.conf import settings
+
+
+_TOKEN = re.compile(r'\S+\s*')
+
+
+def gemini_llm(model):
+	from langchain_google_genai import ChatGoogleGenerativeAI
+	return ChatGoogleGenerativeAI(model=model, google_api_key=os.getenv("GEMINI_API_KEY"))
+
+
+class FakeChatModel:
+	"""Deterministic local chat model for tests and benchmarks.
+
+	Answers quote the start of the first context passage in the prompt, after ``latency``
+	seconds to the first token and ``token_latency`` seconds per further token, so streaming
+	and non-streaming paths cost what a remote model would without any network calls.
+	"""
+
+	def __init__(self, model='fake', latency=0.0, token_latency=0.0, answer_words=40):
+		self.model = model
+		self.latency = latency
+		self.token_latency = token_latency
+		self.answer_words = answer_words
+		self.calls = 0
+
+	def _tokens(self, prompt):
+		self.calls += 1
+		_, found, context = prompt.partition("Document Context:\n")
+		if not found:
+			return _TOKEN.findall("Please upload a document first so I can answer questions about it.")
+		passage = context.split("\n---\n", 1)[0].split("\n\nChat History:", 1)[0]
+		words = passage.split()[:self.answer_words]
+		return _TOKEN.findall(' '.join(["According", "to", "the", "document:"] + words))
+
+	def _delay(self, tokens):
+		return self.latency + self.token_latency * max(len(tokens) - 1, 0)
+
+	def invoke(self, prompt):
+		from langchain_core.messages import AIMessage
+		tokens = self._tokens(prompt)
+		time.sleep(self._delay(tokens))
+		return AIMessage(content=''.join(tokens))
+
+	async def ainvoke(self, prompt):
+		from langchain_core.messages import AIMessage
+		tokens = self._tokens(prompt)
+		await asyncio.sleep(self._delay(tokens))
+		return AIMessage(content=''.join(tokens))
+
+	async def astream(self, prompt):
+		from langchain_core.messages import AIMessageChunk
+		tokens = self._tokens(prompt)
+		await asyncio.sleep(self.latency)
+		for i, token in enumerate(tokens):
+			if i and self.token_latency:
+				await asyncio.sleep(self.token_latency)
+			yield AIMessageChunk(content=token)
+
+
+def fake_llm(model):
+	return FakeChatModel(
+		model=model,
+		latency=getattr(settings, 'FAKE_LLM_LATENCY', 0.0),
+		token_latency=getattr(settings, 'FAKE_LLM_TOKEN_LATENCY', 0.0),
+	)
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from qa.answering import document_not_ready_error
+from qa.batch import run_batch
+from qa.models import Document
+
+
+def read_questions(path):
+	"""Questions from a JSON list, JSON lines with a ``question`` key, or plain lines ('-' reads stdin)."""
+	text = sys.stdin.read() if path == '-' else open(path, encoding='utf-8').read()
+	if text.lstrip().startswith('['):
+		return [str(question) for question in json.loads(text)]
+	questions = []
+	for line in text.splitlines():
+		line = line.strip()
+		if not line:
+			continue
+		questions.append(json.loads(line)['question'] if line.startswith('{') else line)
+	return questions
+
+
+class Command(BaseCommand):
+	help = (
+		"Answer a list of questions about documents (e.g. a compliance checklist) and write one JSON "
+		"line per question. --retrieve-only writes the ranked chunks and scores without calling the LLM."
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--document', type=int, action='append', required=True, help="Document id; repeat for several.")
+		parser.add_argument('--questions', required=True, help="File of questions: JSON list, JSON lines or one per line ('-' for stdin).")
+		parser.add_argument('--retrieve-only', action='store_true')
+		parser.add_argument('-k', type=int, default=5, help="Chunks retrieved per question.")
+		parser.add_argument('--concurrency', type=int, help="Override BATCH_QA_MAX_CONCURRENCY.")
+		parser.add_argument('--rate', type=float, help="Override BATCH_QA_REQUESTS_PER_SECOND.")
+		parser.add_argument('--output', help="Write JSON lines here instead of stdout.")
+
+	def handle(self, *args, **options):
+		documents = list(Document.objects.filter(id__in=options['document']).order_by('id'))
+		missing = set(options['document']) - {document.id for document in documents}
+		if missing:
+			raise CommandError(f"Documents not found: {', '.join(map(str, sorted(missing)))}")
+		for document in documents:
+			error = document_not_ready_error(document)
+			if error:
+				raise CommandError(f"Document {document.id}: {error['error']}")
+		questions = read_questions(options['questions'])
+		if not questions:
+			raise CommandError("No questions given.")
+
+		output = open(options['output'], 'w', encoding='utf-8') if options['output'] else self.stdout
+		try:
+			failed = asyncio.run(self.run(documents, questions, options, output))
+		finally:
+			if options['output']:
+				output.close()
+		self.stderr.write(f"Answered {len(questions) - failed} of {len(questions)} questions.")
+
+	async def run(self, documents, questions, options, output):
+		failed = 0
+		batch = run_batch(
+			documents, questions, k=options['k'], retrieve_only=options['retrieve_only'],
+			concurrency=options['concurrency'], rate=options['rate'],
+		)
+		async for result in batch:
+			failed += 'error' in result
+			output.write(json.dumps(result) + '\n')
+		return failed
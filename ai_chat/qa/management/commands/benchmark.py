@@ -0,0 +1,127 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from qa.benchmark import FORMATS, SIZES, Benchmark, compare, generate_corpus, results
+
+
+class Command(BaseCommand):
+	help = (
+		"Run the upload, QA and history load scenarios end to end against a throwaway test database, "
+		"with fake chat and embedding models, and report latency percentiles, throughput and peak RSS per stage."
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--users', type=int, default=4)
+		parser.add_argument('--documents', type=int, default=12, help="Generated documents, spread across users.")
+		parser.add_argument('--sizes', default='small,medium,large', help=f"Comma-separated, from {', '.join(SIZES)}.")
+		parser.add_argument('--formats', default=','.join(FORMATS))
+		parser.add_argument('--followups', type=int, default=5, help="Questions per conversation burst.")
+		parser.add_argument('--concurrency', type=int, default=8, help="Maximum requests in flight.")
+		parser.add_argument('--ingest-workers', type=int, default=2)
+		parser.add_argument('--llm-latency', type=float, default=0.2, help="Fake model seconds to first token.")
+		parser.add_argument('--token-latency', type=float, default=0.005, help="Fake model seconds per further token.")
+		parser.add_argument('--embedding-latency', type=float, default=0.05, help="Fake embedding seconds per call.")
+		parser.add_argument('--seed', type=int, default=0)
+		parser.add_argument('--output', help="Write results as JSON to this file.")
+		parser.add_argument('--compare', help="Compare against a previous JSON results file.")
+		parser.add_argument('--fail-threshold', type=float, help="Exit with an error if any metric regresses by more than this percent.")
+
+	def handle(self, *args, **options):
+		sizes = [size for size in options['sizes'].split(',') if size]
+		formats = [file_format for file_format in options['formats'].split(',') if file_format]
+		unknown = set(sizes) - set(SIZES) | set(formats) - set(FORMATS)
+		if unknown:
+			raise CommandError(f"Unknown sizes or formats: {', '.join(sorted(unknown))}")
+
+		workdir = tempfile.mkdtemp(prefix='qa-benchmark-')
+		try:
+			corpus = generate_corpus(os.path.join(workdir, 'corpus'), options['documents'], sizes, formats, options['seed'])
+			with override_settings(**self.benchmark_settings(workdir, options)):
+				stages = self.run_scenarios(corpus, workdir, options)
+		finally:
+			shutil.rmtree(workdir, ignore_errors=True)
+
+		config = {
+			key: options[key] for key in (
+				'users', 'documents', 'followups', 'concurrency', 'ingest_workers',
+				'llm_latency', 'token_latency', 'embedding_latency', 'seed',
+			)
+		}
+		config.update(sizes=sizes, formats=formats)
+		report = results(stages, config)
+		self.print_stages(stages)
+		if options['output']:
+			with open(options['output'], 'w') as f:
+				json.dump(report, f, indent=2)
+			self.stdout.write(f"Results written to {options['output']}")
+		if options['compare']:
+			self.print_comparison(options['compare'], report, options['fail_threshold'])
+
+	def benchmark_settings(self, workdir, options):
+		return {
+			'MEDIA_ROOT': os.path.join(workdir, 'media'),
+			'VECTOR_STORE_OPTIONS': {**getattr(settings, 'VECTOR_STORE_OPTIONS', {}), 'root': os.path.join(workdir, 'vectors')},
+			'KEYWORD_INDEX_ROOT': os.path.join(workdir, 'keyword_indexes'),
+			'EMBEDDING_CACHE_PATH': None,
+			'EMBEDDING_PROVIDER': 'qa.embeddings.fake_embeddings',
+			'FAKE_EMBEDDING_LATENCY': options['embedding_latency'],
+			'LLM_PROVIDER': 'qa.llm.fake_llm',
+			'FAKE_LLM_LATENCY': options['llm_latency'],
+			'FAKE_LLM_TOKEN_LATENCY': options['token_latency'],
+			'INGESTION_BACKEND': 'qa.ingestion.InProcessIngestionBackend',
+			'INGESTION_BACKEND_OPTIONS': {'max_workers': options['ingest_workers']},
+		}
+
+	def run_scenarios(self, corpus, workdir, options):
+		# A file-backed sqlite test database, so ingestion threads and request handlers share it.
+		if connection.vendor == 'sqlite':
+			connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(workdir, 'benchmark.sqlite3')
+		setup_test_environment()
+		old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+		try:
+			benchmark = Benchmark(
+				corpus,
+				users=options['users'],
+				concurrency=options['concurrency'],
+				followups=options['followups'],
+				seed=options['seed'],
+			)
+			return asyncio.run(benchmark.run())
+		finally:
+			connection.creation.destroy_test_db(old_name, verbosity=0)
+			teardown_test_environment()
+
+	def print_stages(self, stages):
+		header = f"{'stage':<24}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>9}{'peak MB':>9}"
+		self.stdout.write(header)
+		for name, stats in stages.items():
+			self.stdout.write(
+				f"{name:<24}{stats['count']:>7}{stats['errors']:>8}{_cell(stats['p50_ms'])}{_cell(stats['p95_ms'])}"
+				f"{_cell(stats['p99_ms'])}{_cell(stats['throughput_per_s'], 9)}{_cell(stats['peak_rss_mb'], 9)}"
+			)
+
+	def print_comparison(self, path, report, threshold):
+		with open(path) as f:
+			baseline = json.load(f)
+		rows = compare(baseline, report, threshold if threshold is not None else 10.0)
+		self.stdout.write(f"\nCompared with {baseline.get('commit') or path}:")
+		if baseline.get('config') != report['config']:
+			self.stderr.write("Warning: the runs used different configurations; differences may not be regressions.")
+		for stage, metric, old, new, change, regressed in rows:
+			marker = '  REGRESSION' if regressed else ''
+			self.stdout.write(f"{stage:<24}{metric:<18}{old:>12}{new:>12}{change:>+9.1f}%{marker}")
+		regressions = [row for row in rows if row[-1]]
+		if threshold is not None and regressions:
+			raise CommandError(f"{len(regressions)} metrics regressed by more than {threshold}%")
+
+
+def _cell(value, width=10):
+	return f"{'-' if value is None else value:>{width}}"
@@ -0,0 +1,28 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from qa.keyword_index import build_keyword_index, keyword_index_path
+from qa.models import Document, DocumentChunk
+
+
+class Command(BaseCommand):
+	help = "Build BM25 keyword indexes from the stored chunks of ready documents that do not have one yet."
+
+	def add_arguments(self, parser):
+		parser.add_argument('--rebuild', action='store_true', help="Rebuild indexes that already exist.")
+
+	def handle(self, *args, **options):
+		built = skipped = 0
+		documents = Document.objects.filter(status=Document.Status.READY, index_owner__isnull=True).only('id')
+		for document in documents.iterator():
+			if not options['rebuild'] and os.path.exists(os.path.join(keyword_index_path(document.id), 'bm25.npz')):
+				continue
+			chunks = [row.as_chunk() for row in DocumentChunk.objects.filter(document_id=document.id).order_by('position')]
+			if not chunks:
+				self.stderr.write(f"Document {document.id}: no stored chunks, skipped")
+				skipped += 1
+				continue
+			build_keyword_index(document.id, chunks)
+			built += 1
+		self.stdout.write(self.style.SUCCESS(f"Built {built} keyword indexes, skipped {skipped}."))
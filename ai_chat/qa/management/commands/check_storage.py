@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from qa.storage_check import StorageCheck
+
+
+class Command(BaseCommand):
+	help = (
+		"Reconcile uploads, vector and keyword indexes with the document rows: remove files and index "
+		"data no document owns, re-ingest ready documents whose vectors are missing and rebuild missing keyword indexes."
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--dry-run', action='store_true', help="Only report what would be removed or rebuilt.")
+		parser.add_argument('--no-rebuild', action='store_true', help="Report documents with missing indexes instead of rebuilding them.")
+		parser.add_argument('--min-age', type=int, help="Keep unreferenced uploads younger than this many seconds (default STORAGE_CHECK_MIN_AGE).")
+		parser.add_argument('--batch-size', type=int, default=500)
+
+	def handle(self, *args, **options):
+		check = StorageCheck(
+			dry_run=options['dry_run'], rebuild=not options['no_rebuild'],
+			min_age=options['min_age'], batch_size=options['batch_size'],
+		)
+		for finding in check.run():
+			size = f" ({filesizeformat(finding['bytes'])})" if finding['bytes'] else ''
+			self.stdout.write(f"{finding['check']}: {finding['action']} {finding['target']}{size}")
+		counts = ', '.join(f"{count} {check_name}" for check_name, count in sorted(check.counts.items())) or 'nothing to fix'
+		verb = 'Would reclaim' if check.dry_run else 'Reclaimed'
+		self.stdout.write(self.style.SUCCESS(f"{counts}. {verb} {filesizeformat(check.reclaimed)}."))
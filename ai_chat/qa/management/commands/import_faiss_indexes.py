@@ -0,0 +1,53 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from qa.chunking import assign_ids
+from qa.ingestion import save_chunks
+from qa.models import Document
+from qa.vector_store import PerDocumentFaissStore, get_legacy_store, get_vector_store
+
+
+class Command(BaseCommand):
+	help = "Import per-document FAISS directories into the shared vector store, reusing their stored vectors."
+
+	def add_arguments(self, parser):
+		parser.add_argument('--keep', action='store_true', help="Keep the legacy index directories after importing.")
+		parser.add_argument('--optimize', action='store_true', help="Rebuild every shard afterwards (flat or IVF by size).")
+
+	def handle(self, *args, **options):
+		store = get_vector_store()
+		if isinstance(store, PerDocumentFaissStore):
+			self.stderr.write("VECTOR_STORE_BACKEND is the per-document store; nothing to import into.")
+			return
+
+		legacy = get_legacy_store()
+		imported = skipped = vectors = 0
+		documents = Document.objects.exclude(faiss_index_path__isnull=True).exclude(faiss_index_path='')
+		for document in documents.only('id', 'user_id', 'faiss_index_path').iterator():
+			if not os.path.isdir(document.faiss_index_path):
+				self.stderr.write(f"Document {document.id}: index {document.faiss_index_path} is missing, skipped")
+				skipped += 1
+				continue
+			vectorstore = legacy.load(document.id, document.faiss_index_path)
+			index = vectorstore.index
+			chunks = []
+			for position in range(index.ntotal):
+				chunk = vectorstore.docstore.search(vectorstore.index_to_docstore_id[position])
+				chunks.append({'text': chunk.page_content, 'page': chunk.metadata.get('page')})
+			assign_ids(chunks)
+			store.add_document(document.id, document.user_id, chunks, index.reconstruct_n(0, index.ntotal))
+			with transaction.atomic():
+				Document.objects.filter(id=document.id).update(faiss_index_path=None, chunk_count=len(chunks))
+				save_chunks(document.id, chunks)
+			if not options['keep']:
+				legacy.remove_document(document.id, document.faiss_index_path)
+			imported += 1
+			vectors += index.ntotal
+			self.stdout.write(f"Document {document.id}: imported {index.ntotal} chunks")
+
+		if options['optimize']:
+			for shard in range(store.shards):
+				store.optimize_shard(shard)
+		self.stdout.write(self.style.SUCCESS(f"Imported {imported} documents ({vectors} vectors), skipped {skipped}."))
@@ -0,0 +1,70 @@
+import faiss
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from qa.models import Document
+from qa.vector_store import ShardedFaissStore, describe_index, get_vector_store
+
+
+def recall_at_k(index, queries, expected, k, nprobe):
+	if isinstance(index, faiss.IndexIVF):
+		_, found = index.search(queries, k, params=faiss.SearchParametersIVF(nprobe=nprobe))
+	else:
+		_, found = index.search(queries, k)
+	return float(np.mean([len(set(row) & set(truth)) / len(truth) for row, truth in zip(found, expected)]))
+
+
+class Command(BaseCommand):
+	help = (
+		"Rebuild the shared vector store shards in the configured index format (or --quantization), "
+		"reporting each shard's size and recall@k against exact search before and after."
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--quantization', choices=['none', 'sq8', 'pq'], help="Override VECTOR_STORE_OPTIONS['quantization'].")
+		parser.add_argument('--queries', type=int, default=200, help="Sampled stored vectors used as recall queries.")
+		parser.add_argument('-k', type=int, default=5)
+		parser.add_argument('--dry-run', action='store_true', help="Measure only; keep the current shards.")
+
+	def handle(self, *args, **options):
+		store = get_vector_store()
+		if not isinstance(store, ShardedFaissStore):
+			raise CommandError("VECTOR_STORE_BACKEND is not the sharded store; nothing to rebuild.")
+		legacy = Document.objects.exclude(faiss_index_path__isnull=True).exclude(faiss_index_path='').count()
+		if legacy:
+			self.stderr.write(f"{legacy} documents still use per-document indexes; run import_faiss_indexes to include them.")
+
+		quantization = None if options['quantization'] is None else ('' if options['quantization'] == 'none' else options['quantization'])
+		rng = np.random.default_rng(0)
+		total_before = total_after = 0
+		for shard in range(store.shards):
+			index, ids, vectors = store.shard_contents(shard)
+			if index is None or not len(ids):
+				continue
+			rebuilt = store.optimize_shard(shard, quantization=quantization, save=not options['dry_run'])
+
+			# Queries are stored vectors with a little noise; the truth is exact search over the same vectors.
+			sample = vectors[rng.choice(len(vectors), min(options['queries'], len(vectors)), replace=False)]
+			queries = (sample + rng.normal(scale=0.01, size=sample.shape)).astype(np.float32)
+			faiss.normalize_L2(queries)
+			k = min(options['k'], len(ids))
+			exact = faiss.IndexFlatIP(vectors.shape[1])
+			exact.add(vectors)
+			_, positions = exact.search(queries, k)
+			expected = ids[positions]
+
+			before = len(faiss.serialize_index(index))
+			after = len(faiss.serialize_index(rebuilt))
+			total_before += before
+			total_after += after
+			self.stdout.write(
+				f"Shard {shard}: {len(ids)} vectors, {describe_index(index)} -> {describe_index(rebuilt)}, "
+				f"{before / 2 ** 20:.1f} MB -> {after / 2 ** 20:.1f} MB, "
+				f"recall@{k} {recall_at_k(index, queries, expected, k, store.nprobe):.3f} -> "
+				f"{recall_at_k(rebuilt, queries, expected, k, store.nprobe):.3f}"
+			)
+		saved = total_before - total_after
+		verb = "Would save" if options['dry_run'] else "Saved"
+		self.stdout.write(self.style.SUCCESS(
+			f"{verb} {saved / 2 ** 20:.1f} MB of index memory ({total_before / 2 ** 20:.1f} MB -> {total_after / 2 ** 20:.1f} MB)."
+		))
@@ -0,0 +1,241 @@
+"""In-process metrics and request tracing, rendered in the Prometheus text format at ``/metrics``.
+
+Histograms and counters live in this process only; under several ASGI workers each worker
+serves its own numbers, so scrape every worker (or run one). Cache, index and queue
+gauges are read from the existing ``stats()`` helpers at scrape time and cost nothing otherwise.
+"""
+import bisect
+import contextvars
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+# Stage name -> seconds for the request (or ingestion job) being handled.
+_spans = contextvars.ContextVar('spans', default=None)
+_VALID_REQUEST_ID = re.compile(r'^[\w.-]{1,64}$')
+
+
+def metrics_enabled():
+	return getattr(settings, 'METRICS_ENABLED', False)
+
+
+def _escape(value):
+	return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+	pairs = list(zip(names, values)) + list(extra)
+	if not pairs:
+		return ''
+	return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+	kind = 'counter'
+
+	def __init__(self, name, documentation, labelnames=()):
+		self.name = name
+		self.documentation = documentation
+		self.labelnames = tuple(labelnames)
+		self._values = {}
+		self._lock = threading.Lock()
+		REGISTRY.append(self)
+
+	def inc(self, amount=1, **labels):
+		if not metrics_enabled():
+			return
+		key = tuple(str(labels[name]) for name in self.labelnames)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + amount
+
+	def value(self, **labels):
+		return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+	def samples(self):
+		with self._lock:
+			return [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+	kind = 'histogram'
+
+	def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+		self.name = name
+		self.documentation = documentation
+		self.labelnames = tuple(labelnames)
+		self.buckets = tuple(buckets)
+		self._values = {}
+		self._lock = threading.Lock()
+		REGISTRY.append(self)
+
+	def observe(self, value, **labels):
+		if not metrics_enabled():
+			return
+		key = tuple(str(labels[name]) for name in self.labelnames)
+		index = bisect.bisect_left(self.buckets, value)
+		with self._lock:
+			entry = self._values.get(key)
+			if entry is None:
+				entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+			entry[0][index] += 1
+			entry[1] += value
+			entry[2] += 1
+
+	def count(self, **labels):
+		entry = self._values.get(tuple(str(labels[name]) for name in self.labelnames))
+		return entry[2] if entry else 0
+
+	def samples(self):
+		lines = []
+		with self._lock:
+			for key, (counts, total, count) in sorted(self._values.items()):
+				cumulative = 0
+				for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+					cumulative += bucket_count
+					le = '+Inf' if bound == float('inf') else repr(bound)
+					lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', le)])} {cumulative}")
+				lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+				lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+		return lines
+
+
+REGISTRY = []
+
+REQUEST_SECONDS = Histogram('qa_http_request_duration_seconds', 'HTTP request latency by view.', ('view', 'method', 'status'))
+STAGE_SECONDS = Histogram('qa_stage_duration_seconds', 'Time spent in each traced stage of a request or ingestion job.', ('stage',))
+LLM_TOKENS = Counter('qa_llm_tokens_total', 'Approximate chat model tokens sent and received.', ('kind',))
+EMBEDDING_TOKENS = Counter('qa_embedding_tokens_total', 'Approximate tokens sent to the embedding provider.')
+EMBEDDING_TEXTS = Counter('qa_embedding_texts_total', 'Texts embedded, by whether the vector came from the cache or the provider.', ('source',))
+DOCUMENTS_INGESTED = Counter('qa_documents_ingested_total', 'Finished ingestion jobs by outcome.', ('status',))
+NOT_FOUND_EARLY_EXITS = Counter('qa_not_found_early_exits_total', 'Questions answered as not found without an LLM call because no chunk passed the rerank cutoff.')
+
+
+def current_request_id():
+	return _request_id.get()
+
+
+@contextmanager
+def request_context(request_id=None):
+	"""Bind a request id (generated if not given) and a fresh span record to the current context."""
+	request_id = request_id or uuid.uuid4().hex[:16]
+	id_token = _request_id.set(request_id)
+	spans_token = _spans.set({})
+	try:
+		yield request_id
+	finally:
+		_spans.reset(spans_token)
+		_request_id.reset(id_token)
+
+
+def request_id_from_header(value):
+	return value if value and _VALID_REQUEST_ID.match(value) else None
+
+
+def current_spans():
+	return _spans.get() or {}
+
+
+@contextmanager
+def span(stage):
+	"""Time a stage into ``qa_stage_duration_seconds`` and the current request's span record."""
+	if not metrics_enabled():
+		yield
+		return
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		observe_stage(stage, time.perf_counter() - start)
+
+
+def observe_stage(stage, seconds):
+	if not metrics_enabled():
+		return
+	STAGE_SECONDS.observe(seconds, stage=stage)
+	spans = _spans.get()
+	if spans is not None:
+		spans[stage] = spans.get(stage, 0.0) + seconds
+
+
+def format_spans(spans):
+	return ','.join(f"{stage}:{seconds * 1000:.1f}ms" for stage, seconds in spans.items())
+
+
+def _format_field(value):
+	if isinstance(value, float):
+		value = round(value, 3)
+	text = str(value)
+	return json.dumps(text) if not text or re.search(r'[\s"=]', text) else text
+
+
+class KeyValueFormatter(logging.Formatter):
+	"""Formats records as ``[LEVEL] message key=value ...`` from the ``fields`` passed to ``log()``."""
+
+	def format(self, record):
+		fields = getattr(record, 'fields', None) or {}
+		suffix = ' '.join(f"{key}={_format_field(value)}" for key, value in fields.items())
+		line = f"[{record.levelname}] {record.getMessage()}" + (f" {suffix}" if suffix else '')
+		if record.exc_info:
+			line += '\n' + self.formatException(record.exc_info)
+		return line
+
+
+def log(level, message, **fields):
+	"""Log ``message`` at ``level`` (a level name) with ``fields`` and the current request id as ``extra``."""
+	request_id = _request_id.get()
+	if request_id:
+		fields = {'request_id': request_id, **fields}
+	logger.log(logging.getLevelName(level), message, extra={'fields': fields})
+
+
+def _gauge(name, documentation, samples, kind='gauge'):
+	lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+	lines.extend(f"{name}{labels} {value}" for labels, value in samples)
+	return lines
+
+
+def _collect_stats():
+	"""Scrape-time gauges from the caches, vector store and ingestion queue."""
+	from .answer_cache import get_answer_cache
+	from .history import get_history_writer
+	from .index_cache import get_index_cache
+	from .ingestion import get_ingestion_backend
+	from .vector_store import get_vector_store
+
+	lines = []
+	for prefix, stats in (('qa_index_cache', get_index_cache().stats()), ('qa_answer_cache', get_answer_cache().stats())):
+		hits = stats.get('hits', stats.get('exact_hits', 0) + stats.get('semantic_hits', 0))
+		lines += _gauge(f"{prefix}_entries", 'Entries currently cached.', [('', stats['entries'])])
+		lines += _gauge(f"{prefix}_hits_total", 'Cache hits.', [('', hits)], 'counter')
+		lines += _gauge(f"{prefix}_misses_total", 'Cache misses.', [('', stats['misses'])], 'counter')
+		lines += _gauge(f"{prefix}_hit_ratio", 'Hits over lookups since start.', [('', stats['hit_rate'])])
+	lines += _gauge('qa_index_cache_bytes', 'Approximate bytes of loaded indexes.', [('', get_index_cache().stats()['bytes'])])
+
+	shards = get_vector_store().stats().get('shards', [])
+	lines += _gauge('qa_vector_store_vectors', 'Vectors per shard.', [(_labels(('shard',), (s['shard'],)), s['vectors']) for s in shards])
+	lines += _gauge('qa_vector_store_bytes', 'Shard file size.', [(_labels(('shard',), (s['shard'],)), s['bytes']) for s in shards])
+	lines += _gauge('qa_ingestion_queue_depth', 'Documents queued or being ingested.', [('', get_ingestion_backend().queue_depth())])
+	lines += _gauge('qa_chat_history_pending', 'Chat history rows waiting for a write-behind insert.', [('', get_history_writer().pending())])
+	return lines
+
+
+def render():
+	lines = []
+	for metric in REGISTRY:
+		lines.append(f"# HELP {metric.name} {metric.documentation}")
+		lines.append(f"# TYPE {metric.name} {metric.kind}")
+		lines.extend(metric.samples())
+	lines.extend(_collect_stats())
+	return '\n'.join(lines) + '\n'
@@ -0,0 +1,89 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+from .db_router import EXEMPT_VIEWS, replica_reads
+from .metrics import REQUEST_SECONDS, current_spans, format_spans, log, metrics_enabled, request_context, request_id_from_header
+
+
+class RequestMetricsMiddleware:
+	"""Give every request an id (``X-Request-ID`` if the client sent a valid one), time it and log it.
+
+	The id is echoed in the response header and attached to log lines written while the
+	request is handled, together with the time spent in each traced stage.
+	"""
+
+	sync_capable = True
+	async_capable = True
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+		self.async_mode = iscoroutinefunction(get_response)
+		if self.async_mode:
+			markcoroutinefunction(self)
+
+	def __call__(self, request):
+		if self.async_mode:
+			return self.__acall__(request)
+		with request_context(request_id_from_header(request.headers.get('X-Request-ID'))) as request_id:
+			start = time.perf_counter()
+			response = self.get_response(request)
+			return self.finish(request, response, request_id, start)
+
+	async def __acall__(self, request):
+		with request_context(request_id_from_header(request.headers.get('X-Request-ID'))) as request_id:
+			start = time.perf_counter()
+			response = await self.get_response(request)
+			return self.finish(request, response, request_id, start)
+
+	def finish(self, request, response, request_id, start):
+		elapsed = time.perf_counter() - start
+		response['X-Request-ID'] = request_id
+		match = request.resolver_match
+		view = match.url_name if match and match.url_name else 'unmatched'
+		if view == 'metrics':
+			return response
+		REQUEST_SECONDS.observe(elapsed, view=view, method=request.method, status=response.status_code)
+		if metrics_enabled():
+			log(
+				'INFO', 'Request', method=request.method, path=request.path, status=response.status_code,
+				duration_ms=elapsed * 1000, spans=format_spans(current_spans()),
+			)
+		return response
+
+
+class ReplicaReadsMiddleware:
+	"""Serve GET/HEAD requests from the read replica, if one is configured (see ``qa.db_router``).
+
+	Views listed in ``DATABASE_REPLICA_EXEMPT_VIEWS`` are served from the primary.
+	"""
+
+	sync_capable = True
+	async_capable = True
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+		self.async_mode = iscoroutinefunction(get_response)
+		if self.async_mode:
+			markcoroutinefunction(self)
+
+	def __call__(self, request):
+		if self.async_mode:
+			return self.__acall__(request)
+		with replica_reads(self.use_replica(request)):
+			return self.get_response(request)
+
+	async def __acall__(self, request):
+		with replica_reads(self.use_replica(request)):
+			return await self.get_response(request)
+
+	def use_replica(self, request):
+		if request.method not in ('GET', 'HEAD'):
+			return False
+		try:
+			match = resolve(request.path_info, getattr(request, 'urlconf', None))
+		except Resolver404:
+			return True
+		return match.url_name not in getattr(settings, 'DATABASE_REPLICA_EXEMPT_VIEWS', EXEMPT_VIEWS)
@@ -0,0 +1,157 @@
+import hashlib
+from collections import Counter
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def assign_ids(chunks):
+    """Frozen copy of ``qa.chunking.assign_ids`` as of this migration."""
+    seen = Counter()
+    for chunk in chunks:
+        digest = hashlib.sha1(chunk['text'].encode('utf-8')).hexdigest()[:16]
+        seen[digest] += 1
+        chunk['id'] = digest if seen[digest] == 1 else f"{digest}-{seen[digest]}"
+    return chunks
+
+
+def copy_chunks_to_rows(apps, schema_editor):
+    """Move each document's ``chunks`` JSON into ``DocumentChunk`` rows.
+
+    Older uploads stored plain strings, newer ones ``{'id', 'text', 'page', 'section'}`` dicts.
+    Content ids are recomputed the way ingestion assigns them, so they match the ids it would give
+    the same text and vectors already stored under them are reused on the next replace.
+    """
+    Document = apps.get_model('qa', 'Document')
+    DocumentChunk = apps.get_model('qa', 'DocumentChunk')
+    documents = Document.objects.exclude(chunks__isnull=True).only('id', 'chunks')
+    for document in documents.iterator(chunk_size=100):
+        chunks = [
+            {'text': chunk, 'page': None, 'section': None} if isinstance(chunk, str)
+            else {'text': chunk.get('text') or '', 'page': chunk.get('page'), 'section': chunk.get('section')}
+            for chunk in document.chunks or []
+        ]
+        chunks = assign_ids([chunk for chunk in chunks if chunk['text']])
+        DocumentChunk.objects.bulk_create([
+            DocumentChunk(
+                document_id=document.id,
+                position=position,
+                content_hash=chunk['id'],
+                page=chunk['page'],
+                section=(chunk['section'] or '')[:255],
+                text=chunk['text'],
+            )
+            for position, chunk in enumerate(chunks)
+        ], batch_size=500)
+        Document.objects.filter(id=document.id).update(chunk_count=len(chunks))
+
+
+def copy_rows_to_chunks(apps, schema_editor):
+    Document = apps.get_model('qa', 'Document')
+    DocumentChunk = apps.get_model('qa', 'DocumentChunk')
+    for document in Document.objects.only('id').iterator(chunk_size=100):
+        rows = DocumentChunk.objects.filter(document_id=document.id).order_by('position')
+        chunks = [
+            {'id': row.content_hash, 'text': row.text, 'page': row.page, 'section': row.section or None}
+            for row in rows
+        ]
+        if chunks:
+            Document.objects.filter(id=document.id).update(
+                chunks=chunks, text_content='\n\n'.join(chunk['text'] for chunk in chunks),
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qa', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='chunk_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='index_owner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='index_references', to='qa.document'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('extracting', 'Extracting'), ('embedding', 'Embedding'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=16),
+        ),
+        migrations.CreateModel(
+            name='SuggestedQuestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('question', models.TextField()),
+                ('normalized', models.CharField(db_index=True, max_length=255)),
+                ('context', models.JSONField(default=list)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='suggested_questions', to='qa.document')),
+            ],
+            options={
+                'ordering': ['document', 'position'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ConversationSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(blank=True, default='', max_length=255)),
+                ('summary', models.TextField(blank=True, default='')),
+                ('summarized_through', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_summaries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'scope'), name='unique_conversation_summary')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DocumentChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('content_hash', models.CharField(max_length=40)),
+                ('page', models.PositiveIntegerField(blank=True, null=True)),
+                ('section', models.CharField(blank=True, default='', max_length=255)),
+                ('text', models.TextField()),
+                # No reverse accessor yet: it would shadow the Document.chunks column copied below.
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='qa.document')),
+            ],
+            options={
+                'ordering': ['document', 'position'],
+                'constraints': [models.UniqueConstraint(fields=('document', 'position'), name='unique_chunk_position')],
+            },
+        ),
+        migrations.RunPython(copy_chunks_to_rows, copy_rows_to_chunks),
+        migrations.RemoveField(
+            model_name='document',
+            name='chunks',
+        ),
+        migrations.RemoveField(
+            model_name='document',
+            name='text_content',
+        ),
+        migrations.AlterField(
+            model_name='documentchunk',
+            name='document',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='qa.document'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Cast
+
+
+def scope_single_document_turns(apps, schema_editor):
+    """Earlier turns about one document belong to that document's conversation.
+
+    Turns about several documents did not record which ones, so they keep the empty scope.
+    """
+    ChatHistory = apps.get_model('qa', 'ChatHistory')
+    ChatHistory.objects.filter(document__isnull=False).update(scope=Cast('document_id', models.CharField(max_length=255)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qa', '0002_document_chunks'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chathistory',
+            name='scope',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='chathistory',
+            index=models.Index(fields=['user', 'scope'], name='qa_chathist_user_id_af2b1b_idx'),
+        ),
+        migrations.RunPython(scope_single_document_turns, migrations.RunPython.noop),
+    ]
@@ -7,19 +7,78 @@ class UserProfile(models.Model):
 		return self.user.username
 
 class Document(models.Model):
+	class Status(models.TextChoices):
+		QUEUED = 'queued', 'Queued'
+		EXTRACTING = 'extracting', 'Extracting'
+		EMBEDDING = 'embedding', 'Embedding'
+		READY = 'ready', 'Ready'
+		FAILED = 'failed', 'Failed'
+
 	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='documents', null=True, blank=True)
 	file = models.FileField(upload_to='documents/')
 	uploaded_at = models.DateTimeField(auto_now_add=True)
-	text_content = models.TextField(blank=True, null=True)
 	faiss_index_path = models.CharField(max_length=255, blank=True, null=True)
-	chunks = models.JSONField(blank=True, null=True)
+	chunk_count = models.PositiveIntegerField(default=0)
+	status = models.CharField(max_length=16, choices=Status.choices, default=Status.READY)
+	error = models.TextField(blank=True, default='')
+	# sha256 of the uploaded file. An upload identical to a ready document points ``index_owner``
+	# at it and shares its chunks and indexes instead of building its own.
+	content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)
+	index_owner = models.ForeignKey('self', on_delete=models.SET_NULL, related_name='index_references', null=True, blank=True)
+
+	@property
+	def index_id(self):
+		"""Document id the chunks, vectors and keyword index of this document are stored under."""
+		return self.index_owner_id or self.id
 
 	def __str__(self):
 		return self.file.name
 
+class DocumentChunk(models.Model):
+	"""One indexed chunk of a document; kept off the ``Document`` row so listings stay small."""
+	document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks')
+	position = models.PositiveIntegerField()
+	content_hash = models.CharField(max_length=40)
+	page = models.PositiveIntegerField(null=True, blank=True)
+	section = models.CharField(max_length=255, blank=True, default='')
+	text = models.TextField()
+
+	class Meta:
+		ordering = ['document', 'position']
+		constraints = [
+			models.UniqueConstraint(fields=['document', 'position'], name='unique_chunk_position'),
+		]
+
+	def as_chunk(self):
+		return {'id': self.content_hash, 'text': self.text, 'page': self.page, 'section': self.section or None}
+
+	def __str__(self):
+		return f"{self.document_id}#{self.position}"
+
+class SuggestedQuestion(models.Model):
+	"""A likely question generated at ingest time, stored with its retrieved context.
+
+	``context`` holds the ranked chunks (``text``, ``page``, ``document_id``, ``chunk_id``) so
+	asking the question later needs neither a query embedding nor a search.
+	"""
+	document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='suggested_questions')
+	position = models.PositiveIntegerField()
+	question = models.TextField()
+	normalized = models.CharField(max_length=255, db_index=True)
+	context = models.JSONField(default=list)
+
+	class Meta:
+		ordering = ['document', 'position']
+
+	def __str__(self):
+		return self.question
+
 class ChatHistory(models.Model):
 	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chats')
+	# Set only when exactly one document was asked about; ``scope`` records every document.
 	document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chats', null=True, blank=True)
+	# The conversation this turn belongs to, as in ``ConversationSummary.scope``.
+	scope = models.CharField(max_length=255, blank=True, default='')
 	question = models.TextField()
 	answer = models.TextField()
 	created_at = models.DateTimeField(auto_now_add=True, db_index=True)
@@ -29,8 +88,36 @@ class ChatHistory(models.Model):
 		indexes = [
 			models.Index(fields=['user', '-created_at']),
 			models.Index(fields=['document', '-created_at']),
+			models.Index(fields=['user', 'scope']),
 		]
 
+	def save(self, *args, **kwargs):
+		if not self.scope and self.document_id:
+			self.scope = str(self.document_id)
+		super().save(*args, **kwargs)
+
 	def __str__(self):
 		return f"Q: {self.question[:50]}..."
 
+
+
+class ConversationSummary(models.Model):
+	"""Rolling summary of the turns of one conversation that have left the recent-history window.
+
+	A conversation is a user plus the documents asked about (``scope``: sorted, comma-separated
+	document ids, empty for questions without a document). ``summarized_through`` is the id of
+	the newest ``ChatHistory`` row folded in, so each turn is summarized once.
+	"""
+	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_summaries')
+	scope = models.CharField(max_length=255, blank=True, default='')
+	summary = models.TextField(blank=True, default='')
+	summarized_through = models.BigIntegerField(default=0)
+	updated_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=['user', 'scope'], name='unique_conversation_summary'),
+		]
+
+	def __str__(self):
+		return f"Summary for {self.user} [{self.scope}]"
@@ -0,0 +1,99 @@
+import hashlib
+import re
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .metrics import LLM_TOKENS, log, span
+from .models import ChatHistory, ConversationSummary
+
+
+MAX_HISTORY = 5
+# Turns folded into the summary per request; older unsummarized turns are skipped.
+MAX_FOLD = 20
+
+_TOKEN_PATTERN = re.compile(r'\w{1,4}|[^\w\s]')
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s')
+
+
+def count_tokens(text):
+	"""Approximate BPE token count: words split into 4-character pieces, plus punctuation."""
+	return len(_TOKEN_PATTERN.findall(text or ''))
+
+
+def truncate_tokens(text, max_tokens):
+	pieces = list(_TOKEN_PATTERN.finditer(text))
+	if len(pieces) <= max_tokens:
+		return text
+	return text[:pieces[max_tokens - 1].end()] + '...'
+
+
+def format_turn(chat):
+	return f"Q: {chat.question}\nA: {chat.answer}\n"
+
+
+def extractive_summary(summary, turns, max_tokens):
+	"""Fold ``turns`` into ``summary`` without a model call.
+
+	Each turn becomes one line with its question and the first sentence of its answer; the
+	oldest lines are dropped once the summary exceeds ``max_tokens``.
+	"""
+	lines = [line for line in summary.split('\n') if line]
+	for chat in turns:
+		first_sentence = _SENTENCE_END.split(chat.answer.strip(), maxsplit=1)[0]
+		lines.append(f"- Asked: {truncate_tokens(chat.question, 40)} Answered: {truncate_tokens(first_sentence, 60)}")
+	while len(lines) > 1 and count_tokens('\n'.join(lines)) > max_tokens:
+		lines.pop(0)
+	return '\n'.join(lines)
+
+
+def llm_summary(summary, turns, max_tokens):
+	"""Fold ``turns`` into ``summary`` with one chat model call."""
+	from .answering import get_llm, response_text
+	prompt = (
+		f"Update the running summary of a conversation about documents in at most {max_tokens} tokens. "
+		"Keep facts, names, numbers and open questions; drop pleasantries.\n"
+		f"Current summary:\n{summary or '(empty)'}\n\nNew turns:\n{''.join(format_turn(chat) for chat in turns)}\n\nUpdated summary:"
+	)
+	with span('summarize'):
+		answer = response_text(get_llm().invoke(prompt))
+	LLM_TOKENS.inc(count_tokens(prompt), kind='prompt')
+	LLM_TOKENS.inc(count_tokens(answer), kind='completion')
+	return truncate_tokens(answer.strip(), max_tokens)
+
+
+def conversation_scope(documents):
+	"""Sorted, comma-separated document ids; hashed when too long for the ``scope`` columns."""
+	scope = ','.join(str(document_id) for document_id in sorted(document.id for document in documents))
+	if len(scope) > 255:
+		scope = 'sha1:' + hashlib.sha1(scope.encode('ascii')).hexdigest()
+	return scope
+
+
+def conversation_history(user, documents):
+	"""Return ``(summary, recent_turns)`` for a conversation, recent turns oldest first.
+
+	Turns that have fallen out of the last ``MAX_HISTORY`` are folded into the stored summary
+	once, so each request only summarizes the turns that left the window since the last one.
+	"""
+	scope = conversation_scope(documents)
+	stored = ConversationSummary.objects.filter(user=user, scope=scope).first()
+	through = stored.summarized_through if stored else 0
+	turns = list(
+		ChatHistory.objects.filter(user=user, scope=scope, id__gt=through)
+		.order_by('-id')[:MAX_HISTORY + MAX_FOLD]
+	)
+	recent, older = turns[:MAX_HISTORY], turns[MAX_HISTORY:][::-1]
+	summary = stored.summary if stored else ''
+	if older:
+		summarizer = import_string(getattr(settings, 'HISTORY_SUMMARIZER', 'qa.prompting.extractive_summary'))
+		try:
+			summary = summarizer(summary, older, getattr(settings, 'HISTORY_SUMMARY_MAX_TOKENS', 300))
+		except Exception as e:
+			# Keep the old summary; these turns are retried on the next question.
+			log('ERROR', 'Failed to summarize conversation history', error=e)
+		else:
+			ConversationSummary.objects.update_or_create(
+				user=user, scope=scope, defaults={'summary': summary, 'summarized_through': older[-1].id}
+			)
+	return summary, recent[::-1]
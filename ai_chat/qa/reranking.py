@@ -0,0 +1,81 @@
+"""Local second-stage reranking of retrieved chunks, without a cross-encoder.
+
+With ``RERANKING`` enabled, QA retrieval fetches ``RERANK_CANDIDATES`` chunks instead of ``k`` and
+reranks them here in NumPy. A chunk's relevance blends its vector similarity with how much of
+the question it covers (question terms weighted by idf over the candidates, with
+``RERANK_LEXICAL_WEIGHT``); chunks below ``RERANK_MIN_SCORE`` are dropped and the best ``k`` of
+the rest are picked by maximal marginal relevance (``RERANK_MMR_LAMBDA``), so near-duplicate
+chunks do not crowd each other out of the prompt. When no chunk passes the cutoff the question
+is answered as not found without calling the LLM. The cutoff depends on the embedding model's
+similarity range, so calibrate it on real questions before enabling the stage.
+"""
+import numpy as np
+from django.conf import settings
+
+from .keyword_index import tokenize
+
+
+def reranking_enabled():
+	return getattr(settings, 'RERANKING', False)
+
+
+def candidate_count(k):
+	"""How many chunks each search should return for a final ``k``."""
+	return max(k, getattr(settings, 'RERANK_CANDIDATES', 30)) if reranking_enabled() else k
+
+
+def _term_counts(texts, vocabulary):
+	counts = np.zeros((len(texts), len(vocabulary)), dtype=np.float32)
+	for row, terms in enumerate(texts):
+		np.add.at(counts[row], np.array([vocabulary[term] for term in terms], dtype=np.intp), 1.0)
+	return counts
+
+
+def relevance_scores(question, chunks, similarities, lexical_weight=None):
+	"""Blend vector similarities (``None`` for chunks found only by keyword) with question-term coverage."""
+	lexical_weight = getattr(settings, 'RERANK_LEXICAL_WEIGHT', 0.3) if lexical_weight is None else lexical_weight
+	terms = [tokenize(chunk.page_content) for chunk in chunks]
+	vocabulary = {term: i for i, term in enumerate(dict.fromkeys(term for chunk_terms in terms for term in chunk_terms))}
+	counts = _term_counts(terms, vocabulary)
+	idf = np.log1p(len(chunks) / np.maximum((counts > 0).sum(axis=0), 1))
+
+	question_terms = set(tokenize(question))
+	columns = [vocabulary[term] for term in question_terms if term in vocabulary]
+	# Question terms no candidate contains count against coverage with the highest possible idf.
+	total = idf[columns].sum() + (len(question_terms) - len(columns)) * np.log1p(len(chunks))
+	coverage = (counts[:, columns] > 0) @ idf[columns] / total if total else np.zeros(len(chunks))
+
+	semantic = np.array([np.nan if score is None else score for score in similarities], dtype=np.float64)
+	if np.isnan(semantic).all():
+		semantic, lexical_weight = np.zeros(len(chunks)), 1.0
+	else:
+		semantic = np.nan_to_num(semantic, nan=np.nanmin(semantic))
+	if not question_terms:
+		lexical_weight = 0.0
+	return (1 - lexical_weight) * semantic + lexical_weight * coverage, counts * idf
+
+
+def rerank(question, candidates, k, min_score=None, mmr_lambda=None, lexical_weight=None):
+	"""Return up to ``k`` chunks of ``candidates`` (``[(chunk, similarity or None)]``) that pass the cutoff, in MMR order."""
+	if not candidates:
+		return []
+	min_score = getattr(settings, 'RERANK_MIN_SCORE', 0.3) if min_score is None else min_score
+	mmr_lambda = getattr(settings, 'RERANK_MMR_LAMBDA', 0.7) if mmr_lambda is None else mmr_lambda
+	chunks = [chunk for chunk, _ in candidates]
+	relevance, weights = relevance_scores(question, chunks, [score for _, score in candidates], lexical_weight)
+	available = relevance >= min_score
+	if not available.any():
+		return []
+
+	norms = np.linalg.norm(weights, axis=1, keepdims=True)
+	weights = np.divide(weights, norms, out=np.zeros_like(weights), where=norms > 0)
+	similarity = weights @ weights.T
+	selected = []
+	redundancy = np.zeros(len(chunks))
+	for _ in range(min(k, int(available.sum()))):
+		scores = np.where(available, mmr_lambda * relevance - (1 - mmr_lambda) * redundancy, -np.inf)
+		best = int(np.argmax(scores))
+		selected.append(best)
+		available[best] = False
+		redundancy = np.maximum(redundancy, similarity[:, best])
+	return [chunks[i] for i in selected]
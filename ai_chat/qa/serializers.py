@@ -1,5 +1,6 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Document, ChatHistory
+from .models import Document, DocumentChunk, ChatHistory
 
 
 class DocumentSerializer(serializers.ModelSerializer):
@@ -7,17 +8,64 @@ class DocumentSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Document
-        fields = ['id', 'file', 'filename', 'uploaded_at', 'text_content']
+        fields = ['id', 'file', 'filename', 'uploaded_at', 'status', 'error', 'chunk_count']
+        read_only_fields = ['status', 'error', 'chunk_count']
     
     def get_filename(self, obj):
         return obj.file.name if obj.file else 'Unknown'
 
+# Columns DocumentSerializer reads, for .only() on list querysets.
+DOCUMENT_LIST_FIELDS = ['id', 'file', 'uploaded_at', 'status', 'error', 'chunk_count']
+
+class DocumentSummarySerializer(serializers.ModelSerializer):
+    filename = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Document
+        fields = ['id', 'filename', 'status']
+
+    def get_filename(self, obj):
+        return obj.file.name if obj.file else 'Unknown'
+
+class DocumentChunkSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DocumentChunk
+        fields = ['position', 'page', 'section', 'text']
+
+class DocumentStatusSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Document
+        fields = ['id', 'status', 'error']
+
 class ChatHistorySerializer(serializers.ModelSerializer):
-    document = DocumentSerializer(read_only=True)
+    document = DocumentSummarySerializer(read_only=True)
     class Meta:
         model = ChatHistory
         fields = ['id', 'user', 'document', 'question', 'answer', 'created_at']
 
 class QARequestSerializer(serializers.Serializer):
     document_id = serializers.IntegerField(required=False, allow_null=True)
+    document_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    all_documents = serializers.BooleanField(required=False, default=False)
     question = serializers.CharField()
+
+    def validate(self, data):
+        selectors = [data.get('document_id'), data.get('document_ids'), data.get('all_documents')]
+        if sum(1 for selector in selectors if selector) > 1:
+            raise serializers.ValidationError('Use only one of document_id, document_ids or all_documents.')
+        return data
+
+class BatchQARequestSerializer(serializers.Serializer):
+    document_id = serializers.IntegerField(required=False, allow_null=True)
+    document_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    questions = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+    retrieve_only = serializers.BooleanField(required=False, default=False)
+    k = serializers.IntegerField(required=False, default=5, min_value=1, max_value=50)
+
+    def validate(self, data):
+        if bool(data.get('document_id')) == bool(data.get('document_ids')):
+            raise serializers.ValidationError('Use one of document_id or document_ids.')
+        max_questions = getattr(settings, 'BATCH_QA_MAX_QUESTIONS', 500)
+        if len(data['questions']) > max_questions:
+            raise serializers.ValidationError(f'At most {max_questions} questions per batch.')
+        return data
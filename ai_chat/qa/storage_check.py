@@ -0,0 +1,256 @@
+"""Reconcile stored uploads and indexes with ``Document`` rows.
+
+Storage side: uploads under ``media/documents/``, legacy ``document_<id>.index`` directories,
+vectors in the shared store and keyword index directories that no row owns any more (left by
+failed uploads or deletes) are removed. Files younger than ``min_age`` are skipped, since an
+upload writes its file just before its row. Row side: ready documents whose vectors are gone are
+re-ingested from their upload (or marked failed when the upload is gone too), and missing keyword
+indexes are rebuilt from the stored chunks.
+
+Both sides are walked in batches of ``batch_size`` (directory entries via ``os.scandir``, rows
+and store ids by key range), so memory does not grow with the number of documents. Run it with
+``manage.py check_storage``, or every ``STORAGE_CHECK_INTERVAL`` seconds in the server process.
+"""
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+
+from .ingestion import enqueue_ingestion
+from .keyword_index import build_keyword_index, keyword_index_path, remove_keyword_index
+from .metrics import log
+from .models import Document, DocumentChunk
+from .vector_store import PerDocumentFaissStore, get_legacy_store, get_vector_store
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+
+KEYWORD_INDEX_DIR = re.compile(r'document_(\d+)')
+
+
+def disk_usage(path):
+	"""Bytes used by a file or a directory tree."""
+	if not os.path.isdir(path):
+		return os.path.getsize(path) if os.path.exists(path) else 0
+	total = 0
+	with os.scandir(path) as entries:
+		for entry in entries:
+			total += disk_usage(entry.path) if entry.is_dir(follow_symlinks=False) else entry.stat(follow_symlinks=False).st_size
+	return total
+
+
+def _batches(iterable, size):
+	batch = []
+	for item in iterable:
+		batch.append(item)
+		if len(batch) >= size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+
+def _walk_files(root):
+	"""Yield ``os.DirEntry`` objects for the files below ``root``, one directory at a time."""
+	pending = [root]
+	while pending:
+		with os.scandir(pending.pop()) as entries:
+			for entry in entries:
+				if entry.is_dir(follow_symlinks=False):
+					pending.append(entry.path)
+				elif entry.is_file(follow_symlinks=False):
+					yield entry
+
+
+class StorageCheck:
+	"""One reconciliation pass; ``run()`` yields a finding dict per problem found.
+
+	Findings have ``check``, ``target``, ``action`` and ``bytes``. After the run, ``counts``
+	holds findings per check and ``reclaimed`` the bytes freed (or that would be, in dry-run mode).
+	"""
+
+	def __init__(self, dry_run=False, rebuild=True, min_age=None, batch_size=500):
+		self.dry_run = dry_run
+		self.rebuild = rebuild
+		self.min_age = getattr(settings, 'STORAGE_CHECK_MIN_AGE', 3600) if min_age is None else min_age
+		self.batch_size = batch_size
+		self.counts = {}
+		self.reclaimed = 0
+
+	def _finding(self, check, target, action, size=0):
+		self.counts[check] = self.counts.get(check, 0) + 1
+		self.reclaimed += size
+		return {'check': check, 'target': target, 'action': f"would {action}" if self.dry_run else action, 'bytes': size}
+
+	def run(self):
+		yield from self.orphan_uploads()
+		for store in self._stores():
+			yield from self.orphan_vectors(store)
+		yield from self.orphan_keyword_indexes()
+		yield from self.missing_indexes()
+
+	def _stores(self):
+		stores = {}
+		for store in (get_vector_store(), get_legacy_store()):
+			stores.setdefault(os.path.abspath(store.root), store)
+		return list(stores.values())
+
+	def orphan_uploads(self):
+		storage = Document._meta.get_field('file').storage
+		try:
+			root = storage.path('documents')
+		except NotImplementedError:
+			log('WARNING', 'Storage check skips uploads: the file storage has no local path')
+			return
+		if not os.path.isdir(root):
+			return
+		cutoff = time.time() - self.min_age
+		media_root = storage.path('')
+		for entries in _batches(_walk_files(root), self.batch_size):
+			names = {os.path.relpath(entry.path, media_root).replace(os.sep, '/'): entry for entry in entries}
+			referenced = set(Document.objects.filter(file__in=list(names)).values_list('file', flat=True))
+			for name, entry in names.items():
+				stat = entry.stat(follow_symlinks=False)
+				if name in referenced or stat.st_mtime > cutoff:
+					continue
+				if not self.dry_run:
+					storage.delete(name)
+				yield self._finding('orphan_upload', name, 'remove', stat.st_size)
+
+	def orphan_vectors(self, store):
+		legacy = isinstance(store, PerDocumentFaissStore)
+		# Per-document directories belong to rows recording an index path, shared-store vectors to owners without one.
+		owners = Document.objects.filter(index_owner__isnull=True)
+		no_path = Q(faiss_index_path__isnull=True) | Q(faiss_index_path='')
+		owners = owners.exclude(no_path) if legacy else owners.filter(no_path)
+		before = None if legacy else disk_usage(store.root)
+		removed = 0
+		for batch in store.iter_document_ids(self.batch_size):
+			live = set(owners.filter(id__in=batch).values_list('id', flat=True))
+			for document_id in batch:
+				if document_id in live:
+					continue
+				target = store.index_path(document_id) if legacy else f"{store.root} document {document_id}"
+				size = disk_usage(target) if legacy else 0
+				if not self.dry_run:
+					store.remove_document(document_id)
+				removed += 1
+				yield self._finding('orphan_vectors', target, 'remove', size)
+		if removed and not legacy and not self.dry_run:
+			# Shared shards shrink as a whole; count what the removals freed.
+			self.reclaimed += max(before - disk_usage(store.root), 0)
+
+	def orphan_keyword_indexes(self):
+		root = str(getattr(settings, 'KEYWORD_INDEX_ROOT', 'keyword_indexes'))
+		if not os.path.isdir(root):
+			return
+		with os.scandir(root) as scanned:
+			entries = (entry for entry in scanned if KEYWORD_INDEX_DIR.fullmatch(entry.name) and entry.is_dir())
+			for batch in _batches(entries, self.batch_size):
+				ids = {int(KEYWORD_INDEX_DIR.fullmatch(entry.name).group(1)): entry for entry in batch}
+				live = set(Document.objects.filter(id__in=list(ids), index_owner__isnull=True).values_list('id', flat=True))
+				for document_id, entry in ids.items():
+					if document_id in live:
+						continue
+					size = disk_usage(entry.path)
+					if not self.dry_run:
+						remove_keyword_index(document_id)
+					yield self._finding('orphan_keyword_index', entry.path, 'remove', size)
+
+	def missing_indexes(self):
+		"""Ready documents owning indexes that are gone: re-ingest them, or rebuild just the keyword index."""
+		documents = (
+			Document.objects.filter(status=Document.Status.READY, index_owner__isnull=True, chunk_count__gt=0)
+			.only('id', 'file', 'faiss_index_path').order_by('id')
+		)
+		last = 0
+		while True:
+			batch = list(documents.filter(id__gt=last)[:self.batch_size])
+			if not batch:
+				return
+			last = batch[-1].id
+			shared = get_vector_store().indexed_documents([document.id for document in batch if not document.faiss_index_path])
+			for document in batch:
+				if document.faiss_index_path:
+					indexed = os.path.isdir(document.faiss_index_path)
+				else:
+					indexed = document.id in shared
+				if not indexed:
+					yield self._missing_vectors(document)
+				elif not os.path.exists(os.path.join(keyword_index_path(document.id), 'bm25.npz')):
+					yield self._missing_keyword_index(document)
+
+	def _missing_vectors(self, document):
+		if not document.file or not document.file.storage.exists(document.file.name):
+			if not self.dry_run:
+				Document.objects.filter(id=document.id).update(
+					status=Document.Status.FAILED, error='The index and the uploaded file are missing. Please upload the document again.',
+				)
+			return self._finding('missing_index', f"document {document.id}", 'mark failed')
+		if not self.rebuild:
+			return self._finding('missing_index', f"document {document.id}", 'report')
+		if not self.dry_run:
+			# Re-ingesting a document whose legacy directory is gone indexes it into the shared store.
+			Document.objects.filter(id=document.id).update(status=Document.Status.QUEUED, error='', faiss_index_path=None)
+			enqueue_ingestion(document.id)
+		return self._finding('missing_index', f"document {document.id}", 're-ingest')
+
+	def _missing_keyword_index(self, document):
+		if not self.rebuild:
+			return self._finding('missing_keyword_index', f"document {document.id}", 'report')
+		if not self.dry_run:
+			chunks = [row.as_chunk() for row in DocumentChunk.objects.filter(document_id=document.id).order_by('position')]
+			if chunks:
+				build_keyword_index(document.id, chunks)
+		return self._finding('missing_keyword_index', f"document {document.id}", 'rebuild')
+
+
+def run_storage_check(**options):
+	"""Run a full pass, logging each finding and a summary; returns the ``StorageCheck``."""
+	check = StorageCheck(**options)
+	for finding in check.run():
+		log('INFO', 'Storage check', **finding)
+	log('INFO', 'Storage check finished', dry_run=check.dry_run, reclaimed_bytes=check.reclaimed, **check.counts)
+	return check
+
+
+_periodic = None
+_periodic_lock = threading.Lock()
+
+
+def _periodic_loop(interval, lock_path):
+	while True:
+		time.sleep(interval)
+		try:
+			with open(lock_path, 'w') as lock_file:
+				if fcntl is not None:
+					try:
+						fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+					except OSError:
+						continue  # Another worker process on this host is running the check.
+				run_storage_check()
+		except Exception as e:
+			log('ERROR', 'Storage check failed', error=e)
+		finally:
+			close_old_connections()
+
+
+def start_periodic_storage_check():
+	"""Start the background check if ``STORAGE_CHECK_INTERVAL`` is set; called by the server entry points."""
+	global _periodic
+	interval = getattr(settings, 'STORAGE_CHECK_INTERVAL', None)
+	if not interval:
+		return
+	with _periodic_lock:
+		if _periodic is None:
+			os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+			lock_path = os.path.join(settings.MEDIA_ROOT, '.storage_check.lock')
+			_periodic = threading.Thread(target=_periodic_loop, args=(interval, lock_path), name='storage-check', daemon=True)
+			_periodic.start()
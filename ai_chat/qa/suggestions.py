@@ -0,0 +1,70 @@
+"""Suggested questions, generated per document at ingest time with their context precomputed.
+
+``SUGGESTED_QUESTIONS_GENERATOR`` names a callable taking the document's chunks and returning
+question strings; the default picks templates that fit the text (dates, amounts, parties...)
+and adds questions about the first section headings. The questions are embedded in one batch
+(which also fills the query embedding cache) and their retrieved chunks are stored, so asking
+one of them skips both the embedding and the search.
+"""
+import re
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .answer_cache import normalize_question
+from .models import SuggestedQuestion
+
+
+_DATE = re.compile(
+	r'\b(?:\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{4}-\d{2}-\d{2}|(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.? \d{1,2}|\d{1,2} (?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*|deadline|due date)\b',
+	re.IGNORECASE,
+)
+_AMOUNT = re.compile(r'[$€£¥]\s?\d|\b\d[\d,.]*\s?(?:%|percent|eur|euros?|usd|dollars?|gbp|pounds?)\b', re.IGNORECASE)
+_PARTIES = re.compile(r'\b(?:between|parties|party|landlord|tenant|employer|employee|buyer|seller|supplier|customer|client|contractor)\b', re.IGNORECASE)
+_OBLIGATIONS = re.compile(r'\b(?:shall|must|required|obligations?|responsible for)\b', re.IGNORECASE)
+
+TEMPLATES = [
+	(None, "What is this document about?"),
+	(_PARTIES, "Who are the parties involved?"),
+	(_DATE, "What are the key dates and deadlines?"),
+	(_AMOUNT, "What amounts, prices or fees are mentioned?"),
+	(_OBLIGATIONS, "What are the main obligations and requirements?"),
+]
+
+
+def template_questions(chunks):
+	"""Questions from ``TEMPLATES`` whose pattern occurs in the text, then one per leading section heading."""
+	text = '\n'.join(chunk['text'] for chunk in chunks)
+	questions = [question for pattern, question in TEMPLATES if pattern is None or pattern.search(text)]
+	for section in dict.fromkeys(chunk.get('section') for chunk in chunks):
+		if section and len(section) <= 80:
+			questions.append(f"What does the document say about {section.rstrip('.:')}?")
+	return questions
+
+
+def build_suggestions(document, chunks):
+	"""Generate, retrieve and store the suggested questions of a freshly indexed document."""
+	from .answering import retrieve_many
+
+	generator = getattr(settings, 'SUGGESTED_QUESTIONS_GENERATOR', 'qa.suggestions.template_questions')
+	questions = import_string(generator)(chunks) if generator and chunks else []
+	questions = list(dict.fromkeys(questions))[:getattr(settings, 'SUGGESTED_QUESTIONS_MAX', 6)]
+	retrieved = retrieve_many([document], questions) if questions else []
+	rows = [
+		SuggestedQuestion(
+			document_id=document.id,
+			position=position,
+			question=question,
+			normalized=normalize_question(question)[:255],
+			context=[
+				{'text': chunk.page_content, 'page': chunk.metadata.get('page'), 'document_id': chunk.metadata.get('document_id'), 'chunk_id': chunk.metadata.get('chunk_id')}
+				for chunk, _ in results
+			],
+		)
+		for position, (question, results) in enumerate(zip(questions, retrieved))
+	]
+	with transaction.atomic():
+		SuggestedQuestion.objects.filter(document_id=document.id).delete()
+		SuggestedQuestion.objects.bulk_create(rows)
+	return questions
@@ -1 +1,1300 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .answer_cache import AnswerCache, get_answer_cache
+from .benchmark import RssSampler, compare, generate_corpus, summarize
+from .authentication import _local_tokens
+from .answering import NOT_FOUND_ANSWER, CONTEXT_SEPARATOR, _cite, alookup_cached_answer, answer_scope, fit_prompt, format_prompt, reciprocal_rank_fusion, retrieve
+from .history import asave_chat, get_history_writer
+from .embeddings import CachedBatchEmbeddings, EmbeddingCache, FakeEmbeddings
+from .extraction import iter_pages
+from .index_cache import VectorStoreCache
+from .chunking import assign_ids, chunk_pages
+from .ingestion import build_index, save_chunks
+from .keyword_index import KeywordIndex, build_keyword_index, keyword_index_path, remove_keyword_index
+from .llm import FakeChatModel
+from .storage_check import StorageCheck
+from .metrics import LLM_TOKENS, NOT_FOUND_EARLY_EXITS, STAGE_SECONDS, KeyValueFormatter, log, request_context, span
+from .reranking import rerank
+from .vector_store import PerDocumentFaissStore, ShardedFaissStore, _as_langchain_document
+from .models import ChatHistory, ConversationSummary, Document
+from .prompting import MAX_HISTORY, conversation_history, count_tokens, extractive_summary, format_turn
+
+
+def _write_index(path, size):
+	os.makedirs(path, exist_ok=True)
+	with open(os.path.join(path, 'index.faiss'), 'wb') as fh:
+		fh.write(b'x' * size)
+
+
+class VectorStoreCacheTests(TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(self.tmp.cleanup)
+		self.loads = []
+
+	def loader(self, path):
+		self.loads.append(path)
+		return object()
+
+	def index(self, name, size=10):
+		path = os.path.join(self.tmp.name, name)
+		_write_index(path, size)
+		return path
+
+	def test_hit_after_first_load(self):
+		path = self.index('a')
+		cache = VectorStoreCache(max_bytes=100)
+		first = cache.get(1, path, self.loader)
+		self.assertIs(cache.get(1, path, self.loader), first)
+		self.assertEqual(len(self.loads), 1)
+		self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (1, 1))
+
+	def test_reload_when_index_changes(self):
+		path = self.index('a')
+		cache = VectorStoreCache(max_bytes=100)
+		cache.get(1, path, self.loader)
+		stat = os.stat(os.path.join(path, 'index.faiss'))
+		os.utime(os.path.join(path, 'index.faiss'), (stat.st_atime, stat.st_mtime + 5))
+		cache.get(1, path, self.loader)
+		self.assertEqual(len(self.loads), 2)
+
+	def test_lru_eviction_and_invalidate(self):
+		cache = VectorStoreCache(max_bytes=25)
+		a, b, c = self.index('a'), self.index('b'), self.index('c')
+		cache.get(1, a, self.loader)
+		cache.get(2, b, self.loader)
+		cache.get(1, a, self.loader)
+		cache.get(3, c, self.loader)
+		self.assertEqual(cache.stats()['evictions'], 1)
+		cache.get(1, a, self.loader)
+		self.assertEqual(len(self.loads), 3)
+		cache.invalidate(1)
+		cache.get(1, a, self.loader)
+		self.assertEqual(len(self.loads), 4)
+
+	def test_concurrent_loads_share_one_lock_that_is_always_released(self):
+		import threading
+		path = self.index('a')
+		cache = VectorStoreCache(max_bytes=100)
+		with self.assertRaises(OSError):
+			cache.get(1, path, mock.Mock(side_effect=OSError('corrupt index')))
+		self.assertEqual(cache._load_locks, {})
+
+		started, release = threading.Event(), threading.Event()
+
+		def slow_loader(path):
+			started.set()
+			release.wait(5)
+			return self.loader(path)
+
+		results = []
+		first = threading.Thread(target=lambda: results.append(cache.get(1, path, slow_loader)))
+		first.start()
+		started.wait(5)
+		second = threading.Thread(target=lambda: results.append(cache.get(1, path, slow_loader)))
+		second.start()
+		while cache._load_locks[1][1] < 2:
+			time.sleep(0.001)
+		release.set()
+		first.join()
+		second.join()
+		self.assertEqual(len(self.loads), 1)
+		self.assertIs(results[0], results[1])
+		self.assertEqual(cache._load_locks, {})
+
+
+class UploadStatusTests(TestCase):
+	def setUp(self):
+		self.media = tempfile.TemporaryDirectory()
+		self.addCleanup(self.media.cleanup)
+		override = override_settings(MEDIA_ROOT=self.media.name)
+		override.enable()
+		self.addCleanup(override.disable)
+		self.user = User.objects.create_user(username='alice', password='pw')
+		self.client = APIClient()
+		self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+
+	def test_upload_is_accepted_and_queued(self):
+		with self.captureOnCommitCallbacks() as callbacks:
+			response = self.client.post('/api/qa/upload/', {'file': SimpleUploadedFile('a.txt', b'hello')}, format='multipart')
+		self.assertEqual(response.status_code, 202)
+		document = response.json()
+		self.assertEqual(document['status'], Document.Status.QUEUED)
+		self.assertEqual(len(callbacks), 1)
+
+		status_response = self.client.get(f"/api/qa/documents/{document['id']}/status/")
+		self.assertEqual(status_response.data['status'], Document.Status.QUEUED)
+
+		qa_response = self.client.post('/api/qa/qa/', {'document_id': document['id'], 'question': 'hi?'}, format='json')
+		self.assertEqual(qa_response.status_code, 409)
+
+	def test_replace_queues_new_version(self):
+		with self.captureOnCommitCallbacks():
+			document = self.client.post('/api/qa/upload/', {'file': SimpleUploadedFile('a.txt', b'v1')}, format='multipart').json()
+		url = f"/api/qa/documents/{document['id']}/replace/"
+		self.assertEqual(self.client.post(url, {'file': SimpleUploadedFile('a.txt', b'v2')}, format='multipart').status_code, 409)
+
+		Document.objects.filter(id=document['id']).update(status=Document.Status.READY)
+		old_path = Document.objects.get(id=document['id']).file.path
+		with self.captureOnCommitCallbacks() as callbacks:
+			response = self.client.post(url, {'file': SimpleUploadedFile('a-v2.txt', b'v2')}, format='multipart')
+		self.assertEqual(response.status_code, 202)
+		self.assertEqual(len(callbacks), 1)
+		replaced = Document.objects.get(id=document['id'])
+		self.assertEqual(replaced.status, Document.Status.QUEUED)
+		self.assertEqual(replaced.file.read(), b'v2')
+		self.assertFalse(os.path.exists(old_path))
+
+	def test_bulk_upload_reports_each_file(self):
+		import io
+		import zipfile
+		archive = io.BytesIO()
+		with zipfile.ZipFile(archive, 'w') as zf:
+			zf.writestr('docs/b.txt', 'beta')
+			zf.writestr('docs/notes.exe', 'nope')
+			zf.writestr('__MACOSX/docs/._b.txt', 'junk')
+		files = [SimpleUploadedFile('a.txt', b'alpha'), SimpleUploadedFile('bulk.zip', archive.getvalue())]
+		with self.captureOnCommitCallbacks() as callbacks:
+			response = self.client.post('/api/qa/upload/bulk/', {'files': files}, format='multipart')
+		self.assertEqual(response.status_code, 202)
+		body = response.json()
+		self.assertEqual((body['accepted'], body['rejected']), (2, 1))
+		self.assertEqual([(r['filename'], r['status']) for r in body['results']], [('a.txt', 'queued'), ('b.txt', 'queued'), ('notes.exe', 'rejected')])
+		self.assertEqual(len(callbacks), 1)
+		self.assertFalse(ChatHistory.objects.filter(user=self.user).exists())
+
+		ids = [r['document']['id'] for r in body['results'] if r['status'] == 'queued']
+		status_response = self.client.get('/api/qa/documents/status/', {'ids': ','.join(map(str, ids))})
+		self.assertEqual([d['id'] for d in status_response.data['documents']], ids)
+		self.assertEqual(status_response.data['counts'], {Document.Status.QUEUED: 2})
+
+		with override_settings(BULK_UPLOAD_MAX_FILES=1):
+			response = self.client.post('/api/qa/upload/bulk/', {'files': [SimpleUploadedFile('c.txt', b'c'), SimpleUploadedFile('d.txt', b'd')]}, format='multipart')
+		self.assertEqual([r['status'] for r in response.json()['results']], ['queued', 'rejected'])
+
+	def test_batch_ingestion_embeds_documents_together(self):
+		from .ingestion import run_batch_ingestion
+		embeddings = FakeEmbeddings(dimensions=16)
+		provider = mock.Mock(wraps=embeddings)
+		store = ShardedFaissStore(os.path.join(self.media.name, 'shared'), shards=1)
+		documents = [Document.objects.create(user=self.user) for _ in range(3)]
+		for document, content in zip(documents, [b'Refunds take ten days.', b'Shipping is free.', b'']):
+			document.file.save('doc.txt', SimpleUploadedFile('doc.txt', content))
+		with override_settings(KEYWORD_INDEX_ROOT=self.media.name), \
+				mock.patch('qa.ingestion.get_vector_store', return_value=store), \
+				mock.patch('qa.embeddings.get_embeddings', return_value=provider), \
+				mock.patch('qa.answering.get_embeddings', return_value=provider):
+			run_batch_ingestion([document.id for document in documents])
+		self.assertEqual(provider.embed_documents.call_count, 1)
+		self.assertEqual(provider.embed_documents.call_args.args[0], ['Refunds take ten days.', 'Shipping is free.'])
+		statuses = [Document.objects.get(id=document.id).status for document in documents]
+		self.assertEqual(statuses, [Document.Status.READY, Document.Status.READY, Document.Status.FAILED])
+		results = store.search(embeddings.embed_query('Shipping is free.'), 1, document_ids=[documents[1].id])
+		self.assertEqual(results[0][0].page_content, 'Shipping is free.')
+
+	def test_batch_ingestion_never_leaves_documents_in_progress(self):
+		from .ingestion import run_batch_ingestion
+		store = mock.Mock(chunk_hashes=mock.Mock(side_effect=[set(), OSError('store unavailable'), set()]))
+		documents = [Document.objects.create(user=self.user) for _ in range(3)]
+		for document in documents:
+			document.file.save('doc.txt', SimpleUploadedFile('doc.txt', b'Refunds take ten days.'))
+		with mock.patch('qa.ingestion.get_vector_store', return_value=store), \
+				mock.patch('qa.ingestion._embed_batch', side_effect=RuntimeError('broker down')):
+			run_batch_ingestion([document.id for document in documents])
+		failed = Document.objects.filter(id__in=[document.id for document in documents])
+		self.assertEqual(sorted(failed.values_list('status', 'error')), sorted([
+			(Document.Status.FAILED, 'store unavailable'),
+			(Document.Status.FAILED, 'broker down'),
+			(Document.Status.FAILED, 'broker down'),
+		]))
+
+	@override_settings(CHUNK_MAX_TOKENS=12)
+	def test_identical_uploads_share_one_index(self):
+		from .ingestion import run_ingestion
+		embeddings = FakeEmbeddings(dimensions=16)
+		provider = mock.Mock(wraps=embeddings)
+		store = ShardedFaissStore(os.path.join(self.media.name, 'shared'), shards=2)
+		bob = User.objects.create_user(username='bob', password='pw')
+		bob_client = APIClient()
+		bob_client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=bob).key}')
+		content = b'Refunds take ten days.\n\nShipping is free over fifty euros.'
+
+		with override_settings(KEYWORD_INDEX_ROOT=os.path.join(self.media.name, 'bm25')), \
+				mock.patch('qa.ingestion.get_vector_store', return_value=store), \
+				mock.patch('qa.vector_store.get_vector_store', return_value=store), \
+				mock.patch('qa.embeddings.get_embeddings', return_value=provider), \
+				mock.patch('qa.answering.get_embeddings', return_value=provider):
+			ids = []
+			for client in (self.client, bob_client):
+				with self.captureOnCommitCallbacks():
+					ids.append(client.post('/api/qa/upload/', {'file': SimpleUploadedFile('p.txt', content)}, format='multipart').json()['id'])
+				run_ingestion(ids[-1])
+			original, duplicate = Document.objects.get(id=ids[0]), Document.objects.get(id=ids[1])
+			self.assertEqual(original.content_hash, hashlib.sha256(content).hexdigest())
+			self.assertEqual((duplicate.status, duplicate.index_owner_id), (Document.Status.READY, original.id))
+			self.assertEqual(provider.embed_documents.call_count, 1)
+			self.assertEqual(retrieve([duplicate], 'shipping fifty euros', k=1)[0].page_content, 'Shipping is free over fifty euros.')
+			self.assertEqual(bob_client.get(f'/api/qa/documents/{original.id}/chunks/').status_code, 404)
+			self.assertEqual(bob_client.get(f'/api/qa/documents/{duplicate.id}/chunks/').data['count'], 2)
+			suggested = bob_client.get(f'/api/qa/documents/{duplicate.id}/suggestions/').data['questions']
+			self.assertIn('What is this document about?', suggested)
+
+			# Deleting the original hands the shared index to the duplicate; the last delete removes it.
+			self.client.delete(f'/api/qa/documents/{original.id}/')
+			duplicate.refresh_from_db()
+			self.assertIsNone(duplicate.index_owner_id)
+			self.assertEqual(retrieve([duplicate], 'refunds ten days', k=1)[0].page_content, 'Refunds take ten days.')
+			self.assertEqual(bob_client.get(f'/api/qa/documents/{duplicate.id}/chunks/').data['count'], 2)
+			self.assertEqual(bob_client.get(f'/api/qa/documents/{duplicate.id}/suggestions/').data['questions'], suggested)
+			# The chunks now belong to bob, on his shard.
+			self.assertNotEqual(store.shard_for(bob.id), store.shard_for(self.user.id))
+			bob_results = store.search(embeddings.embed_query('refunds ten days'), 2, user_id=bob.id)
+			self.assertEqual({doc.metadata['document_id'] for doc, _ in bob_results}, {duplicate.id})
+			self.assertEqual(store.stats()['shards'][store.shard_for(bob.id)]['vectors'], 2)
+			self.assertEqual(store.search(embeddings.embed_query('refunds ten days'), 2, user_id=self.user.id), [])
+			bob_client.delete(f'/api/qa/documents/{duplicate.id}/')
+		self.assertEqual(store.stats()['shards'][0]['vectors'] + store.stats()['shards'][1]['vectors'], 0)
+		self.assertFalse(os.listdir(os.path.join(self.media.name, 'bm25')))
+
+
+class DocumentListingTests(TestCase):
+	def setUp(self):
+		self.user = User.objects.create_user(username='hank', password='pw')
+		self.client = APIClient()
+		self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+		self.document = Document.objects.create(user=self.user, file='documents/big.txt', chunk_count=3)
+		save_chunks(self.document.id, chunk_pages([(1, 'First part.\n\nSecond part.'), (2, 'Third part.')], max_tokens=4))
+		ChatHistory.objects.create(user=self.user, document=self.document, question='q', answer='a')
+
+	def test_lists_are_slim(self):
+		documents = self.client.get('/api/qa/documents/').json()
+		self.assertEqual(set(documents[0]), {'id', 'file', 'filename', 'uploaded_at', 'status', 'error', 'chunk_count'})
+		with self.assertNumQueries(2):
+			history = self.client.get('/api/qa/history/').json()['results']
+		self.assertEqual(history[0]['document'], {'id': self.document.id, 'filename': 'documents/big.txt', 'status': 'ready'})
+
+	def test_full_text_is_paginated(self):
+		url = f'/api/qa/documents/{self.document.id}/chunks/'
+		page = self.client.get(url, {'page_size': 2}).json()
+		self.assertEqual(page['count'], 3)
+		self.assertEqual([chunk['text'] for chunk in page['results']], ['First part.', 'Second part.'])
+		last = self.client.get(url, {'page_size': 2, 'page': 2}).json()
+		self.assertEqual(last['results'], [{'position': 2, 'page': 2, 'section': '', 'text': 'Third part.'}])
+
+		other = User.objects.create_user(username='ivy', password='pw')
+		self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=other).key}')
+		self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@override_settings(DATABASE_READ_REPLICA='replica')
+class ReplicaRoutingTests(TransactionTestCase):
+	# ``replica`` is a test mirror of ``default`` in ai_chat.test_settings.
+	databases = {'default', 'replica'}
+
+	def setUp(self):
+		self.user = User.objects.create_user(username='olga', password='pw')
+		self.client = APIClient()
+		self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+		self.document = Document.objects.create(user=self.user, file='documents/a.txt')
+		ChatHistory.objects.create(user=self.user, document=self.document, question='q', answer='a')
+
+	def test_reads_use_the_replica_and_writes_the_primary(self):
+		self.client.get('/api/qa/documents/')
+		with self.assertNumQueries(0, using='default'), self.assertNumQueries(1, using='replica'):
+			self.assertEqual(self.client.get('/api/qa/documents/').status_code, 200)
+
+		with mock.patch('qa.views.get_llm', return_value=FakeChatModel()), \
+				mock.patch('qa.views.alookup_cached_answer', return_value=(None, None)), \
+				mock.patch('qa.views.abuild_prompt', return_value='prompt'), \
+				self.assertNumQueries(1, using='replica'):
+			response = self.client.post('/api/qa/qa/', {'question': 'hi', 'document_id': self.document.id}, format='json')
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(ChatHistory.objects.filter(question='hi').count(), 1)
+
+		# Deleting reads the primary: its rows decide which indexes are removed.
+		with self.assertNumQueries(0, using='replica'):
+			self.assertEqual(self.client.delete(f'/api/qa/documents/{self.document.id}/').status_code, 200)
+
+	def test_token_lookups_and_polled_views_read_the_primary(self):
+		_local_tokens.clear()
+		with self.assertNumQueries(0, using='replica'):
+			self.assertEqual(self.client.get('/api/qa/history/').status_code, 200)
+			self.assertEqual(self.client.get(f'/api/qa/documents/{self.document.id}/status/').status_code, 200)
+			self.assertEqual(self.client.get(f'/api/qa/documents/status/?ids={self.document.id}').status_code, 200)
+
+	@override_settings(CHAT_HISTORY_WRITE_BEHIND=True)
+	def test_write_behind_history(self):
+		with mock.patch('qa.views.get_llm', return_value=FakeChatModel()):
+			for question in ('first', 'second'):
+				self.assertEqual(self.client.post('/api/qa/qa/', {'question': question}, format='json').status_code, 200)
+		get_history_writer().flush()
+		self.assertEqual(list(ChatHistory.objects.filter(document=None).order_by('id').values_list('question', flat=True)), ['first', 'second'])
+
+
+class ChunkMigrationTests(TransactionTestCase):
+	def test_stored_chunks_are_copied_into_rows(self):
+		from django.db import connection
+		from django.db.migrations.executor import MigrationExecutor
+
+		executor = MigrationExecutor(connection)
+		executor.migrate([('qa', '0001_initial')])
+		apps = executor.loader.project_state([('qa', '0001_initial')]).apps
+		OldDocument = apps.get_model('qa', 'Document')
+		legacy = OldDocument.objects.create(file='documents/a.txt', chunks=['Refunds take ten days.', 'Refunds take ten days.'])
+		structured = OldDocument.objects.create(file='documents/b.pdf', chunks=[{'id': 'x', 'text': 'Pets are not allowed.', 'page': 2, 'section': 'Rules'}])
+
+		executor = MigrationExecutor(connection)
+		executor.loader.build_graph()
+		executor.migrate(executor.loader.graph.leaf_nodes('qa'))
+		rows = [row.as_chunk() for row in Document.objects.get(id=legacy.id).chunks.order_by('position')]
+		self.assertEqual(rows, assign_ids([
+			{'text': 'Refunds take ten days.', 'page': None, 'section': None},
+			{'text': 'Refunds take ten days.', 'page': None, 'section': None},
+		]))
+		self.assertEqual(rows[1]['id'], rows[0]['id'] + '-2')
+		document = Document.objects.get(id=structured.id)
+		self.assertEqual(document.chunk_count, 1)
+		self.assertEqual(document.chunks.get().as_chunk(), assign_ids([{'text': 'Pets are not allowed.', 'page': 2, 'section': 'Rules'}])[0])
+
+
+class TokenAuthenticationTests(TestCase):
+	def setUp(self):
+		self.user = User.objects.create_user(username='nora', password='pw')
+		self.token = Token.objects.create(user=self.user).key
+		self.client = APIClient()
+		self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+	def test_cached_token_skips_the_database(self):
+		self.assertEqual(self.client.get('/api/qa/documents/status/?ids=').status_code, 200)
+		with self.assertNumQueries(0):
+			self.assertEqual(self.client.get('/api/qa/documents/status/?ids=').status_code, 200)
+
+	def test_shared_tier_is_opt_in_and_must_be_shared(self):
+		# Stands in for a Redis cache every worker can reach.
+		shared = LocMemCache('token-test', {})
+		with mock.patch('qa.authentication._shared_cache', return_value=shared):
+			self.assertEqual(self.client.get('/api/qa/documents/status/?ids=').status_code, 200)
+			# Another process only has the shared cache.
+			_local_tokens.clear()
+			with self.assertNumQueries(0):
+				self.assertEqual(self.client.get('/api/qa/documents/status/?ids=').status_code, 200)
+			self.assertEqual(self.client.post('/api/qa/logout/').status_code, 200)
+			_local_tokens.clear()
+			self.assertEqual(self.client.get('/api/qa/documents/status/?ids=').status_code, 401)
+
+		from .authentication import _shared_cache
+		self.assertIsNone(_shared_cache())
+		with override_settings(TOKEN_AUTH_CACHE='default'), self.assertRaises(ImproperlyConfigured):
+			_shared_cache()
+
+	def test_logout_and_deactivation_revoke_cached_tokens(self):
+		self.assertEqual(self.client.get('/api/qa/documents/status/?ids=').status_code, 200)
+		self.assertEqual(self.client.post('/api/qa/logout/').status_code, 200)
+		self.assertEqual(self.client.get('/api/qa/documents/status/?ids=').status_code, 401)
+
+		token = Token.objects.create(user=self.user).key
+		self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+		self.assertEqual(self.client.get('/api/qa/documents/status/?ids=').status_code, 200)
+		self.user.is_active = False
+		self.user.save()
+		self.assertEqual(self.client.get('/api/qa/documents/status/?ids=').status_code, 401)
+
+	def test_login_is_throttled(self):
+		client = APIClient()
+		with mock.patch('rest_framework.throttling.ScopedRateThrottle.THROTTLE_RATES', {'login': '2/minute'}), \
+				mock.patch('rest_framework.throttling.ScopedRateThrottle.cache', LocMemCache('throttle-test', {})):
+			codes = [client.post('/api/qa/login/', {'username': 'nora', 'password': 'wrong'}).status_code for _ in range(3)]
+		self.assertEqual(codes, [401, 401, 429])
+
+
+class ChatHistoryPaginationTests(TestCase):
+	def setUp(self):
+		self.user = User.objects.create_user(username='jack', password='pw')
+		self.client = APIClient()
+		self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+		self.documents = [Document.objects.create(user=self.user, file=f'documents/{n}.txt') for n in range(3)]
+
+	def chat(self, n):
+		return ChatHistory.objects.create(user=self.user, document=self.documents[n % 3], question=f'q{n}', answer=f'a{n}')
+
+	def test_query_count_is_constant_per_page(self):
+		for n in range(3):
+			self.chat(n)
+		with self.assertNumQueries(3):
+			self.client.get('/api/qa/history/', {'page_size': 10})
+		for n in range(3, 30):
+			self.chat(n)
+		with self.assertNumQueries(2):
+			page = self.client.get('/api/qa/history/', {'page_size': 10}).json()
+		self.assertEqual([row['question'] for row in page['results']], [f'q{n}' for n in range(29, 19, -1)])
+
+		with self.assertNumQueries(2):
+			second = self.client.get(page['next']).json()
+		self.assertEqual(second['results'][0]['question'], 'q19')
+
+	def test_since_and_document_filters(self):
+		for n in range(4):
+			self.chat(n)
+		cutoff = ChatHistory.objects.get(question='q1').created_at
+		newer = self.client.get('/api/qa/history/', {'since': cutoff.isoformat()}).json()['results']
+		self.assertEqual([row['question'] for row in newer], ['q3', 'q2'])
+		by_document = self.client.get('/api/qa/history/', {'document_id': self.documents[0].id}).json()['results']
+		self.assertEqual([row['question'] for row in by_document], ['q3', 'q0'])
+		self.assertEqual(self.client.get('/api/qa/history/', {'since': 'yesterday'}).status_code, 400)
+
+	def test_unchanged_history_is_not_modified(self):
+		self.chat(0)
+		response = self.client.get('/api/qa/history/')
+		etag = response['ETag']
+		with self.assertNumQueries(1):
+			cached = self.client.get('/api/qa/history/', HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(cached.status_code, 304)
+
+		self.chat(1)
+		changed = self.client.get('/api/qa/history/', HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(changed.status_code, 200)
+		self.assertNotEqual(changed['ETag'], etag)
+
+	def test_browsers_may_revalidate_history(self):
+		preflight = self.client.options(
+			'/api/qa/history/', HTTP_ORIGIN='http://localhost:5173',
+			HTTP_ACCESS_CONTROL_REQUEST_METHOD='GET', HTTP_ACCESS_CONTROL_REQUEST_HEADERS='authorization, if-none-match',
+		)
+		self.assertIn('if-none-match', preflight['Access-Control-Allow-Headers'])
+		response = self.client.get('/api/qa/history/', HTTP_ORIGIN='http://localhost:5173')
+		self.assertEqual(response['Access-Control-Expose-Headers'], 'ETag')
+
+
+class CachedBatchEmbeddingsTests(TestCase):
+	def test_batches_and_never_reembeds_identical_chunks(self):
+		provider = FakeEmbeddings(dimensions=16)
+		embeddings = CachedBatchEmbeddings(provider, 'fake', cache=EmbeddingCache(':memory:'), batch_size=2, max_concurrency=2)
+		texts = ['alpha beta', 'gamma', 'alpha beta', 'delta', 'epsilon']
+		vectors = embeddings.embed_documents(texts)
+		self.assertEqual(provider.calls, 2)
+		self.assertEqual(vectors[0], vectors[2])
+		self.assertEqual(vectors, provider.embed_documents(texts))
+
+		provider.calls = 0
+		self.assertEqual(embeddings.embed_documents(['delta', 'gamma']), [vectors[3], vectors[1]])
+		self.assertEqual(provider.calls, 0)
+
+	def test_retries_failed_batches(self):
+		provider = FakeEmbeddings(dimensions=8)
+		failures = iter([RuntimeError('quota'), None])
+		original = provider.embed_documents
+
+		def flaky(texts):
+			error = next(failures)
+			if error:
+				raise error
+			return original(texts)
+
+		provider.embed_documents = flaky
+		embeddings = CachedBatchEmbeddings(provider, 'fake', backoff=0)
+		self.assertEqual(len(embeddings.embed_documents(['one'])), 1)
+
+	def test_caches_question_embeddings_by_normalized_text(self):
+		provider = FakeEmbeddings(dimensions=16)
+		cache = EmbeddingCache(':memory:')
+		embeddings = CachedBatchEmbeddings(provider, 'fake', cache=cache, query_cache_size=1)
+		vector = embeddings.embed_query('When is the invoice due?')
+		self.assertEqual(embeddings.embed_query('  when is the INVOICE due'), vector)
+		self.assertEqual(provider.calls, 1)
+		self.assertEqual(embeddings.embed_queries(['when is the invoice due', 'who signed it', 'Who signed it?']), [vector, provider._embed('who signed it'), provider._embed('who signed it')])
+		self.assertEqual(provider.calls, 2)
+
+		# A new process (fresh LRU) reads the persistent cache; document vectors are kept apart.
+		restarted = CachedBatchEmbeddings(provider, 'fake', cache=cache)
+		self.assertEqual(restarted.embed_query('When is the invoice due?'), vector)
+		self.assertEqual(provider.calls, 2)
+		restarted.embed_documents(['when is the invoice due'])
+		self.assertEqual(provider.calls, 3)
+
+
+class FakeStreamingLLM:
+	def __init__(self, tokens):
+		self.tokens = tokens
+		self.prompts = []
+
+	async def ainvoke(self, prompt):
+		self.prompts.append(prompt)
+		return mock.Mock(content=''.join(self.tokens))
+
+	async def astream(self, prompt):
+		self.prompts.append(prompt)
+		for token in self.tokens:
+			yield mock.Mock(content=token)
+
+
+class QAStreamTests(TestCase):
+	def setUp(self):
+		self.user = User.objects.create_user(username='bob', password='pw')
+		self.token = Token.objects.create(user=self.user).key
+
+	async def test_streams_tokens_then_saves_history(self):
+		client = AsyncClient()
+		with mock.patch('qa.views.get_llm', return_value=FakeStreamingLLM(['Hel', 'lo'])):
+			response = await client.post(
+				'/api/qa/qa/stream/', {'question': 'hi'}, content_type='application/json',
+				headers={'Authorization': f'Token {self.token}'},
+			)
+			self.assertEqual(response['Content-Type'], 'text/event-stream')
+			body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+		events = [block.split('\n') for block in body.strip().split('\n\n')]
+		self.assertEqual([lines[0] for lines in events], ['event: token', 'event: token', 'event: done'])
+		self.assertEqual(json.loads(events[-1][1][len('data: '):])['answer'], 'Hello')
+		self.assertEqual(await ChatHistory.objects.filter(user=self.user, answer='Hello').acount(), 1)
+
+	async def test_requires_authentication(self):
+		response = await AsyncClient().post('/api/qa/qa/stream/', {'question': 'hi'}, content_type='application/json')
+		self.assertEqual(response.status_code, 401)
+
+
+class AsyncQAViewTests(TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(self.tmp.cleanup)
+		self.user = User.objects.create_user(username='carol', password='pw')
+		self.token = Token.objects.create(user=self.user).key
+		self.embeddings = CachedBatchEmbeddings(FakeEmbeddings(dimensions=64), 'fake')
+		for target in ('qa.answering.get_embeddings', 'qa.embeddings.get_embeddings'):
+			patcher = mock.patch(target, return_value=self.embeddings)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def tearDown(self):
+		get_answer_cache().clear()
+
+	def test_answers_from_retrieved_context(self):
+		from langchain_community.vectorstores import FAISS
+		index_path = os.path.join(self.tmp.name, 'doc.index')
+		FAISS.from_texts(['The invoice is due on March 3.', 'Unrelated text about cats.'], self.embeddings).save_local(index_path)
+		document = Document.objects.create(user=self.user, file='documents/a.txt', faiss_index_path=index_path)
+
+		llm = FakeStreamingLLM(['March 3'])
+		client = APIClient()
+		client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+		with mock.patch('qa.views.get_llm', return_value=llm):
+			response = client.post('/api/qa/qa/', {'document_id': document.id, 'question': 'When is the invoice due?'}, format='json')
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.json()['answer'], 'March 3')
+		self.assertIn('The invoice is due on March 3.', llm.prompts[0])
+		self.assertTrue(ChatHistory.objects.filter(document=document, answer='March 3').exists())
+
+		with mock.patch('qa.views.get_llm', return_value=llm):
+			response = client.post('/api/qa/qa/', {'document_id': document.id, 'question': 'when is the invoice due'}, format='json')
+		self.assertEqual(response.json(), {'answer': 'March 3', 'cached': 'exact'})
+		self.assertEqual(len(llm.prompts), 1)
+
+	def test_answers_across_all_documents(self):
+		store = ShardedFaissStore(os.path.join(self.tmp.name, 'shared'), shards=2)
+		legacy = PerDocumentFaissStore(root=os.path.join(self.tmp.name, 'legacy'))
+		texts = {
+			'lease.pdf': ['The lease ends in June.', 'Pets are not allowed.'],
+			'invoice.pdf': ['The invoice total is 900 euros.'],
+		}
+		documents = {}
+		for name, chunks in texts.items():
+			documents[name] = Document.objects.create(user=self.user, file=f'documents/{name}')
+			vectors = self.embeddings.embed_documents(chunks)
+			rows = [{'text': text, 'page': 1} for text in chunks]
+			if name == 'lease.pdf':
+				store.add_document(documents[name].id, self.user.id, rows, vectors)
+			else:
+				path = legacy.add_document(documents[name].id, self.user.id, rows, vectors)
+				Document.objects.filter(id=documents[name].id).update(faiss_index_path=path)
+		Document.objects.create(user=self.user, file='documents/pending.pdf', status=Document.Status.QUEUED)
+
+		llm = FakeStreamingLLM(['June; 900 euros'])
+		client = APIClient()
+		client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+		with mock.patch('qa.vector_store.get_vector_store', return_value=store), \
+				mock.patch('qa.vector_store.get_legacy_store', return_value=legacy), \
+				mock.patch('qa.views.get_llm', return_value=llm):
+			response = client.post('/api/qa/qa/', {'all_documents': True, 'question': 'When does the lease end and what is the invoice total?'}, format='json')
+			self.assertEqual(response.status_code, 200)
+			self.assertIn('[lease.pdf, Page 1] The lease ends in June.', llm.prompts[0])
+			self.assertIn('[invoice.pdf, Page 1] The invoice total is 900 euros.', llm.prompts[0])
+			self.assertTrue(ChatHistory.objects.filter(document__isnull=True, answer='June; 900 euros').exists())
+
+			ids = [documents['invoice.pdf'].id, documents['lease.pdf'].id]
+			response = client.post('/api/qa/qa/', {'document_ids': ids, 'question': 'when does the lease end and what is the invoice total'}, format='json')
+			self.assertEqual(response.json()['cached'], 'exact')
+			get_answer_cache().invalidate(documents['lease.pdf'].id)
+			response = client.post('/api/qa/qa/', {'document_ids': ids, 'question': 'when does the lease end and what is the invoice total'}, format='json')
+			self.assertIsNone(response.json()['cached'])
+
+		response = client.post('/api/qa/qa/', {'document_id': ids[0], 'document_ids': ids, 'question': 'Hi'}, format='json')
+		self.assertEqual(response.status_code, 400)
+		response = client.post('/api/qa/qa/', {'document_ids': [ids[0], 999999], 'question': 'Hi'}, format='json')
+		self.assertEqual(response.status_code, 404)
+
+	def _shared_document(self):
+		store = ShardedFaissStore(os.path.join(self.tmp.name, 'shared'), shards=1)
+		document = Document.objects.create(user=self.user, file='documents/policy.pdf')
+		texts = ['Refunds take ten days.', 'Shipping is free over fifty euros.', 'Returns need a receipt.']
+		store.add_document(document.id, self.user.id, [{'text': text, 'page': i + 1} for i, text in enumerate(texts)], self.embeddings.embed_documents(texts))
+		return store, document
+
+	@override_settings(RERANKING=True, METRICS_ENABLED=True)
+	def test_reranking_answers_off_topic_questions_without_the_llm(self):
+		store, document = self._shared_document()
+		llm = FakeStreamingLLM(['Ten days.'])
+		client = APIClient()
+		client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+		exits = NOT_FOUND_EARLY_EXITS.value()
+		with mock.patch('qa.vector_store.get_vector_store', return_value=store), mock.patch('qa.views.get_llm', return_value=llm):
+			response = client.post('/api/qa/qa/', {'document_id': document.id, 'question': 'What is the capital of France?'}, format='json')
+			self.assertEqual(response.json()['answer'], NOT_FOUND_ANSWER)
+			self.assertEqual(llm.prompts, [])
+			self.assertEqual(NOT_FOUND_EARLY_EXITS.value(), exits + 1)
+
+			response = client.post('/api/qa/qa/', {'document_id': document.id, 'question': 'how long do refunds take'}, format='json')
+		self.assertEqual(response.json()['answer'], 'Ten days.')
+		self.assertIn('Refunds take ten days.', llm.prompts[0])
+		self.assertNotIn('Shipping is free', llm.prompts[0])
+
+	async def test_batch_retrieve_only_streams_ranked_chunks(self):
+		store, document = await sync_to_async(self._shared_document)()
+		calls = self.embeddings.provider.calls
+		with mock.patch('qa.vector_store.get_vector_store', return_value=store):
+			response = await AsyncClient().post(
+				'/api/qa/qa/batch/',
+				{'document_id': document.id, 'questions': ['how long do refunds take', 'is shipping free', 'what do returns need'], 'retrieve_only': True, 'k': 2},
+				content_type='application/json', headers={'Authorization': f'Token {self.token}'},
+			)
+			self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+			lines = [json.loads(line) for line in b''.join([chunk async for chunk in response.streaming_content]).decode().splitlines()]
+		self.assertEqual(self.embeddings.provider.calls, calls + 1)
+		self.assertEqual([line['index'] for line in lines], [0, 1, 2])
+		self.assertEqual([line['chunks'][0]['text'] for line in lines], ['Refunds take ten days.', 'Shipping is free over fifty euros.', 'Returns need a receipt.'])
+		self.assertEqual(lines[1]['chunks'][0]['page'], 2)
+		self.assertGreater(lines[0]['chunks'][0]['score'], lines[0]['chunks'][1]['score'])
+
+	def test_batch_command_answers_each_question(self):
+		from io import StringIO
+		from django.core.management import call_command
+		store, document = self._shared_document()
+		questions = os.path.join(self.tmp.name, 'questions.txt')
+		with open(questions, 'w') as fh:
+			fh.write('How long do refunds take?\n\nIs shipping free?\n')
+		output = os.path.join(self.tmp.name, 'answers.jsonl')
+		llm = FakeStreamingLLM(['See the policy.'])
+		with mock.patch('qa.vector_store.get_vector_store', return_value=store), mock.patch('qa.batch.get_llm', return_value=llm):
+			call_command('batch_qa', document=[document.id], questions=questions, output=output, concurrency=2, stderr=StringIO())
+			call_command('batch_qa', document=[document.id], questions=questions, output=output, stderr=StringIO())
+		with open(output) as fh:
+			lines = sorted((json.loads(line) for line in fh), key=lambda line: line['index'])
+		self.assertEqual([(line['question'], line['answer'], line['cached']) for line in lines], [
+			('How long do refunds take?', 'See the policy.', 'exact'), ('Is shipping free?', 'See the policy.', 'exact'),
+		])
+		self.assertEqual(len(llm.prompts), 2)
+		self.assertTrue(any('Refunds take ten days.' in prompt for prompt in llm.prompts))
+		self.assertFalse(ChatHistory.objects.exists())
+
+
+class SuggestedQuestionTests(TestCase):
+	def test_templates_follow_the_text(self):
+		from .suggestions import template_questions
+		chunks = [
+			{'text': 'This agreement is made between the Landlord and the Tenant.', 'section': None},
+			{'text': 'Rent of €900 is due on 1 March 2025.', 'section': 'Section 2 Payment'},
+		]
+		self.assertEqual(template_questions(chunks), [
+			'What is this document about?', 'Who are the parties involved?', 'What are the key dates and deadlines?',
+			'What amounts, prices or fees are mentioned?', 'What does the document say about Section 2 Payment?',
+		])
+
+	def test_suggested_question_skips_embedding_and_search(self):
+		from .suggestions import build_suggestions
+		user = User.objects.create_user(username='hana', password='pw')
+		document = Document.objects.create(user=user, file='documents/lease.txt')
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		store = ShardedFaissStore(tmp.name, shards=1)
+		provider = mock.Mock(wraps=FakeEmbeddings(dimensions=16))
+		chunks = [{'text': 'The tenant shall pay rent monthly.', 'page': 1}, {'text': 'Pets are not allowed.', 'page': 2}]
+		store.add_document(document.id, user.id, chunks, provider.embed_documents([chunk['text'] for chunk in chunks]))
+		with mock.patch('qa.vector_store.get_vector_store', return_value=store), \
+				mock.patch('qa.answering.get_embeddings', return_value=provider):
+			questions = build_suggestions(document, chunks)
+			self.assertEqual(questions, ['What is this document about?', 'Who are the parties involved?', 'What are the main obligations and requirements?'])
+			self.assertEqual(provider.embed_queries.call_count, 1)
+
+			with mock.patch.object(store, 'search_many', side_effect=AssertionError('searched')):
+				context = retrieve([document], 'what are the main obligations and requirements', k=1)
+		self.assertEqual([(chunk.page_content, chunk.metadata['page']) for chunk in context], [('The tenant shall pay rent monthly.', 1)])
+		provider.embed_query.assert_not_called()
+
+
+class AnswerCacheTests(TestCase):
+	def test_exact_match_ignores_case_and_punctuation(self):
+		cache = AnswerCache()
+		cache.put(1, 'What is the deadline?', 'Friday')
+		self.assertEqual(cache.get(1, '  what is the DEADLINE '), ('Friday', 'exact'))
+		self.assertIsNone(cache.get(2, 'What is the deadline?'))
+
+	def test_near_duplicate_uses_similarity_threshold(self):
+		embeddings = FakeEmbeddings(dimensions=64)
+		cache = AnswerCache(similarity_threshold=0.8)
+		cache.put(1, 'summarize this document', 'A summary', embeddings.embed_query('summarize this document'))
+		self.assertEqual(cache.get(1, 'please summarize this document', embeddings.embed_query('please summarize this document')), ('A summary', 'semantic'))
+		self.assertIsNone(cache.get(1, 'who signed it', embeddings.embed_query('who signed it')))
+
+	def test_ttl_size_and_invalidation(self):
+		cache = AnswerCache(max_entries=2, ttl=0)
+		cache.put(1, 'a', 'x')
+		self.assertIsNone(cache.get(1, 'a'))
+		self.assertEqual(cache.stats()['expirations'], 1)
+
+		cache = AnswerCache(max_entries=2)
+		cache.put(1, 'a', 'x')
+		cache.put(1, 'b', 'y')
+		cache.put(2, 'c', 'z')
+		self.assertIsNone(cache.get(1, 'a'))
+		self.assertEqual(cache.stats()['evictions'], 1)
+		cache.invalidate(1)
+		self.assertIsNone(cache.get(1, 'b'))
+		self.assertEqual(cache.get(2, 'c'), ('z', 'exact'))
+
+	def test_replaced_document_misses_in_other_workers(self):
+		user = User.objects.create_user(username='ravi', password='pw')
+		document = Document.objects.create(user=user, file='documents/lease.txt', content_hash='a' * 64)
+		handling_worker, other_worker = AnswerCache(), AnswerCache()
+		for cache in (handling_worker, other_worker):
+			cache.put(answer_scope([document]), 'When is rent due?', 'On Mondays')
+		with mock.patch('qa.answering.get_answer_cache', return_value=other_worker):
+			self.assertEqual(async_to_sync(alookup_cached_answer)([document], 'when is rent due')[0], ('On Mondays', 'exact'))
+
+		# Replaced through the handling worker, which is the only one that sees the invalidation.
+		Document.objects.filter(id=document.id).update(content_hash='b' * 64)
+		handling_worker.invalidate(document.id)
+		self.assertEqual(handling_worker.stats()['entries'], 0)
+		document.refresh_from_db()
+		with mock.patch('qa.answering.get_answer_cache', return_value=other_worker):
+			self.assertIsNone(async_to_sync(alookup_cached_answer)([document], 'when is rent due')[0])
+
+
+class PromptBudgetTests(TestCase):
+	def setUp(self):
+		self.user = User.objects.create_user(username='erin', password='pw')
+		self.document = Document.objects.create(user=self.user, file='documents/a.txt')
+
+	def chunk(self, text):
+		from langchain_core.documents import Document as LangchainDocument
+		return LangchainDocument(page_content=text, metadata={'page': 1})
+
+	def test_fills_budget_in_priority_order(self):
+		chunks = [self.chunk('best passage ' * 20), self.chunk('second passage ' * 20), self.chunk('third passage ' * 20)]
+		history = [ChatHistory(question='old question', answer='long answer ' * 100), ChatHistory(question='last question', answer='short')]
+		base = count_tokens(format_prompt('Q?', [], ()))
+		budget = base + sum(count_tokens(_cite(chunk) + CONTEXT_SEPARATOR) for chunk in chunks[:2]) + count_tokens(format_turn(history[1]))
+		with override_settings(PROMPT_TOKEN_BUDGET=budget):
+			prompt = fit_prompt('Q?', chunks, history, summary='earlier facts')
+		self.assertIn('best passage', prompt)
+		self.assertIn('second passage', prompt)
+		self.assertNotIn('third passage', prompt)
+		self.assertIn('last question', prompt)
+		self.assertNotIn('old question', prompt)
+		self.assertNotIn('earlier facts', prompt)
+		self.assertLessEqual(count_tokens(prompt), budget)
+
+	def test_older_turns_are_summarized_once(self):
+		for n in range(MAX_HISTORY + 2):
+			ChatHistory.objects.create(user=self.user, document=self.document, question=f'question {n}?', answer=f'Answer {n}. More detail.')
+		with mock.patch('qa.prompting.extractive_summary', wraps=extractive_summary) as summarizer:
+			summary, recent = conversation_history(self.user, [self.document])
+			self.assertEqual([chat.question for chat in summarizer.call_args.args[1]], ['question 0?', 'question 1?'])
+			self.assertEqual([chat.question for chat in recent], [f'question {n}?' for n in range(2, MAX_HISTORY + 2)])
+			self.assertIn('Answered: Answer 1.', summary)
+			self.assertNotIn('More detail', summary)
+
+			ChatHistory.objects.create(user=self.user, document=self.document, question='question new?', answer='New.')
+			summary, recent = conversation_history(self.user, [self.document])
+			self.assertEqual([chat.question for chat in summarizer.call_args.args[1]], ['question 2?'])
+			self.assertEqual(summarizer.call_count, 2)
+		self.assertIn('question 0?', summary)
+		self.assertIn('question 2?', summary)
+		self.assertEqual(ConversationSummary.objects.get(user=self.user, scope=str(self.document.id)).summary, summary)
+
+	def test_multi_document_conversations_keep_their_own_turns(self):
+		other = Document.objects.create(user=self.user, file='documents/b.txt')
+		async_to_sync(asave_chat)(self.user, [self.document], 'about a?', 'A.')
+		async_to_sync(asave_chat)(self.user, [other, self.document], 'about both?', 'Both.')
+		async_to_sync(asave_chat)(self.user, [other], 'about b?', 'B.')
+		self.assertEqual([chat.question for chat in conversation_history(self.user, [self.document, other])[1]], ['about both?'])
+		self.assertEqual([chat.question for chat in conversation_history(self.user, [self.document])[1]], ['about a?'])
+		self.assertEqual(ChatHistory.objects.get(question='about both?').document, None)
+
+
+class RerankingTests(TestCase):
+	def candidates(self, *items):
+		return [(_as_langchain_document(text, {'document_id': 1}), score) for text, score in items]
+
+	def test_cutoff_and_diversity(self):
+		candidates = self.candidates(
+			('Refunds take ten days after the return arrives.', 0.62),
+			('Refunds take ten days once the return arrives.', 0.61),
+			('Refunds for damaged items are paid at once.', 0.55),
+			('Cats sleep most of the day.', 0.2),
+			('Refund form REF-7 must be signed.', None),
+		)
+		question = 'How long do refunds take?'
+		self.assertEqual([chunk.page_content for chunk in rerank(question, candidates, 2, mmr_lambda=1.0)], [
+			'Refunds take ten days after the return arrives.', 'Refunds take ten days once the return arrives.',
+		])
+		# With diversity weighted in, the near-duplicate gives way to a different relevant chunk.
+		self.assertEqual([chunk.page_content for chunk in rerank(question, candidates, 3, mmr_lambda=0.5)], [
+			'Refunds take ten days after the return arrives.', 'Refunds for damaged items are paid at once.',
+			'Refunds take ten days once the return arrives.',
+		])
+		off_topic = self.candidates(('Refunds take ten days.', 0.25), ('Cats sleep most of the day.', 0.3))
+		self.assertEqual(rerank('What is the capital of France?', off_topic, 2), [])
+
+	def test_keyword_only_candidates_use_term_coverage(self):
+		candidates = self.candidates(('Invoice INV-2024-07 is overdue.', None), ('The weather is sunny.', None))
+		self.assertEqual([chunk.page_content for chunk in rerank('status of INV-2024-07', candidates, 2)], ['Invoice INV-2024-07 is overdue.'])
+
+
+class KeywordIndexTests(TestCase):
+	chunks = [
+		{'text': 'Invoice INV-2024-0042 is due on 3 March.', 'page': 1},
+		{'text': 'Invoice INV-2024-0043 was paid in full.', 'page': 2},
+		{'text': 'Payment is expected within thirty days of delivery.', 'page': 2},
+		{'text': 'Clause 4.2.1 limits liability to the contract value.', 'page': 3},
+	]
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(self.tmp.cleanup)
+		override = override_settings(KEYWORD_INDEX_ROOT=self.tmp.name)
+		override.enable()
+		self.addCleanup(override.disable)
+
+	def test_exact_identifiers_rank_first_and_survive_reload(self):
+		index = KeywordIndex.build(self.chunks)
+		hits, confidence = index.search('INV-2024-0042', k=2)
+		self.assertEqual([chunk_id for chunk_id, _ in hits], [0, 1])
+		self.assertGreater(confidence, 0.8)
+		self.assertLess(index.search('What does INV-2024-0042 say about penalties?', k=2)[1], confidence)
+		self.assertEqual(index.search('clause 4.2.1', k=1)[0][0][0], 3)
+
+		path = os.path.join(self.tmp.name, 'saved')
+		index.save(path)
+		loaded = KeywordIndex.load(path)
+		self.assertEqual(loaded.search('INV-2024-0042', k=2), (hits, confidence))
+		chunk = loaded.chunk(3, document_id=7)
+		self.assertEqual(chunk.page_content, self.chunks[3]['text'])
+		self.assertEqual(chunk.metadata, {'document_id': 7, 'chunk_id': 3, 'page': 3})
+
+	def test_fast_path_skips_embedding_and_fusion_merges_both(self):
+		user = User.objects.create_user(username='frank', password='pw')
+		document = Document.objects.create(user=user, file='documents/invoices.pdf')
+		embeddings = FakeEmbeddings(dimensions=64)
+		store = ShardedFaissStore(os.path.join(self.tmp.name, 'shared'), shards=1)
+		store.add_document(document.id, user.id, self.chunks, embeddings.embed_documents([chunk['text'] for chunk in self.chunks]))
+		build_keyword_index(document.id, self.chunks)
+
+		provider = mock.Mock(wraps=embeddings)
+		with mock.patch('qa.answering.get_embeddings', return_value=provider), \
+				mock.patch('qa.vector_store.get_vector_store', return_value=store):
+			chunks = retrieve([document], 'INV-2024-0042', k=2)
+			self.assertEqual(chunks[0].page_content, self.chunks[0]['text'])
+			provider.embed_query.assert_not_called()
+
+			chunks = retrieve([document], 'When should the payment for the invoice arrive?', k=3)
+			provider.embed_query.assert_called_once()
+		texts = [chunk.page_content for chunk in chunks]
+		self.assertIn(self.chunks[2]['text'], texts)
+		self.assertEqual(len(set(texts)), len(texts))
+
+	def test_reciprocal_rank_fusion_rewards_agreement(self):
+		from langchain_core.documents import Document as LangchainDocument
+		a, b, c = [LangchainDocument(page_content=text, metadata={'document_id': 1}) for text in 'abc']
+		fused = reciprocal_rank_fusion([[(a, 0.9), (b, 0.8)], [(b, 7.0), (c, 3.0)]], k=3)
+		self.assertEqual([chunk.page_content for chunk in fused], ['b', 'a', 'c'])
+
+
+class ExtractionTests(TestCase):
+	def test_chunks_keep_page_numbers(self):
+		chunks = chunk_pages([(1, 'first page'), (2, ''), (3, 'third page')])
+		self.assertEqual([(chunk['text'], chunk['page']) for chunk in chunks], [('first page', 1), ('third page', 3)])
+
+	def test_txt_streams_from_path(self):
+		with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as fh:
+			fh.write('plain text')
+		self.addCleanup(os.remove, fh.name)
+		self.assertEqual(list(iter_pages(fh.name, 'notes.txt')), [(None, 'plain text')])
+
+	@override_settings(PDF_PAGES_PER_TASK=1, PDF_EXTRACTION_WORKERS=2)
+	def test_pdf_ranges_are_resubmitted_when_a_worker_dies(self):
+		from concurrent.futures import Future
+		from concurrent.futures.process import BrokenProcessPool
+		from .extraction import iter_pdf_pages
+
+		pools = []
+
+		class FakePool:
+			def __init__(self, workers):
+				self.broken = not pools  # Only the first pool loses its worker.
+				pools.append(self)
+
+			def submit(self, func, path, start, stop, page_timeout):
+				future = Future()
+				if self.broken:
+					future.set_exception(BrokenProcessPool('worker died'))
+				else:
+					future.set_result([(start + 1, f'page {start + 1}')])
+				return future
+
+			def shutdown(self, **kwargs):
+				pass
+
+		pdf = mock.MagicMock()
+		pdf.__enter__.return_value.pages = [None, None]
+		with mock.patch('pdfplumber.open', return_value=pdf), mock.patch('qa.extraction._new_pool', FakePool):
+			pages = list(iter_pdf_pages('/tmp/a.pdf'))
+		self.assertEqual(pages, [(1, 'page 1'), (2, 'page 2')])
+		self.assertEqual(len(pools), 2)
+
+	@override_settings(PDF_PAGES_PER_TASK=16, PDF_EXTRACTION_WORKERS=2)
+	def test_small_pdfs_are_extracted_without_a_pool(self):
+		from .extraction import iter_pdf_pages
+		page = mock.Mock(**{'extract_text.return_value': 'short text'})
+		pdf = mock.MagicMock()
+		pdf.__enter__.return_value.pages = [page, page]
+		with mock.patch('pdfplumber.open', return_value=pdf), mock.patch('qa.extraction._new_pool') as new_pool:
+			pages = list(iter_pdf_pages('/tmp/a.pdf'))
+		self.assertEqual(pages, [(1, 'short text'), (2, 'short text')])
+		new_pool.assert_not_called()
+
+
+class ChunkingTests(TestCase):
+	def test_follows_headings_and_token_budget(self):
+		text = (
+			'1. DEFINITIONS\n"Tenant" means the person renting\nthe flat.\n\n'
+			'2.1 Rent\n' + 'The rent is paid monthly. ' * 30 + '\n\nA short closing note.'
+		)
+		chunks = chunk_pages([(1, text), (2, 'SCHEDULE A\n'), (3, 'Inventory of furniture.')], max_tokens=40)
+		self.assertEqual(chunks[0]['text'], '1. DEFINITIONS\n"Tenant" means the person renting the flat.')
+		self.assertTrue(chunks[1]['text'].startswith('2.1 Rent\nThe rent is paid monthly.'))
+		self.assertTrue(all(chunk['section'] == '2.1 Rent' for chunk in chunks[1:-1]))
+		self.assertTrue(all(count_tokens(chunk['text']) <= 40 + count_tokens('2.1 Rent') for chunk in chunks))
+		self.assertEqual(chunks[-2]['text'].split('. ')[-1], 'A short closing note.')
+		self.assertEqual((chunks[-1]['text'], chunks[-1]['page']), ('SCHEDULE A\nInventory of furniture.', 3))
+
+	def test_ids_are_stable_content_hashes(self):
+		first = chunk_pages([(1, 'Alpha paragraph.\n\nBeta paragraph.'), (2, 'Alpha paragraph.')], max_tokens=8)
+		second = chunk_pages([(1, 'Alpha paragraph.\n\nBeta paragraph, edited.'), (2, 'Alpha paragraph.')], max_tokens=8)
+		self.assertEqual(first[0]['id'], second[0]['id'])
+		self.assertNotEqual(first[1]['id'], second[1]['id'])
+		self.assertEqual(first[2]['id'], f"{first[0]['id']}-2")
+		self.assertEqual(len({chunk['id'] for chunk in first}), 3)
+
+
+class ShardedFaissStoreTests(TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(self.tmp.cleanup)
+		self.embeddings = FakeEmbeddings(dimensions=32)
+		patcher = mock.patch('qa.embeddings.get_embeddings', return_value=CachedBatchEmbeddings(self.embeddings, 'fake'))
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def add(self, store, document_id, user_id, texts):
+		chunks = [{'text': text, 'page': i + 1} for i, text in enumerate(texts)]
+		store.add_document(document_id, user_id, chunks, self.embeddings.embed_documents(texts))
+
+	def search(self, store, question, k=3, **filters):
+		return store.search(self.embeddings.embed_query(question), k, **filters)
+
+	def test_filtered_search_and_removal(self):
+		store = ShardedFaissStore(self.tmp.name, shards=2)
+		self.add(store, 1, 10, ['invoice number 42 is overdue', 'the weather is sunny'])
+		self.add(store, 2, 11, ['invoice number 42 was paid'])
+
+		results = self.search(store, 'invoice number 42', document_ids=[1])
+		self.assertEqual([doc.metadata['document_id'] for doc, _ in results], [1, 1])
+		self.assertEqual(results[0][0].page_content, 'invoice number 42 is overdue')
+		self.assertEqual(results[0][0].metadata['page'], 1)
+
+		across = self.search(store, 'invoice number 42', k=2, document_ids=[1, 2])
+		self.assertEqual({doc.metadata['document_id'] for doc, _ in across}, {1, 2})
+		self.assertEqual([doc.metadata['document_id'] for doc, _ in self.search(store, 'invoice', user_id=11)], [2])
+
+		store.remove_document(1)
+		self.assertEqual(self.search(store, 'invoice number 42', document_ids=[1]), [])
+		self.assertEqual(len(self.search(store, 'invoice number 42', document_ids=[2])), 1)
+
+	def test_writes_append_deltas_that_other_processes_replay(self):
+		store = ShardedFaissStore(self.tmp.name, shards=1)
+		self.add(store, 1, 10, ['invoice number 42 is overdue', 'the weather is sunny'])
+		other = ShardedFaissStore(self.tmp.name, shards=1)
+		self.assertEqual(len(self.search(other, 'invoice number 42', document_ids=[1])), 2)
+		shard_file = os.stat(store._shard_path(0))
+
+		self.add(store, 2, 10, ['invoice number 42 was paid'])
+		store.remove_document(1)
+		self.assertEqual(os.stat(store._shard_path(0)).st_mtime_ns, shard_file.st_mtime_ns)
+		self.assertGreater(os.path.getsize(store._delta_path(0)), 0)
+
+		with mock.patch.object(other, '_members') as members:
+			self.assertEqual([doc.metadata['document_id'] for doc, _ in self.search(other, 'invoice number 42', user_id=10)], [2])
+			self.assertEqual(self.search(other, 'invoice number 42', document_ids=[1]), [])
+		members.assert_not_called()
+		reopened = ShardedFaissStore(self.tmp.name, shards=1)
+		self.assertEqual(reopened.stats()['shards'][0]['vectors'], 1)
+
+		store.optimize_shard(0)
+		self.assertEqual(os.path.getsize(store._delta_path(0)), 0)
+		self.assertEqual([doc.page_content for doc, _ in self.search(other, 'invoice number 42')], ['invoice number 42 was paid'])
+
+	def test_large_shards_switch_to_ivf(self):
+		import faiss
+		store = ShardedFaissStore(self.tmp.name, shards=1, ivf_min_vectors=40, nprobe=64)
+		for document_id in range(5):
+			self.add(store, document_id, 1, [f'document {document_id} clause {n} text' for n in range(10)])
+		self.assertIsInstance(store._load_shard(0), faiss.IndexIVF)
+		results = self.search(store, 'document 3 clause 7 text', k=1, document_ids=[3])
+		self.assertEqual(results[0][0].page_content, 'document 3 clause 7 text')
+
+		reopened = ShardedFaissStore(self.tmp.name, shards=1, ivf_min_vectors=40)
+		self.assertEqual(reopened.stats()['shards'][0]['vectors'], 50)
+
+	def test_quantized_memory_mapped_shards(self):
+		store = ShardedFaissStore(self.tmp.name, shards=1, ivf_min_vectors=40, quantization='sq8', mmap=True)
+		self.add(store, 1, 1, ['invoice number 42 is overdue', 'the weather is sunny'])
+		self.assertEqual(store.stats()['shards'][0]['type'], 'IndexIDMap2(IndexScalarQuantizer)')
+		for document_id in range(2, 7):
+			self.add(store, document_id, 1, [f'document {document_id} clause {n} text' for n in range(10)])
+		self.assertEqual(store.stats()['shards'][0]['type'], 'IndexIVFScalarQuantizer')
+		results = self.search(store, 'invoice number 42 overdue', k=1, document_ids=[1])
+		self.assertEqual(results[0][0].page_content, 'invoice number 42 is overdue')
+
+	def test_rebuild_command_reports_size_and_recall(self):
+		from io import StringIO
+		from django.core.management import call_command
+		store = ShardedFaissStore(self.tmp.name, shards=1)
+		self.add(store, 1, 1, [f'clause {n} covers topic {n * 7}' for n in range(30)])
+		out = StringIO()
+		with mock.patch('qa.management.commands.rebuild_vector_indexes.get_vector_store', return_value=store):
+			call_command('rebuild_vector_indexes', quantization='sq8', stdout=out)
+		self.assertIn('IndexIDMap2(IndexFlatIP) -> IndexIDMap2(IndexScalarQuantizer)', out.getvalue())
+		self.assertIn('recall@5 1.000 ->', out.getvalue())
+		self.assertEqual(store.stats()['shards'][0]['type'], 'IndexIDMap2(IndexScalarQuantizer)')
+		self.assertEqual(len(self.search(store, 'clause 3', document_ids=[1])), 3)
+
+	@override_settings(CHUNK_MAX_TOKENS=12)
+	def test_replaced_document_only_embeds_changed_chunks(self):
+		user = User.objects.create_user(username='gina', password='pw')
+		document = Document.objects.create(user=user, file='documents/policy.txt')
+		store = ShardedFaissStore(os.path.join(self.tmp.name, 'shared'), shards=1)
+		provider = mock.Mock(wraps=self.embeddings)
+		version_1 = 'Refunds take ten days.\n\nShipping is free over fifty euros.\n\nReturns need a receipt.'
+		version_2 = 'Refunds take ten days.\n\nShipping costs five euros.\n\nReturns need a receipt.'
+		with override_settings(KEYWORD_INDEX_ROOT=self.tmp.name), \
+				mock.patch('qa.ingestion.get_vector_store', return_value=store), \
+				mock.patch('qa.embeddings.get_embeddings', return_value=provider):
+			build_index(document, chunk_pages([(None, version_1)]))
+			self.assertEqual(len(provider.embed_documents.call_args.args[0]), 3)
+			before = dict(store._db().execute('SELECT text, vector_id FROM chunks'))
+
+			build_index(document, chunk_pages([(None, version_2)]))
+			self.assertEqual(provider.embed_documents.call_args.args[0], ['Shipping costs five euros.'])
+		after = dict(store._db().execute('SELECT text, vector_id FROM chunks'))
+		self.assertEqual(set(after), {'Refunds take ten days.', 'Shipping costs five euros.', 'Returns need a receipt.'})
+		self.assertEqual(after['Returns need a receipt.'], before['Returns need a receipt.'])
+		self.assertEqual(store.stats()['shards'][0]['vectors'], 3)
+		results = self.search(store, 'shipping costs five euros', k=1, document_ids=[document.id])
+		self.assertEqual(results[0][0].page_content, 'Shipping costs five euros.')
+
+	def test_import_legacy_indexes(self):
+		from django.core.management import call_command
+		from io import StringIO
+
+		user = User.objects.create_user(username='dave', password='pw')
+		legacy = PerDocumentFaissStore(root=os.path.join(self.tmp.name, 'legacy'))
+		document = Document.objects.create(user=user, file='documents/a.txt')
+		texts = ['alpha clause', 'payment schedule for tenants']
+		path = legacy.add_document(document.id, user.id, [{'text': t, 'page': None} for t in texts], self.embeddings.embed_documents(texts))
+		Document.objects.filter(id=document.id).update(faiss_index_path=path)
+
+		store = ShardedFaissStore(os.path.join(self.tmp.name, 'shared'), shards=2)
+		with mock.patch('qa.management.commands.import_faiss_indexes.get_vector_store', return_value=store), \
+				mock.patch('qa.management.commands.import_faiss_indexes.get_legacy_store', return_value=legacy):
+			call_command('import_faiss_indexes', stdout=StringIO())
+
+		document.refresh_from_db()
+		self.assertIsNone(document.faiss_index_path)
+		self.assertFalse(os.path.exists(path))
+		self.assertEqual(self.search(store, 'payment schedule', k=1, document_ids=[document.id])[0][0].page_content, 'payment schedule for tenants')
+
+
+class StorageCheckTests(TestCase):
+	def setUp(self):
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.root = tmp.name
+		settings = override_settings(MEDIA_ROOT=os.path.join(self.root, 'media'), KEYWORD_INDEX_ROOT=os.path.join(self.root, 'keywords'))
+		settings.enable()
+		self.addCleanup(settings.disable)
+		self.store = ShardedFaissStore(os.path.join(self.root, 'shared'), shards=1)
+		self.legacy = PerDocumentFaissStore(os.path.join(self.root, 'legacy'))
+		for target, store in (('qa.storage_check.get_vector_store', self.store), ('qa.storage_check.get_legacy_store', self.legacy)):
+			patcher = mock.patch(target, return_value=store)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+		self.embeddings = FakeEmbeddings(dimensions=8)
+		self.user = User.objects.create_user(username='pia', password='pw')
+
+	def upload(self, name, age=0):
+		path = os.path.join(self.root, 'media', 'documents', name)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path, 'w') as fh:
+			fh.write('x' * 100)
+		os.utime(path, (time.time() - age, time.time() - age))
+		return f'documents/{name}'
+
+	def index(self, document_id, texts):
+		chunks = assign_ids([{'text': text, 'page': 1} for text in texts])
+		self.store.add_document(document_id, self.user.id, chunks, self.embeddings.embed_documents(texts))
+		build_keyword_index(document_id, chunks)
+		return chunks
+
+	def test_dry_run_reports_then_run_reconciles(self):
+		kept = Document.objects.create(user=self.user, file=self.upload('kept.txt', age=7200), chunk_count=1)
+		save_chunks(kept.id, self.index(kept.id, ['kept text']))
+		self.upload('orphan.txt', age=7200)
+		self.upload('in_progress.txt')
+		self.index(999, ['deleted document'])
+		os.makedirs(self.legacy.index_path(998))
+		no_keywords = Document.objects.create(user=self.user, file=self.upload('nokw.txt', age=7200), chunk_count=1)
+		chunks = self.index(no_keywords.id, ['keywords are gone'])
+		save_chunks(no_keywords.id, chunks)
+		remove_keyword_index(no_keywords.id)
+		lost = Document.objects.create(user=self.user, file='documents/lost.txt', chunk_count=2)
+
+		dry = StorageCheck(dry_run=True)
+		findings = {(finding['check'], finding['action']) for finding in dry.run()}
+		self.assertEqual(findings, {
+			('orphan_upload', 'would remove'), ('orphan_vectors', 'would remove'),
+			('orphan_keyword_index', 'would remove'), ('missing_keyword_index', 'would rebuild'), ('missing_index', 'would mark failed'),
+		})
+		self.assertEqual(dry.counts['orphan_vectors'], 2)
+		self.assertGreaterEqual(dry.reclaimed, 100)
+		self.assertTrue(os.path.exists(os.path.join(self.root, 'media', 'documents', 'orphan.txt')))
+		self.assertEqual(self.store.indexed_documents([999]), {999})
+
+		from io import StringIO
+		from django.core.management import call_command
+		out = StringIO()
+		call_command('check_storage', stdout=out)
+		self.assertIn('orphan_upload: remove documents/orphan.txt (100\xa0bytes)', out.getvalue())
+		self.assertEqual(sorted(os.listdir(os.path.join(self.root, 'media', 'documents'))), ['in_progress.txt', 'kept.txt', 'nokw.txt'])
+		self.assertEqual(self.store.indexed_documents([kept.id, no_keywords.id, 999]), {kept.id, no_keywords.id})
+		self.assertFalse(os.path.exists(self.legacy.index_path(998)))
+		self.assertFalse(os.path.exists(keyword_index_path(999)))
+		self.assertTrue(os.path.exists(os.path.join(keyword_index_path(no_keywords.id), 'bm25.npz')))
+		lost.refresh_from_db()
+		self.assertEqual(lost.status, Document.Status.FAILED)
+		self.assertEqual(list(StorageCheck().run()), [])
+
+
+class BenchmarkTests(TestCase):
+	def test_generated_corpus_is_extractable(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			paths = generate_corpus(tmp, 3, sizes=('small',))
+			for path in paths:
+				pages = list(iter_pages(path, os.path.basename(path)))
+				self.assertGreater(len(chunk_pages(pages)), 2, path)
+			self.assertEqual(generate_corpus(tmp, 1)[0], paths[0])
+
+	async def test_fake_llm_streams_its_answer(self):
+		llm = FakeChatModel()
+		prompt = format_prompt('What is due?', [mock.Mock(page_content='Payment is due in 30 days.', metadata={})])
+		answer = (await llm.ainvoke(prompt)).content
+		self.assertEqual(answer, 'According to the document: Payment is due in 30 days.')
+		self.assertEqual(''.join([chunk.content async for chunk in llm.astream(prompt)]), answer)
+		self.assertEqual(llm.invoke(prompt).content, answer)
+
+	def test_peak_rss_is_unknown_without_procfs_or_resource(self):
+		with mock.patch('builtins.open', side_effect=OSError), mock.patch('qa.benchmark.resource', None):
+			with RssSampler() as rss:
+				pass
+		self.assertIsNone(rss.peak)
+		self.assertIsNone(summarize([0.1], 0, 1.0, rss.peak)['peak_rss_mb'])
+
+	def test_compare_flags_regressions(self):
+		baseline = {'stages': {'qa': {'p50_ms': 100.0, 'throughput_per_s': 10.0}}}
+		current = {'stages': {'qa': {'p50_ms': 130.0, 'throughput_per_s': 9.5}, 'new': {'p50_ms': 1.0}}}
+		rows = compare(baseline, current, threshold=10)
+		self.assertEqual(rows, [('qa', 'p50_ms', 100.0, 130.0, 30.0, True), ('qa', 'throughput_per_s', 10.0, 9.5, -5.0, False)])
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(self.tmp.cleanup)
+		self.user = User.objects.create_user(username='mia', password='pw')
+		self.token = Token.objects.create(user=self.user).key
+		patcher = mock.patch('qa.vector_store.get_vector_store', return_value=ShardedFaissStore(self.tmp.name, shards=1))
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_traces_question_stages_and_serves_metrics(self):
+		llm_calls = STAGE_SECONDS.count(stage='llm')
+		prompt_tokens = LLM_TOKENS.value(kind='prompt')
+		client = APIClient()
+		client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+		with mock.patch('qa.views.get_llm', return_value=FakeChatModel()):
+			response = client.post('/api/qa/qa/', {'question': 'hi'}, format='json', HTTP_X_REQUEST_ID='req-42')
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response['X-Request-ID'], 'req-42')
+		self.assertEqual(STAGE_SECONDS.count(stage='llm'), llm_calls + 1)
+		self.assertGreater(LLM_TOKENS.value(kind='prompt'), prompt_tokens)
+
+		body = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').content.decode()
+		self.assertIn('qa_stage_duration_seconds_bucket{stage="llm",le="+Inf"}', body)
+		self.assertIn('qa_http_request_duration_seconds_count{view="qa",method="POST",status="200"}', body)
+		self.assertIn('qa_ingestion_queue_depth ', body)
+		self.assertIn('qa_vector_store_vectors{shard="0"} 0', body)
+
+	def test_log_lines_carry_fields_on_the_record(self):
+		with request_context('req-7'), self.assertLogs('qa', 'INFO') as logs:
+			log('WARNING', 'Slow page', page=3, reason='took too long')
+		record = logs.records[0]
+		self.assertEqual((record.levelname, record.fields), ('WARNING', {'request_id': 'req-7', 'page': 3, 'reason': 'took too long'}))
+		self.assertEqual(KeyValueFormatter().format(record), '[WARNING] Slow page request_id=req-7 page=3 reason="took too long"')
+
+	def test_invalid_request_id_is_replaced(self):
+		response = self.client.get('/api/qa/history/', HTTP_X_REQUEST_ID='bad id\n')
+		self.assertRegex(response['X-Request-ID'], r'^[0-9a-f]{16}$')
+
+	def test_token_and_disabled_switch(self):
+		self.assertEqual(self.client.get('/metrics').status_code, 401)
+		self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+		with override_settings(METRICS_TOKEN=None), self.assertRaises(ImproperlyConfigured):
+			self.client.get('/metrics')
+		with override_settings(METRICS_ENABLED=False):
+			self.assertEqual(self.client.get('/metrics').status_code, 404)
+			count = STAGE_SECONDS.count(stage='noop')
+			with span('noop'):
+				pass
+			self.assertEqual(STAGE_SECONDS.count(stage='noop'), count)
@@ -1,12 +1,22 @@
 from django.urls import path
-from .views import DocumentUploadView, QAView, ChatHistoryListView, RegisterUserView, LoginUserView, DocumentListView, DocumentDeleteView
+from .views import DocumentUploadView, QAView, QAStreamView, ChatHistoryListView, RegisterUserView, LoginUserView, LogoutUserView, DocumentListView, DocumentDeleteView, DocumentChunkListView, DocumentReplaceView, DocumentStatusView, DocumentBatchStatusView, SuggestedQuestionsView, BulkUploadView, BatchQAView, CacheStatsView
 
 urlpatterns = [
     path('upload/', DocumentUploadView.as_view(), name='document-upload'),
+    path('upload/bulk/', BulkUploadView.as_view(), name='document-bulk-upload'),
     path('documents/', DocumentListView.as_view(), name='document-list'),
+    path('documents/status/', DocumentBatchStatusView.as_view(), name='document-batch-status'),
     path('documents/<int:document_id>/', DocumentDeleteView.as_view(), name='document-delete'),
+    path('documents/<int:document_id>/chunks/', DocumentChunkListView.as_view(), name='document-chunks'),
+    path('documents/<int:document_id>/replace/', DocumentReplaceView.as_view(), name='document-replace'),
+    path('documents/<int:document_id>/status/', DocumentStatusView.as_view(), name='document-status'),
+    path('documents/<int:document_id>/suggestions/', SuggestedQuestionsView.as_view(), name='document-suggestions'),
     path('qa/', QAView.as_view(), name='qa'),
+    path('qa/stream/', QAStreamView.as_view(), name='qa-stream'),
+    path('qa/batch/', BatchQAView.as_view(), name='qa-batch'),
     path('history/', ChatHistoryListView.as_view(), name='chat-history'),
     path('register/', RegisterUserView.as_view(), name='register'),
     path('login/', LoginUserView.as_view(), name='login'),
+    path('logout/', LogoutUserView.as_view(), name='logout'),
+    path('stats/', CacheStatsView.as_view(), name='cache-stats'),
 ]
@@ -0,0 +1,785 @@
+import contextlib
+import os
+import re
+import shutil
+import sqlite3
+import struct
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .metrics import log, span
+
+try:
+	import fcntl
+except ImportError:  # Windows: cross-process locking is unavailable, in-process locks still apply.
+	fcntl = None
+
+
+INDEX_DIR = re.compile(r'document_(\d+)\.index')
+
+
+def _as_langchain_document(text, metadata):
+	from langchain_core.documents import Document as LangchainDocument
+	return LangchainDocument(page_content=text, metadata=metadata)
+
+
+class PerDocumentFaissStore:
+	"""Legacy layout: one LangChain FAISS directory per document under ``faiss_indexes/``.
+
+	Loaded indexes go through the process-wide index cache. Scores are converted from squared
+	L2 distance to cosine similarity (embeddings are unit length) so they merge with other stores.
+	"""
+
+	def __init__(self, root='faiss_indexes', **options):
+		self.root = str(root)
+
+	def index_path(self, document_id):
+		return os.path.join(self.root, f"document_{document_id}.index")
+
+	def add_document(self, document_id, user_id, chunks, vectors):
+		from langchain_community.vectorstores import FAISS
+		from .embeddings import get_embeddings
+		from .index_cache import get_index_cache
+
+		vectorstore = FAISS.from_embeddings(
+			list(zip([chunk['text'] for chunk in chunks], vectors)),
+			get_embeddings(),
+			metadatas=[{'page': chunk['page'], 'document_id': document_id, 'chunk_id': i} for i, chunk in enumerate(chunks)],
+		)
+		index_path = self.index_path(document_id)
+		os.makedirs(os.path.dirname(index_path), exist_ok=True)
+		vectorstore.save_local(index_path)
+		get_index_cache().invalidate(document_id)
+		return index_path
+
+	def chunk_hashes(self, document_id):
+		# Per-document indexes are always rewritten whole.
+		return set()
+
+	def update_document(self, document_id, user_id, chunks, vectors):
+		return self.add_document(document_id, user_id, chunks, [vectors[i] for i in range(len(chunks))])
+
+	def remove_document(self, document_id, index_path=None):
+		from .index_cache import get_index_cache
+
+		get_index_cache().invalidate(document_id)
+		index_path = index_path or self.index_path(document_id)
+		if os.path.exists(index_path):
+			try:
+				shutil.rmtree(index_path)
+			except OSError as e:
+				log('ERROR', 'Failed to remove FAISS index', path=index_path, error=e)
+
+	def iter_document_ids(self, batch_size=500):
+		"""Yield lists of document ids with an index directory under ``root``, without listing it whole."""
+		if not os.path.isdir(self.root):
+			return
+		batch = []
+		with os.scandir(self.root) as entries:
+			for entry in entries:
+				match = INDEX_DIR.fullmatch(entry.name)
+				if match and entry.is_dir():
+					batch.append(int(match.group(1)))
+					if len(batch) >= batch_size:
+						yield batch
+						batch = []
+		if batch:
+			yield batch
+
+	def indexed_documents(self, document_ids):
+		return {document_id for document_id in document_ids if os.path.isdir(self.index_path(document_id))}
+
+	def load(self, document_id, index_path=None):
+		from langchain_community.vectorstores import FAISS
+		from .embeddings import get_embeddings
+		from .index_cache import get_index_cache
+
+		embeddings = get_embeddings()
+		return get_index_cache().get(
+			document_id,
+			index_path or self.index_path(document_id),
+			lambda path: FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+		)
+
+	def search(self, query_vector, k, document_ids=None, user_id=None, index_paths=None):
+		"""Return ``[(langchain_document, score)]`` best first; ``document_ids`` is required here."""
+		index_paths = index_paths or {}
+		results = []
+		for document_id in document_ids or ():
+			vectorstore = self.load(document_id, index_paths.get(document_id))
+			for doc, distance in vectorstore.similarity_search_with_score_by_vector(list(query_vector), k=k):
+				doc.metadata.setdefault('document_id', document_id)
+				results.append((doc, 1.0 - float(distance) / 2.0))
+		results.sort(key=lambda item: item[1], reverse=True)
+		return results[:k]
+
+	def search_many(self, query_vectors, k, document_ids=None, user_id=None, index_paths=None):
+		# Each index is loaded once through the index cache and then searched per query.
+		return [self.search(query_vector, k, document_ids, user_id, index_paths) for query_vector in query_vectors]
+
+	def stats(self):
+		return {'backend': 'per_document'}
+
+
+def describe_index(index):
+	"""Index type name, including the wrapped index for ``IndexIDMap2``."""
+	import faiss
+	name = type(index).__name__
+	if isinstance(index, faiss.IndexIDMap2):
+		name += f"({type(faiss.downcast_index(index.index)).__name__})"
+	return name
+
+
+# Delta log record: op, document id, user id, new document id, new user id (moves), id count, vector
+# dimension; followed by the int64 ids and, for additions, the float32 vectors.
+DELTA_HEADER = struct.Struct('<BqqqqII')
+DELTA_ADD, DELTA_REMOVE, DELTA_MOVE = 1, 2, 3
+NO_USER = -1
+
+
+def _encode_delta(op, document_id, user_id, ids, vectors=None, new_document_id=0, new_user_id=None):
+	ids = np.ascontiguousarray(ids, dtype=np.int64)
+	dim = vectors.shape[1] if vectors is not None else 0
+	header = DELTA_HEADER.pack(
+		op, document_id, NO_USER if user_id is None else user_id,
+		new_document_id, NO_USER if new_user_id is None else new_user_id, len(ids), dim,
+	)
+	return header + ids.tobytes() + (np.ascontiguousarray(vectors, dtype=np.float32).tobytes() if vectors is not None else b'')
+
+
+class _ShardState:
+	"""A shard as this process sees it: the shard file with the delta log replayed on top.
+
+	``base`` is never modified after loading. Vectors added since the file was written are in
+	``overlay`` and ids removed since then in ``removed``. ``documents`` maps document ids to their
+	live vector ids and ``users`` user ids to their document ids, so search filters become FAISS
+	id selectors without a sqlite query. ``lock`` guards everything except ``base``.
+	"""
+
+	def __init__(self, key, base, documents, users):
+		self.key = key
+		self.base = base
+		self.overlay = None
+		self.removed = set()
+		self.offset = 0
+		self.documents = documents
+		self.users = users
+		self.lock = threading.Lock()
+
+	def pending(self):
+		return (self.overlay.ntotal if self.overlay is not None else 0) + len(self.removed)
+
+	def apply(self, op, document_id, user_id, ids, vectors, new_document_id, new_user_id):
+		import faiss
+		if op == DELTA_ADD:
+			if self.overlay is None:
+				self.overlay = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+			self.overlay.add_with_ids(vectors, ids)
+			self._link(document_id, user_id, ids)
+		elif op == DELTA_REMOVE:
+			if self.overlay is not None:
+				self.overlay.remove_ids(ids)
+			self.removed.update(ids.tolist())
+			self._unlink(document_id, user_id, ids)
+		elif op == DELTA_MOVE:
+			self._unlink(document_id, user_id, ids)
+			self._link(new_document_id, new_user_id, ids)
+
+	def _link(self, document_id, user_id, ids):
+		current = self.documents.get(document_id)
+		self.documents[document_id] = ids.copy() if current is None else np.union1d(current, ids)
+		self.users.setdefault(user_id, set()).add(document_id)
+
+	def _unlink(self, document_id, user_id, ids):
+		remaining = np.setdiff1d(self.documents.get(document_id, ()), ids).astype(np.int64)
+		if len(remaining):
+			self.documents[document_id] = remaining
+			return
+		self.documents.pop(document_id, None)
+		self.users.get(user_id, set()).discard(document_id)
+
+	def allowed_ids(self, document_ids, user_id):
+		"""Live vector ids matching the filters, or ``None`` when unfiltered."""
+		if document_ids is None and user_id is None:
+			return None
+		if document_ids is None:
+			document_ids = self.users.get(user_id, ())
+		elif user_id is not None:
+			document_ids = [document_id for document_id in document_ids if document_id in self.users.get(user_id, ())]
+		arrays = [self.documents[document_id] for document_id in document_ids if document_id in self.documents]
+		return np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+
+
+class ShardedFaissStore:
+	"""All chunk vectors in a few shared FAISS shards, with chunk rows in a sqlite side table.
+
+	Documents are placed on shard ``user_id % shards`` so per-user searches touch one shard.
+	Vector ids are the sqlite row ids, which map back to (document id, chunk id, page, text);
+	filtered search passes an ``IDSelectorBatch`` of the allowed ids to FAISS, built from an
+	in-memory map of each shard's documents. Vectors are L2-normalised and searched by inner
+	product, so scores are cosine similarities.
+
+	Shards start as exact flat indexes and are rebuilt as IVF once they reach
+	``ivf_min_vectors``, where approximate search starts paying for itself. With
+	``quantization`` set, vectors are stored as 8-bit scalar codes (``"sq8"``, 4x smaller) or,
+	in IVF shards of at least ``PQ_MIN_VECTORS``, as product-quantizer codes (``"pq"``, ~32x
+	smaller); smaller shards fall back to sq8. With ``mmap`` readers map shard files instead of
+	loading them, so concurrent worker processes share one copy through the page cache.
+
+	Writes take a per-shard file lock and append their additions and removals to the shard's
+	delta log (``shard_N.delta``) instead of rewriting the shard file; every process replays new
+	log records onto its loaded shard. Once the pending changes pass ``COMPACT_MIN_PENDING`` and
+	``COMPACT_RATIO`` of the shard, or the shard outgrows its index type, the log is folded into
+	a new shard file, which replaces the old one atomically.
+	"""
+
+	QUANTIZATIONS = (None, 'sq8', 'pq')
+	# Below this many vectors PQ codebooks cannot be trained well (256 centroids per sub-quantizer).
+	PQ_MIN_VECTORS = 10000
+	COMPACT_MIN_PENDING = 1000
+	COMPACT_RATIO = 0.1
+
+	def __init__(self, root, shards=4, ivf_min_vectors=50000, nprobe=16, quantization=None, mmap=False):
+		if quantization not in self.QUANTIZATIONS:
+			raise ValueError(f"Unknown quantization {quantization!r}; expected one of {self.QUANTIZATIONS}")
+		self.root = str(root)
+		self.shards = shards
+		self.ivf_min_vectors = ivf_min_vectors
+		self.nprobe = nprobe
+		self.quantization = quantization
+		self.mmap = mmap
+		os.makedirs(self.root, exist_ok=True)
+		self._local = threading.local()
+		self._shard_locks = [threading.Lock() for _ in range(shards)]
+		self._states = {}
+		with self._db() as db:
+			db.execute('PRAGMA journal_mode=WAL')
+			db.execute(
+				'CREATE TABLE IF NOT EXISTS chunks ('
+				'vector_id INTEGER PRIMARY KEY AUTOINCREMENT, document_id INTEGER NOT NULL, '
+				'user_id INTEGER, chunk_id INTEGER NOT NULL, page INTEGER, text TEXT NOT NULL, chunk_hash TEXT)'
+			)
+			if 'chunk_hash' not in {row[1] for row in db.execute('PRAGMA table_info(chunks)')}:
+				db.execute('ALTER TABLE chunks ADD COLUMN chunk_hash TEXT')
+			db.execute('CREATE INDEX IF NOT EXISTS chunks_document ON chunks (document_id)')
+			db.execute('CREATE INDEX IF NOT EXISTS chunks_user ON chunks (user_id)')
+
+	def _db(self):
+		conn = getattr(self._local, 'conn', None)
+		if conn is None:
+			conn = self._local.conn = sqlite3.connect(os.path.join(self.root, 'chunks.sqlite3'), timeout=30)
+		return conn
+
+	def shard_for(self, user_id):
+		return (user_id or 0) % self.shards
+
+	def _shard_path(self, shard):
+		return os.path.join(self.root, f"shard_{shard}.faiss")
+
+	def _delta_path(self, shard):
+		return os.path.join(self.root, f"shard_{shard}.delta")
+
+	def _file_key(self, shard):
+		try:
+			stat = os.stat(self._shard_path(shard))
+		except FileNotFoundError:
+			return None
+		return stat.st_mtime_ns, stat.st_ino, stat.st_size
+
+	def _delta_size(self, shard):
+		try:
+			return os.stat(self._delta_path(shard)).st_size
+		except FileNotFoundError:
+			return 0
+
+	@contextlib.contextmanager
+	def _file_lock(self, shard, shared=False):
+		if fcntl is None:
+			yield
+			return
+		with open(os.path.join(self.root, f"shard_{shard}.lock"), 'w') as lock_file:
+			fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+			try:
+				yield
+			finally:
+				fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+	@contextlib.contextmanager
+	def _write_lock(self, shard):
+		with self._shard_locks[shard], self._file_lock(shard):
+			yield
+
+	def _shard(self, shard):
+		"""Return the shard's state, first catching up with any other process's writes."""
+		state = self._states.get(shard)
+		key, size = self._file_key(shard), self._delta_size(shard)
+		if state is not None and state.key == key and state.offset == size:
+			return state
+		if state is None and key is None and not size:
+			return None
+		with self._shard_locks[shard], self._file_lock(shard, shared=True):
+			return self._sync(shard)
+
+	def _sync(self, shard):
+		# Callers hold the shard's thread lock and a shared or exclusive file lock.
+		key = self._file_key(shard)
+		state = self._states.get(shard)
+		if state is None or state.key != key:
+			if key is None and not self._delta_size(shard):
+				self._states.pop(shard, None)
+				return None
+			state = self._load_state(shard, key)
+		self._replay(shard, state)
+		self._states[shard] = state
+		return state
+
+	def _load_state(self, shard, key):
+		import faiss
+		base = None
+		if key is not None:
+			path = self._shard_path(shard)
+			with span('index_load'):
+				base = self._read_index(path) if self.mmap else faiss.read_index(path)
+			if hasattr(base, 'nprobe'):
+				base.nprobe = self.nprobe
+		return _ShardState(key, base, *self._members(shard))
+
+	def _members(self, shard):
+		documents, users = {}, {}
+		for vector_id, document_id, user_id in self._db().execute(
+			'SELECT vector_id, document_id, user_id FROM chunks '
+			'WHERE user_id % ? = ? OR (user_id IS NULL AND ? = 0) ORDER BY vector_id',
+			(self.shards, shard, shard),
+		):
+			documents.setdefault(document_id, []).append(vector_id)
+			users.setdefault(user_id, set()).add(document_id)
+		return {document_id: np.array(ids, dtype=np.int64) for document_id, ids in documents.items()}, users
+
+	def _replay(self, shard, state):
+		"""Apply the delta log records after ``state.offset``; a torn final record is left for later."""
+		try:
+			with open(self._delta_path(shard), 'rb') as fh:
+				fh.seek(state.offset)
+				data = fh.read()
+		except FileNotFoundError:
+			return
+		position = 0
+		with state.lock:
+			while position + DELTA_HEADER.size <= len(data):
+				op, document_id, user_id, new_document_id, new_user_id, count, dim = DELTA_HEADER.unpack_from(data, position)
+				ids_at = position + DELTA_HEADER.size
+				vectors_at = ids_at + 8 * count
+				end = vectors_at + (4 * count * dim if op == DELTA_ADD else 0)
+				if end > len(data):
+					break
+				ids = np.frombuffer(data, dtype=np.int64, count=count, offset=ids_at)
+				vectors = np.frombuffer(data, dtype=np.float32, count=count * dim, offset=vectors_at).reshape(count, dim) if op == DELTA_ADD else None
+				state.apply(
+					op, document_id, None if user_id == NO_USER else user_id, ids, vectors,
+					new_document_id, None if new_user_id == NO_USER else new_user_id,
+				)
+				position = end
+			state.offset += position
+
+	def _append(self, shard, state, records):
+		"""Append records to the shard's delta log and apply them. Callers hold the write lock."""
+		with open(self._delta_path(shard), 'ab') as fh:
+			fh.truncate(state.offset)  # drops a record torn by a writer that crashed
+			fh.write(b''.join(records))
+		self._replay(shard, state)
+		self._maybe_compact(shard, state)
+
+	def _maybe_compact(self, shard, state):
+		import faiss
+		size = (state.base.ntotal if state.base is not None else 0) + (state.overlay.ntotal if state.overlay is not None else 0)
+		outgrown = size >= self.ivf_min_vectors and not isinstance(state.base, faiss.IndexIVF)
+		if outgrown or state.pending() >= max(self.COMPACT_MIN_PENDING, self.COMPACT_RATIO * size):
+			self._save_shard(shard, self._compact(shard, state, rebuild=outgrown), state)
+
+	def _compact(self, shard, state, rebuild=False, quantization=None):
+		"""A private copy of the shard with its log folded in; ``rebuild`` also picks its index type anew."""
+		import faiss
+		path = self._shard_path(shard)
+		index = faiss.read_index(path) if os.path.exists(path) else None
+		with state.lock:
+			if index is not None and state.removed:
+				index.remove_ids(np.fromiter(state.removed, dtype=np.int64, count=len(state.removed)))
+			if state.overlay is not None and state.overlay.ntotal:
+				ids = faiss.vector_to_array(state.overlay.id_map)
+				vectors = state.overlay.index.reconstruct_n(0, state.overlay.ntotal)
+				if index is None:
+					index = self._new_index(vectors, ids)
+				else:
+					index.add_with_ids(vectors, ids)
+		if index is None or not rebuild:
+			return index
+		ids = self._shard_ids(shard)
+		if not len(ids):
+			return None
+		return self._new_index(self._all_vectors(index, ids), ids, quantization)
+
+	def _load_shard(self, shard):
+		state = self._shard(shard)
+		return state.base if state is not None else None
+
+	@staticmethod
+	def _read_index(path):
+		# IO_FLAG_MMAP maps IVF inverted lists; flat codes need IO_FLAG_MMAP_IFC, which IVF files reject.
+		import faiss
+		try:
+			return faiss.read_index(path, faiss.IO_FLAG_MMAP | getattr(faiss, 'IO_FLAG_MMAP_IFC', 0))
+		except RuntimeError:
+			return faiss.read_index(path, faiss.IO_FLAG_MMAP)
+
+	def _save_shard(self, shard, index, state=None):
+		"""Replace the shard file with ``index`` and empty the delta log. Callers hold the write lock."""
+		import faiss
+		if index is None:
+			return
+		path = self._shard_path(shard)
+		tmp_path = f"{path}.tmp"
+		faiss.write_index(index, tmp_path)
+		os.replace(tmp_path, path)
+		with open(self._delta_path(shard), 'wb'):
+			pass
+		if state is None:
+			# Loaded again, memberships included, on the next search.
+			self._states.pop(shard, None)
+			return
+		# Readers map the new file instead of keeping this in-memory copy.
+		base = self._read_index(path) if self.mmap else index
+		if hasattr(base, 'nprobe'):
+			base.nprobe = self.nprobe
+		with state.lock:
+			documents = dict(state.documents)
+			users = {user_id: set(document_ids) for user_id, document_ids in state.users.items()}
+		self._states[shard] = _ShardState(self._file_key(shard), base, documents, users)
+
+	def _new_index(self, vectors, ids, quantization=None):
+		"""Build an index for ``vectors``, choosing its type by size and ``quantization``."""
+		import faiss
+		quantization = self.quantization if quantization is None else quantization
+		dim = vectors.shape[1]
+		# One value range shared by all dimensions: trained on a first small document it still fits later ones.
+		sq8 = faiss.ScalarQuantizer.QT_8bit_uniform
+		if len(vectors) >= self.ivf_min_vectors:
+			nlist = max(1, int(4 * np.sqrt(len(vectors))))
+			coarse = faiss.IndexFlatIP(dim)
+			if quantization == 'pq' and len(vectors) >= self.PQ_MIN_VECTORS:
+				subquantizers = next(m for m in range(max(1, dim // 8), 0, -1) if dim % m == 0)
+				index = faiss.IndexIVFPQ(coarse, dim, nlist, subquantizers, 8, faiss.METRIC_INNER_PRODUCT)
+			elif quantization:
+				index = faiss.IndexIVFScalarQuantizer(coarse, dim, nlist, sq8, faiss.METRIC_INNER_PRODUCT)
+			else:
+				index = faiss.IndexIVFFlat(coarse, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+			index.train(vectors)
+			index.set_direct_map_type(faiss.DirectMap.Hashtable)
+			index.nprobe = self.nprobe
+		elif quantization:
+			codes = faiss.IndexScalarQuantizer(dim, sq8, faiss.METRIC_INNER_PRODUCT)
+			codes.train(vectors)
+			index = faiss.IndexIDMap2(codes)
+		else:
+			index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+		index.add_with_ids(vectors, ids)
+		return index
+
+	def _all_vectors(self, index, ids):
+		return np.vstack([index.reconstruct(int(i)) for i in ids]).astype(np.float32) if len(ids) else None
+
+	def add_document(self, document_id, user_id, chunks, vectors):
+		self.remove_document(document_id)
+		return self.update_document(document_id, user_id, chunks, dict(enumerate(vectors)))
+
+	def chunk_hashes(self, document_id):
+		return {row[0] for row in self._db().execute(
+			'SELECT chunk_hash FROM chunks WHERE document_id = ? AND chunk_hash IS NOT NULL', (document_id,)
+		)}
+
+	def update_document(self, document_id, user_id, chunks, vectors):
+		"""Make a document's stored chunks match ``chunks``, matching rows by chunk content id.
+
+		Rows whose content id is still present keep their vector and only get their position and
+		page refreshed; other rows are removed. ``vectors`` maps a position in ``chunks`` to its
+		vector and must cover every chunk that is not stored yet.
+		"""
+		import faiss
+		shard = self.shard_for(user_id)
+		db = self._db()
+		with self._write_lock(shard):
+			state = self._sync(shard)
+			rows = db.execute('SELECT vector_id, chunk_hash FROM chunks WHERE document_id = ?', (document_id,)).fetchall()
+			wanted = {chunk.get('id') for chunk in chunks} - {None}
+			kept = {}
+			for vector_id, chunk_hash in rows:
+				if chunk_hash in wanted:
+					kept.setdefault(chunk_hash, vector_id)
+			stale = [vector_id for vector_id, chunk_hash in rows if kept.get(chunk_hash) != vector_id]
+			added = [i for i, chunk in enumerate(chunks) if chunk.get('id') not in kept]
+			missing = [i for i in added if i not in vectors]
+			if missing:
+				raise ValueError(f"No vectors for {len(missing)} new chunks of document {document_id}")
+
+			# One sqlite transaction around the index write, so a failed write leaves the rows unchanged.
+			with db:
+				db.executemany(
+					'UPDATE chunks SET chunk_id = ?, page = ? WHERE vector_id = ?',
+					[(i, chunk['page'], kept[chunk['id']]) for i, chunk in enumerate(chunks) if chunk.get('id') in kept],
+				)
+				if not stale and not added:
+					return None
+				if stale:
+					db.execute(f"DELETE FROM chunks WHERE vector_id IN ({','.join('?' * len(stale))})", stale)
+				ids = np.array([
+					db.execute(
+						'INSERT INTO chunks (document_id, user_id, chunk_id, page, text, chunk_hash) VALUES (?, ?, ?, ?, ?, ?)',
+						(document_id, user_id, i, chunks[i]['page'], chunks[i]['text'], chunks[i].get('id')),
+					).lastrowid
+					for i in added
+				], dtype=np.int64)
+				new_vectors = None
+				if added:
+					new_vectors = np.asarray([vectors[i] for i in added], dtype=np.float32)
+					faiss.normalize_L2(new_vectors)
+				if state is None:
+					# A new shard is written whole; later writes go to its delta log.
+					if added:
+						self._save_shard(shard, self._new_index(new_vectors, ids))
+					return None
+				records = []
+				if stale:
+					records.append(_encode_delta(DELTA_REMOVE, document_id, user_id, stale))
+				if added:
+					records.append(_encode_delta(DELTA_ADD, document_id, user_id, ids, new_vectors))
+				self._append(shard, state, records)
+		return None
+
+	def remove_document(self, document_id, index_path=None):
+		db = self._db()
+		rows = db.execute('SELECT vector_id, user_id FROM chunks WHERE document_id = ?', (document_id,)).fetchall()
+		if not rows:
+			return
+		shard = self.shard_for(rows[0][1])
+		with self._write_lock(shard):
+			state = self._sync(shard)
+			with db:
+				db.execute('DELETE FROM chunks WHERE document_id = ?', (document_id,))
+				if state is not None:
+					self._append(shard, state, [_encode_delta(DELTA_REMOVE, document_id, rows[0][1], [row[0] for row in rows])])
+
+	def reassign_document(self, document_id, new_document_id, new_user_id):
+		"""Move a document's stored chunks to another document and user, and so to that user's shard."""
+		db = self._db()
+		rows = db.execute('SELECT vector_id, user_id FROM chunks WHERE document_id = ?', (document_id,)).fetchall()
+		if not rows:
+			return
+		ids = [row[0] for row in rows]
+		user_id = rows[0][1]
+		shard, new_shard = self.shard_for(user_id), self.shard_for(new_user_id)
+		with contextlib.ExitStack() as stack:
+			for locked in sorted({shard, new_shard}):
+				stack.enter_context(self._write_lock(locked))
+			state = self._sync(shard)
+			with db:
+				db.execute('UPDATE chunks SET document_id = ?, user_id = ? WHERE document_id = ?', (new_document_id, new_user_id, document_id))
+				if state is None:
+					return
+				if shard == new_shard:
+					self._append(shard, state, [_encode_delta(
+						DELTA_MOVE, document_id, user_id, ids, new_document_id=new_document_id, new_user_id=new_user_id,
+					)])
+					return
+				vectors = self._stored_vectors(state, ids)
+				new_state = self._sync(new_shard)
+				self._append(shard, state, [_encode_delta(DELTA_REMOVE, document_id, user_id, ids)])
+				if new_state is None:
+					self._save_shard(new_shard, self._new_index(vectors, np.array(ids, dtype=np.int64)))
+				else:
+					self._append(new_shard, new_state, [_encode_delta(DELTA_ADD, new_document_id, new_user_id, ids, vectors)])
+
+	def _stored_vectors(self, state, ids):
+		# Decoded from the index, so approximate for quantized shards.
+		with state.lock:
+			vectors = []
+			for vector_id in ids:
+				try:
+					vectors.append(state.overlay.reconstruct(vector_id))
+				except (AttributeError, RuntimeError):
+					vectors.append(state.base.reconstruct(vector_id))
+		return np.vstack(vectors).astype(np.float32)
+
+	def iter_document_ids(self, batch_size=500):
+		"""Yield lists of the document ids that have stored chunks, in ascending order."""
+		after = 0
+		while True:
+			batch = [row[0] for row in self._db().execute(
+				'SELECT DISTINCT document_id FROM chunks WHERE document_id > ? ORDER BY document_id LIMIT ?', (after, batch_size),
+			)]
+			if not batch:
+				return
+			yield batch
+			after = batch[-1]
+
+	def indexed_documents(self, document_ids):
+		document_ids = list(document_ids)
+		if not document_ids:
+			return set()
+		placeholders = ','.join('?' * len(document_ids))
+		return {row[0] for row in self._db().execute(
+			f'SELECT DISTINCT document_id FROM chunks WHERE document_id IN ({placeholders})', document_ids,
+		)}
+
+	def _shard_ids(self, shard):
+		return np.array([row[0] for row in self._db().execute(
+			'SELECT vector_id FROM chunks WHERE user_id % ? = ? OR (user_id IS NULL AND ? = 0) ORDER BY vector_id',
+			(self.shards, shard, shard),
+		)], dtype=np.int64)
+
+	def shard_contents(self, shard):
+		"""Return ``(index, ids, vectors)`` for a shard; vectors are decoded from the index, so approximate if quantized."""
+		with self._write_lock(shard):
+			state = self._sync(shard)
+			index = self._compact(shard, state) if state is not None else None
+			if index is None:
+				return None, None, None
+			ids = self._shard_ids(shard)
+			return index, ids, self._all_vectors(index, ids)
+
+	def optimize_shard(self, shard, quantization=None, save=True):
+		"""Rebuild a shard, choosing its index type for its current size (also drops removed-id slack).
+
+		``quantization`` overrides the store's setting for this rebuild (``''`` for full float32
+		vectors). Returns the new index, which is only written if ``save``.
+		"""
+		with self._write_lock(shard):
+			state = self._sync(shard)
+			if state is None:
+				return None
+			rebuilt = self._compact(shard, state, rebuild=True, quantization=quantization)
+			if save:
+				self._save_shard(shard, rebuilt, state)
+			return rebuilt
+
+	def _search_index(self, index, query, k, allowed, removed=None):
+		import faiss
+		if index is None or not index.ntotal or (allowed is not None and not len(allowed)):
+			return None
+		selector = excluded = None
+		if allowed is not None:
+			selector = faiss.IDSelectorBatch(allowed)
+			k = min(k, len(allowed))
+		elif removed is not None:
+			excluded = faiss.IDSelectorBatch(removed)
+			selector = faiss.IDSelectorNot(excluded)
+		k = min(k, index.ntotal)
+		if selector is None:
+			return index.search(query, k)
+		if isinstance(index, faiss.IndexIVF):
+			params = faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+		else:
+			params = faiss.SearchParameters(sel=selector)
+		return index.search(query, k, params=params)
+
+	def search(self, query_vector, k, document_ids=None, user_id=None, index_paths=None):
+		"""Return ``[(langchain_document, score)]`` best first, restricted to documents and/or a user."""
+		return self.search_many([query_vector], k, document_ids, user_id, index_paths)[0]
+
+	def search_many(self, query_vectors, k, document_ids=None, user_id=None, index_paths=None):
+		"""Like ``search`` for several query vectors at once, with one FAISS search per shard."""
+		import faiss
+		query = np.asarray(query_vectors, dtype=np.float32).reshape(len(query_vectors), -1)
+		if not len(query):
+			return []
+		faiss.normalize_L2(query)
+		if document_ids is not None:
+			document_ids = list(document_ids)
+			if not document_ids:
+				return [[] for _ in query]
+
+		hits = [{} for _ in query]
+		for shard in [self.shard_for(user_id)] if user_id is not None else range(self.shards):
+			state = self._shard(shard)
+			if state is None:
+				continue
+			# The overlay changes under writers; the base index does not, so it is searched unlocked.
+			with state.lock:
+				allowed = state.allowed_ids(document_ids, user_id)
+				removed = np.fromiter(state.removed, dtype=np.int64, count=len(state.removed)) if allowed is None and state.removed else None
+				found = [self._search_index(state.overlay, query, k, allowed)]
+			found.append(self._search_index(state.base, query, k, allowed, removed))
+			for scores, vector_ids in filter(None, found):
+				for query_hits, query_scores, query_found in zip(hits, scores, vector_ids):
+					for score, vector_id in zip(query_scores, query_found):
+						if vector_id != -1:
+							query_hits[int(vector_id)] = max(float(score), query_hits.get(int(vector_id), float('-inf')))
+		hits = [sorted(((score, vector_id) for vector_id, score in query_hits.items()), reverse=True)[:k] for query_hits in hits]
+
+		ids = sorted({vector_id for query_hits in hits for _, vector_id in query_hits})
+		rows = {
+			row[0]: row for row in self._db().execute(
+				f"SELECT vector_id, document_id, chunk_id, page, text FROM chunks WHERE vector_id IN ({','.join('?' * len(ids))})",
+				ids,
+			)
+		} if ids else {}
+		results = []
+		for query_hits in hits:
+			query_results = []
+			for score, vector_id in query_hits:
+				row = rows.get(vector_id)
+				if row:
+					metadata = {'document_id': row[1], 'chunk_id': row[2], 'page': row[3]}
+					query_results.append((_as_langchain_document(row[4], metadata), score))
+			results.append(query_results)
+		return results
+
+	def stats(self):
+		shards = []
+		for shard in range(self.shards):
+			state = self._shard(shard)
+			vectors = pending = 0
+			if state is not None:
+				with state.lock:
+					vectors = sum(len(ids) for ids in state.documents.values())
+					pending = state.pending()
+			shards.append({
+				'shard': shard,
+				'vectors': vectors,
+				'pending': pending,
+				'type': describe_index(state.base) if state is not None and state.base is not None else None,
+				'bytes': (os.path.getsize(self._shard_path(shard)) if os.path.exists(self._shard_path(shard)) else 0) + self._delta_size(shard),
+			})
+		return {'backend': 'sharded', 'shards': shards}
+
+
+_store = None
+_legacy_store = None
+_store_lock = threading.Lock()
+
+
+def get_vector_store():
+	global _store
+	if _store is None:
+		with _store_lock:
+			if _store is None:
+				backend = import_string(getattr(settings, 'VECTOR_STORE_BACKEND', 'qa.vector_store.ShardedFaissStore'))
+				_store = backend(**getattr(settings, 'VECTOR_STORE_OPTIONS', {'root': 'faiss_indexes/shared'}))
+	return _store
+
+
+def get_legacy_store():
+	global _legacy_store
+	if _legacy_store is None:
+		with _store_lock:
+			if _legacy_store is None:
+				_legacy_store = PerDocumentFaissStore()
+	return _legacy_store
+
+
+def store_for(document):
+	"""Documents still carrying a per-document index path are served from that legacy index."""
+	if document.faiss_index_path:
+		return get_legacy_store()
+	return get_vector_store()
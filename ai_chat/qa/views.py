@@ -4,14 +4,42 @@ from rest_framework.authtoken.models import Token
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions, generics
-from rest_framework.parsers import MultiPartParser, FormParser
-from .models import ChatHistory, Document
-from .serializers import ChatHistorySerializer, QARequestSerializer, DocumentSerializer
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
+from .models import ChatHistory, Document, DocumentChunk, SuggestedQuestion
+from .serializers import BatchQARequestSerializer, ChatHistorySerializer, QARequestSerializer, DocumentSerializer, DocumentStatusSerializer, DocumentChunkSerializer, DOCUMENT_LIST_FIELDS
+from .index_cache import get_index_cache
+from .ingestion import discard_index, enqueue_ingestion, enqueue_ingestion_batch, release_index
+from .answering import NOT_FOUND_ANSWER, abuild_prompt, alookup_cached_answer, answer_scope, document_not_ready_error, get_llm, response_text
+from .answer_cache import get_answer_cache
+from .authentication import password_hashing_slot
+from .batch import run_batch
+from .db_router import replica_reads
+from .history import asave_chat
+from .metrics import LLM_TOKENS, current_request_id, current_spans, format_spans, log, metrics_enabled, observe_stage, render, request_context, span
+from .prompting import count_tokens
+from .vector_store import get_vector_store
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.throttling import ScopedRateThrottle
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+import hashlib
+import hmac
+import json
 import os
+import time
+import zipfile
+from contextlib import nullcontext
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -21,6 +49,8 @@ load_dotenv()
 
 class RegisterUserView(APIView):
 	permission_classes = [permissions.AllowAny]
+	throttle_classes = [ScopedRateThrottle]
+	throttle_scope = 'register'
 
 	def post(self, request):
 		username = request.data.get('username') or request.data.get('name')
@@ -29,7 +59,8 @@ class RegisterUserView(APIView):
 			return Response({'error': 'Username and password required.'}, status=status.HTTP_400_BAD_REQUEST)
 		if User.objects.filter(username=username).exists():
 			return Response({'error': 'Username already exists.'}, status=status.HTTP_400_BAD_REQUEST)
-		user = User.objects.create_user(username=username, password=password)
+		with password_hashing_slot():
+			user = User.objects.create_user(username=username, password=password)
 		token, _ = Token.objects.get_or_create(user=user)
 		return Response({'token': token.key, 'user': {'name': user.username}}, status=status.HTTP_201_CREATED)
 
@@ -37,227 +68,487 @@ class RegisterUserView(APIView):
 
 class LoginUserView(APIView):
 	permission_classes = [permissions.AllowAny]
+	throttle_classes = [ScopedRateThrottle]
+	throttle_scope = 'login'
 
 	def post(self, request):
 		username = request.data.get('username') or request.data.get('name')
 		password = request.data.get('password')
-		user = authenticate(username=username, password=password)
+		with password_hashing_slot():
+			user = authenticate(username=username, password=password)
 		if user:
 			token, _ = Token.objects.get_or_create(user=user)
 			return Response({'token': token.key, 'user': {'name': user.username}}, status=status.HTTP_200_OK)
 		return Response({'error': 'Invalid credentials.'}, status=status.HTTP_401_UNAUTHORIZED)
 
+
+class LogoutUserView(APIView):
+	"""Delete the user's token, which also drops it from the authentication caches."""
+	permission_classes = [permissions.IsAuthenticated]
+
+	def post(self, request):
+		Token.objects.filter(user=request.user).delete()
+		return Response({'message': 'Logged out successfully'}, status=status.HTTP_200_OK)
+
+class HistoryCursorPagination(CursorPagination):
+	# Keyset pagination over the (user, -created_at) / (document, -created_at) indexes.
+	ordering = '-created_at'
+	page_size = 50
+	page_size_query_param = 'page_size'
+	max_page_size = 200
+
+
 class ChatHistoryListView(generics.ListAPIView):
+	"""Chat history, newest first, one cursor page at a time.
+
+	``document_id`` limits it to one document and ``since`` (ISO datetime) to newer rows for
+	incremental sync. Responses carry an ETag over the row count and newest id, so an
+	unchanged history is answered with 304 after one aggregate query.
+	"""
 	serializer_class = ChatHistorySerializer
 	permission_classes = [permissions.IsAuthenticated]
+	pagination_class = HistoryCursorPagination
 
-	def get_queryset(self):
-		user = self.request.user
+	def filter_queryset(self, queryset):
 		document_id = self.request.query_params.get('document_id')
-		queryset = ChatHistory.objects.filter(user=user)
+		since = self.request.query_params.get('since')
 		if document_id:
 			queryset = queryset.filter(document_id=document_id)
-		return queryset.order_by('created_at')
+		if since:
+			since_time = parse_datetime(since)
+			if since_time is None:
+				raise exceptions.ValidationError({'since': 'Expected an ISO 8601 datetime.'})
+			if timezone.is_naive(since_time):
+				since_time = timezone.make_aware(since_time)
+			queryset = queryset.filter(created_at__gt=since_time)
+		return queryset
 
+	def get_queryset(self):
+		return ChatHistory.objects.filter(user=self.request.user).select_related('document').only(
+			'id', 'user', 'document', 'question', 'answer', 'created_at', 'document__id', 'document__file', 'document__status'
+		)
 
+	def get_etag(self):
+		state = self.filter_queryset(ChatHistory.objects.filter(user=self.request.user)).aggregate(count=Count('id'), newest=Max('id'))
+		query = hashlib.sha1(self.request.get_full_path().encode()).hexdigest()[:12]
+		return f'W/"{state["count"]}-{state["newest"] or 0}-{query}"'
 
+	def list(self, request, *args, **kwargs):
+		etag = self.get_etag()
+		headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+		if etag in request.headers.get('If-None-Match', ''):
+			return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+		response = super().list(request, *args, **kwargs)
+		for header, value in headers.items():
+			response[header] = value
+		return response
 
 
 
 
-class QAView(APIView):
-	permission_classes = [permissions.IsAuthenticated]
-	def post(self, request, format=None):
-		import asyncio
-		try:
-			asyncio.get_running_loop()
-		except RuntimeError:
-			asyncio.set_event_loop(asyncio.new_event_loop())
-		
-		serializer = QARequestSerializer(data=request.data)
-		if serializer.is_valid():
-			doc_id = serializer.validated_data.get('document_id', None)
-			question = serializer.validated_data['question']
-			history_text = ""
-			document = None
-			
-			if doc_id:
-				try:
-					document = Document.objects.get(id=doc_id, user=request.user)
-				except Document.DoesNotExist:
-					return Response({'error': 'Document not found'}, status=status.HTTP_404_NOT_FOUND)
-				
-				api_key = os.getenv("GEMINI_API_KEY")
-				embeddings = GoogleGenerativeAIEmbeddings(
-					google_api_key=api_key,
-					model="models/embedding-001"
-				)
-				vectorstore = FAISS.load_local(
-					document.faiss_index_path,
-					embeddings,
-					allow_dangerous_deserialization=True
-				)
-				retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
-				context_chunks = retriever.invoke(question)
-				context = "\n---\n".join([chunk.page_content for chunk in context_chunks])
-				max_history = 5
-				recent_history = ChatHistory.objects.filter(document_id=doc_id, user=request.user).order_by('-created_at')[:max_history]
-				for chat in reversed(recent_history):
-					history_text += f"Q: {chat.question}\nA: {chat.answer}\n"
-				prompt = (
-					"You are an expert Q&A assistant. Only answer questions using the provided Document Context below. "
-					"If the answer is not present in the context, reply: 'Sorry, this information is not found in the uploaded document. Please upload a relevant text document.' "
-					"Do not use any outside knowledge.\n"
-					f"Document Context:\n{context}\n\nChat History:\n{history_text}\n\nCurrent Question: {question}\n\nAnswer:"
-				)
-			else:
-				prompt = (
-					"You are a helpful assistant. The user hasn't uploaded any document yet. "
-					"Please ask them to upload a document first so you can answer questions about it. "
-					f"User question: {question}\n\nAnswer:"
-				)
-			
-			llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=os.getenv("GEMINI_API_KEY"))
-			response = llm.invoke(prompt)
-			
-			if hasattr(response, 'content'):
-				answer = response.content
-			else:
-				answer = str(response)
-			
-			ChatHistory.objects.create(
-				user=request.user, 
-				document=document,
-				question=question, 
-				answer=answer
-			)
-			return Response({'answer': answer}, status=status.HTTP_200_OK)
-		return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 
+def _sse(event, data):
+	return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 
-def extract_text_from_file(file_obj, filename):
-	
-	import tempfile
-	ext = filename.lower().split('.')[-1]
+async def authenticate_request(request):
+	"""Run DRF's configured authenticators for a plain (async) Django view."""
+	drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
 	try:
-		if ext == 'pdf':
-			import pdfplumber
-			with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-				tmp.write(file_obj.read())
-				tmp_path = tmp.name
-			text = ''
-			try:
-				with pdfplumber.open(tmp_path) as pdf:
-					for page in pdf.pages:
-						page_text = page.extract_text()
-						if page_text:
-							text += page_text + '\n'
-			except Exception as e:
-				print(f"[ERROR] pdfplumber failed to parse PDF: {filename}. Exception: {e}")
-				text = ''
-			finally:
-				os.remove(tmp_path)
-			if not text:
-				print(f"[WARNING] No text extracted from PDF: {filename}")
-			return text
-		elif ext == 'docx':
-			try:
-				import docx
-				doc = docx.Document(file_obj)
-				text = '\n'.join([para.text for para in doc.paragraphs])
-				if not text:
-					print(f"[WARNING] No text extracted from DOCX: {filename}")
-				return text
-			except Exception as e:
-				print(f"[ERROR] python-docx failed to parse DOCX: {filename}. Exception: {e}")
-				return ''
-		elif ext == 'txt':
-			try:
-				text = file_obj.read().decode('utf-8')
-				if not text:
-					print(f"[WARNING] No text extracted from TXT: {filename}")
-				return text
-			except Exception as e:
-				print(f"[ERROR] Failed to parse TXT: {filename}. Exception: {e}")
-				return ''
+		user = await sync_to_async(lambda: drf_request.user)()
+	except exceptions.APIException:
+		return None
+	return user if user and user.is_authenticated else None
+
+
+def _json_body(request):
+	try:
+		data = json.loads(request.body or b'{}')
+	except ValueError:
+		return None
+	return data if isinstance(data, dict) else None
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAuthenticatedView(View):
+	"""Async counterpart of an ``IsAuthenticated`` APIView, served natively under ASGI.
+
+	DRF views are sync-only, so authentication reuses the configured DRF authenticators
+	and handlers return plain ``JsonResponse``/``StreamingHttpResponse`` objects.
+	Views that only read before saving the answer set ``read_from_replica`` (see ``qa.db_router``).
+	"""
+	read_from_replica = False
+
+	async def dispatch(self, request, *args, **kwargs):
+		with span('authenticate'):
+			user = await authenticate_request(request)
+		if user is None:
+			return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=status.HTTP_401_UNAUTHORIZED)
+		request.user = user
+		with replica_reads() if self.read_from_replica else nullcontext():
+			return await super().dispatch(request, *args, **kwargs)
+
+	async def get_question(self, request):
+		"""Validate a QA payload; return (question, documents, error_response).
+
+		``documents`` is empty for a question without a document, one document for
+		``document_id``, or several for ``document_ids`` / ``all_documents``.
+		"""
+		data = _json_body(request)
+		if data is None:
+			return None, [], JsonResponse({'error': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+		serializer = QARequestSerializer(data=data)
+		if not serializer.is_valid():
+			return None, [], JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+		documents, error_response = await self.get_documents(request, serializer.validated_data)
+		return serializer.validated_data['question'], documents, error_response
+
+	async def get_documents(self, request, data):
+		"""Load the user's documents selected by ``document_id``/``document_ids``/``all_documents``; return (documents, error_response)."""
+		doc_id = data.get('document_id', None)
+		doc_ids = data.get('document_ids') or ([doc_id] if doc_id else [])
+		documents = Document.objects.filter(user=request.user).order_by('id')
+		if data.get('all_documents'):
+			# Documents still being processed are skipped rather than failing the whole question.
+			return [document async for document in documents.filter(status=Document.Status.READY)], None
+		if not doc_ids:
+			return [], None
+		documents = [document async for document in documents.filter(id__in=set(doc_ids))]
+		if len(documents) != len(set(doc_ids)):
+			return [], JsonResponse({'error': 'Document not found'}, status=status.HTTP_404_NOT_FOUND)
+		for document in documents:
+			error = document_not_ready_error(document)
+			if error:
+				return documents, JsonResponse(error, status=status.HTTP_409_CONFLICT)
+		return documents, None
+
+
+def _count_llm_tokens(prompt, answer):
+	LLM_TOKENS.inc(count_tokens(prompt), kind='prompt')
+	LLM_TOKENS.inc(count_tokens(answer), kind='completion')
+
+
+class QAView(AsyncAuthenticatedView):
+	read_from_replica = True
+
+	async def post(self, request, format=None):
+		with span('load_documents'):
+			question, documents, error_response = await self.get_question(request)
+		if error_response:
+			return error_response
+		
+		cached, question_vector = None, None
+		if documents:
+			cached, question_vector = await alookup_cached_answer(documents, question)
+		if cached:
+			answer = cached[0]
 		else:
-			print(f"[ERROR] Unsupported file type: {filename}")
-			return ''
-	except Exception as e:
-		print(f"[CRITICAL] Unexpected error parsing file {filename}: {e}")
-		return ''
+			with span('build_prompt'):
+				prompt = await abuild_prompt(request.user, documents, question, question_vector)
+			if prompt is None:
+				# Nothing relevant passed the rerank cutoff; skip the generation.
+				answer = NOT_FOUND_ANSWER
+			else:
+				with span('llm'):
+					answer = response_text(await get_llm().ainvoke(prompt))
+				_count_llm_tokens(prompt, answer)
+				if documents and answer:
+					get_answer_cache().put(answer_scope(documents), question, answer, question_vector)
+		
+		with span('save_history'):
+			await asave_chat(request.user, documents, question, answer)
+		return JsonResponse({'answer': answer, 'cached': cached[1] if cached else None}, status=status.HTTP_200_OK)
+
+
+class QAStreamView(AsyncAuthenticatedView):
+	"""Streams the answer as server-sent events: ``token`` events, then one ``done`` (or ``error``) event."""
+	read_from_replica = True
+
+	async def post(self, request):
+		with span('load_documents'):
+			question, documents, error_response = await self.get_question(request)
+		if error_response:
+			return error_response
+		user = request.user
+		cached, question_vector = None, None
+		if documents:
+			cached, question_vector = await alookup_cached_answer(documents, question)
+		prompt = None
+		# A cached answer, or the not-found answer when nothing passed the rerank cutoff, is sent without the LLM.
+		immediate = cached[0] if cached else None
+		if not cached:
+			with span('build_prompt'):
+				prompt = await abuild_prompt(user, documents, question, question_vector)
+			if prompt is None:
+				immediate = NOT_FOUND_ANSWER
+		request_id = current_request_id()
+
+		async def event_stream():
+			# The body is sent after the middleware has returned, so the request id is bound again here.
+			with request_context(request_id):
+				if immediate is not None:
+					answer = immediate
+					yield _sse('token', {'text': answer})
+				else:
+					parts = []
+					start = time.perf_counter()
+					try:
+						with span('llm'):
+							async for chunk in get_llm().astream(prompt):
+								text = response_text(chunk)
+								if text:
+									if not parts:
+										observe_stage('llm_first_token', time.perf_counter() - start)
+									parts.append(text)
+									yield _sse('token', {'text': text})
+					except Exception as e:
+						log('ERROR', 'Streaming answer failed', error=e)
+						yield _sse('error', {'error': 'Failed to generate an answer.'})
+						return
+					answer = ''.join(parts)
+					_count_llm_tokens(prompt, answer)
+					if documents and answer:
+						get_answer_cache().put(answer_scope(documents), question, answer, question_vector)
+				with span('save_history'):
+					chat = await asave_chat(user, documents, question, answer)
+				yield _sse('done', {'answer': answer, 'id': chat.id if chat else None, 'cached': cached[1] if cached else None})
+				log('INFO', 'Streamed answer', cached=bool(cached), spans=format_spans(current_spans()))
+
+		response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+		response['Cache-Control'] = 'no-cache'
+		response['X-Accel-Buffering'] = 'no'
+		return response
+
+
+class BatchQAView(AsyncAuthenticatedView):
+	"""Answer a list of questions about the same documents, streamed as JSON lines (one per question, in completion order).
+
+	With ``retrieve_only`` each line has the ranked chunks and their scores and no LLM call is made.
+	"""
+	read_from_replica = True
+
+	async def post(self, request):
+		data = _json_body(request)
+		if data is None:
+			return JsonResponse({'error': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+		serializer = BatchQARequestSerializer(data=data)
+		if not serializer.is_valid():
+			return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+		with span('load_documents'):
+			documents, error_response = await self.get_documents(request, serializer.validated_data)
+		if error_response:
+			return error_response
+		options = serializer.validated_data
+		request_id = current_request_id()
+
+		async def lines():
+			with request_context(request_id):
+				count = 0
+				async for result in run_batch(documents, options['questions'], k=options['k'], retrieve_only=options['retrieve_only']):
+					count += 1
+					yield json.dumps(result) + '\n'
+				log('INFO', 'Batch answered', questions=count, retrieve_only=options['retrieve_only'], spans=format_spans(current_spans()))
+
+		response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+		response['X-Accel-Buffering'] = 'no'
+		return response
+
+
+def _upload_error(filename, size):
+	"""Return why a file of this name and size cannot be uploaded, else None."""
+	file_ext = os.path.splitext(filename)[1].lower()
+	
+	from django.conf import settings
+	allowed_extensions = getattr(settings, 'ALLOWED_UPLOAD_EXTENSIONS', ['.pdf', '.docx', '.txt'])
+	if file_ext not in allowed_extensions:
+		return f'File type {file_ext} not allowed. Allowed types: {", ".join(allowed_extensions)}'
+	
+	max_size = getattr(settings, 'MAX_UPLOAD_SIZE', 10 * 1024 * 1024)
+	if size > max_size:
+		return f'File too large. Maximum size: {max_size // (1024*1024)}MB'
+	return None
 
 
+def _validate_upload(file_obj):
+	"""Return an error response for a missing, disallowed or oversized upload, else None."""
+	if not file_obj:
+		return JsonResponse({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
+	error = _upload_error(file_obj.name, file_obj.size)
+	if error:
+		return JsonResponse({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+	return None
 
 
+class _HashingFile(File):
+	"""File wrapper that computes the sha256 of the content as storage reads it in chunks."""
 
-class DocumentUploadView(APIView):
-	permission_classes = [permissions.IsAuthenticated]
-	parser_classes = (MultiPartParser, FormParser)
+	def __init__(self, file, name=None):
+		super().__init__(file, name)
+		self.sha256 = hashlib.sha256()
+
+	def chunks(self, chunk_size=None):
+		for chunk in super().chunks(chunk_size):
+			self.sha256.update(chunk)
+			yield chunk
+
+
+def _store_file(document, filename, file_obj):
+	"""Write an upload to storage and record its content hash on ``document`` (not saved)."""
+	hashed = _HashingFile(file_obj, name=filename)
+	document.file.save(filename, hashed, save=False)
+	document.content_hash = hashed.sha256.hexdigest()
 
-	def post(self, request, format=None):
-		import asyncio
+
+def _bulk_files(uploads):
+	"""Yield ``(filename, file, error)`` per uploaded file, opening zip archive members one at a time."""
+	for upload in uploads:
+		if not upload.name.lower().endswith('.zip'):
+			yield upload.name, upload, _upload_error(upload.name, upload.size)
+			continue
 		try:
-			asyncio.get_running_loop()
-		except RuntimeError:
-			asyncio.set_event_loop(asyncio.new_event_loop())
-		
-		file_obj = request.FILES.get('file')
-		if not file_obj:
-			return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
-		
+			archive = zipfile.ZipFile(upload)
+		except zipfile.BadZipFile:
+			yield upload.name, None, 'Not a valid zip archive'
+			continue
+		with archive:
+			for member in archive.infolist():
+				filename = os.path.basename(member.filename)
+				if member.is_dir() or not filename or filename.startswith('.') or '__MACOSX' in member.filename:
+					continue
+				# The declared size is checked before reading; zipfile never returns more than it.
+				error = _upload_error(filename, member.file_size)
+				if error:
+					yield filename, None, error
+					continue
+				with archive.open(member) as member_file:
+					yield filename, File(member_file, name=filename), None
+
+
+def _save_bulk_upload(user, uploads):
+	"""Store each valid file as a queued document; returns ``(documents, results)``."""
+	from django.conf import settings
+	max_files = getattr(settings, 'BULK_UPLOAD_MAX_FILES', 200)
+	documents, results = [], []
+	for filename, file_obj, error in _bulk_files(uploads):
+		if not error and len(documents) >= max_files:
+			error = f'Too many files. Maximum per upload: {max_files}'
+		if not error:
+			try:
+				document = Document(user=user, status=Document.Status.QUEUED)
+				_store_file(document, filename, file_obj)
+				document.save()
+			except Exception as e:
+				log('ERROR', 'Failed to store bulk upload file', filename=filename, error=e)
+				error = 'Failed to store file'
+			else:
+				documents.append(document)
+				results.append({'filename': filename, 'status': 'queued', 'document': DocumentSerializer(document).data})
+				continue
+		results.append({'filename': filename, 'status': 'rejected', 'error': error})
+	if documents:
+		# No chat history row: with no single document it would land in the no-document
+		# conversation and be sent to the LLM as context there.
+		enqueue_ingestion_batch([document.id for document in documents])
+	return documents, results
+
+
+class DocumentUploadView(AsyncAuthenticatedView):
+	async def post(self, request, format=None):
+		with span('validate_upload'):
+			file_obj = request.FILES.get('file')
+			error_response = _validate_upload(file_obj)
+		if error_response:
+			return error_response
 		filename = file_obj.name
-		file_ext = os.path.splitext(filename)[1].lower()
-		
-		from django.conf import settings
-		allowed_extensions = getattr(settings, 'ALLOWED_UPLOAD_EXTENSIONS', ['.pdf', '.docx', '.txt'])
-		if file_ext not in allowed_extensions:
-			return Response({
-				'error': f'File type {file_ext} not allowed. Allowed types: {", ".join(allowed_extensions)}'
-			}, status=status.HTTP_400_BAD_REQUEST)
 		
-		max_size = getattr(settings, 'MAX_UPLOAD_SIZE', 10 * 1024 * 1024)
-		if file_obj.size > max_size:
-			return Response({
-				'error': f'File too large. Maximum size: {max_size // (1024*1024)}MB'
-			}, status=status.HTTP_400_BAD_REQUEST)
-		
-		serializer = DocumentSerializer(data=request.data)
+		serializer = DocumentSerializer(data={'file': file_obj})
 		if serializer.is_valid():
-			file_obj = request.FILES.get('file')
-			filename = file_obj.name if file_obj else ''
-			text = extract_text_from_file(file_obj, filename)
-			doc = serializer.save(text_content=text, user=request.user)
+			def save_document():
+				document = Document(user=request.user, status=Document.Status.QUEUED)
+				_store_file(document, filename, file_obj)
+				document.save()
+				return document
+
+			with span('save_file'):
+				doc = await sync_to_async(save_document)()
 			
 			upload_question = f"📎 Uploaded document: {filename}"
-			upload_answer = f"✅ Document \"{filename}\" uploaded successfully! You can now ask questions about it."
-			
-			ChatHistory.objects.create(
-				user=request.user,
-				document=doc,
-				question=upload_question,
-				answer=upload_answer
-			)
+			upload_answer = f"✅ Document \"{filename}\" uploaded successfully! It is being processed and will be ready for questions shortly."
 			
-			splitter = CharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-			chunks = splitter.split_text(text)
-			api_key = os.getenv("GEMINI_API_KEY")
-			embeddings = GoogleGenerativeAIEmbeddings(
-				google_api_key=api_key,
-				model="models/embedding-001"
-			)
-			vectorstore = FAISS.from_texts(chunks, embeddings)
-			index_path = f"faiss_indexes/document_{doc.id}.index"
-			os.makedirs(os.path.dirname(index_path), exist_ok=True)
-			vectorstore.save_local(index_path)
-			doc.faiss_index_path = index_path
-			doc.chunks = chunks
-			doc.save()
-			return Response(DocumentSerializer(doc).data, status=status.HTTP_201_CREATED)
-		return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+			with span('save_history'):
+				await ChatHistory.objects.acreate(
+					user=request.user,
+					document=doc,
+					question=upload_question,
+					answer=upload_answer
+				)
+			with span('enqueue'):
+				await sync_to_async(enqueue_ingestion)(doc.id)
+			return JsonResponse(DocumentSerializer(doc).data, status=status.HTTP_202_ACCEPTED)
+		return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class BulkUploadView(AsyncAuthenticatedView):
+	"""Upload many files (``files`` fields, zip archives allowed) in one request.
+
+	Uploads are spooled to temporary files instead of memory and archive members are copied
+	to storage one at a time. Every file is reported on its own, so rejected files do not fail
+	the batch; accepted ones are ingested in groups that share embedding calls.
+	"""
+
+	async def post(self, request):
+		try:
+			request.upload_handlers = [TemporaryFileUploadHandler(request)]
+		except AttributeError:
+			pass  # The body was already parsed (e.g. for a session CSRF check) with the default handlers.
+		uploads = request.FILES.getlist('files')
+		if not uploads:
+			return JsonResponse({'error': 'No files provided'}, status=status.HTTP_400_BAD_REQUEST)
+		with span('save_files'):
+			documents, results = await sync_to_async(_save_bulk_upload)(request.user, uploads)
+		return JsonResponse(
+			{'accepted': len(documents), 'rejected': len(results) - len(documents), 'results': results},
+			status=status.HTTP_202_ACCEPTED if documents else status.HTTP_400_BAD_REQUEST,
+		)
+
+
+class DocumentReplaceView(AsyncAuthenticatedView):
+	"""Upload a new version of a document; only chunks whose content changed are re-embedded."""
+
+	async def post(self, request, document_id):
+		file_obj = request.FILES.get('file')
+		error_response = _validate_upload(file_obj)
+		if error_response:
+			return error_response
+		document = await Document.objects.filter(id=document_id, user=request.user).afirst()
+		if document is None:
+			return JsonResponse({'error': 'Document not found'}, status=status.HTTP_404_NOT_FOUND)
+		if document.status not in (Document.Status.READY, Document.Status.FAILED):
+			return JsonResponse({'error': 'Document is still being processed. Please try again shortly.', 'status': document.status}, status=status.HTTP_409_CONFLICT)
+
+		old_file = document.file.name if document.file else None
+
+		def replace_file():
+			# Documents sharing this one's indexes keep the old version's.
+			release_index(document)
+			_store_file(document, file_obj.name, file_obj)
+			document.status = Document.Status.QUEUED
+			document.error = ''
+			document.save(update_fields=['file', 'content_hash', 'status', 'error'])
+			if old_file and old_file != document.file.name:
+				document.file.storage.delete(old_file)
+
+		await sync_to_async(replace_file)()
+		await ChatHistory.objects.acreate(
+			user=request.user,
+			document=document,
+			question=f"📎 Uploaded new version: {file_obj.name}",
+			answer=f"✅ Document \"{file_obj.name}\" replaced. Changed sections are being re-indexed."
+		)
+		await sync_to_async(enqueue_ingestion)(document.id)
+		return JsonResponse(DocumentSerializer(document).data, status=status.HTTP_202_ACCEPTED)
 
 
 class DocumentListView(generics.ListAPIView):
@@ -265,7 +556,68 @@ class DocumentListView(generics.ListAPIView):
 	permission_classes = [permissions.IsAuthenticated]
 
 	def get_queryset(self):
-		return Document.objects.filter(user=self.request.user).order_by('-uploaded_at')
+		return Document.objects.filter(user=self.request.user).only(*DOCUMENT_LIST_FIELDS).order_by('-uploaded_at')
+
+
+class ChunkPagination(PageNumberPagination):
+	page_size = 50
+	page_size_query_param = 'page_size'
+	max_page_size = 500
+
+
+class DocumentChunkListView(generics.ListAPIView):
+	"""Full document text, one page of chunks at a time."""
+	serializer_class = DocumentChunkSerializer
+	permission_classes = [permissions.IsAuthenticated]
+	pagination_class = ChunkPagination
+
+	def get_queryset(self):
+		document_id = self.kwargs['document_id']
+		document = Document.objects.filter(id=document_id, user=self.request.user).only('id', 'index_owner').first()
+		if document is None:
+			raise exceptions.NotFound('Document not found')
+		return DocumentChunk.objects.filter(document_id=document.index_id).only('position', 'page', 'section', 'text').order_by('position')
+
+
+class DocumentStatusView(APIView):
+	permission_classes = [permissions.IsAuthenticated]
+
+	def get(self, request, document_id):
+		try:
+			document = Document.objects.only('id', 'status', 'error').get(id=document_id, user=request.user)
+		except Document.DoesNotExist:
+			return Response({'error': 'Document not found'}, status=status.HTTP_404_NOT_FOUND)
+		return Response(DocumentStatusSerializer(document).data, status=status.HTTP_200_OK)
+
+
+class SuggestedQuestionsView(APIView):
+	"""Questions generated for a document at ingest time; asking one skips embedding and search."""
+	permission_classes = [permissions.IsAuthenticated]
+
+	def get(self, request, document_id):
+		try:
+			document = Document.objects.only('id', 'status', 'index_owner').get(id=document_id, user=request.user)
+		except Document.DoesNotExist:
+			return Response({'error': 'Document not found'}, status=status.HTTP_404_NOT_FOUND)
+		questions = SuggestedQuestion.objects.filter(document_id=document.index_id).values_list('question', flat=True)
+		return Response({'document_id': document.id, 'status': document.status, 'questions': list(questions)}, status=status.HTTP_200_OK)
+
+
+class DocumentBatchStatusView(APIView):
+	"""Processing status of several documents (``?ids=1,2,3``), e.g. to follow a bulk upload."""
+	permission_classes = [permissions.IsAuthenticated]
+
+	def get(self, request):
+		try:
+			ids = [int(value) for value in request.query_params.get('ids', '').split(',') if value]
+		except ValueError:
+			return Response({'error': 'ids must be comma-separated document ids'}, status=status.HTTP_400_BAD_REQUEST)
+		documents = Document.objects.filter(user=request.user, id__in=ids).only('id', 'status', 'error').order_by('id')
+		data = DocumentStatusSerializer(documents, many=True).data
+		counts = {}
+		for item in data:
+			counts[item['status']] = counts.get(item['status'], 0) + 1
+		return Response({'documents': data, 'counts': counts}, status=status.HTTP_200_OK)
 
 
 class DocumentDeleteView(APIView):
@@ -274,18 +626,18 @@ class DocumentDeleteView(APIView):
 	def delete(self, request, document_id):
 		try:
 			document = Document.objects.get(id=document_id, user=request.user)
+			get_answer_cache().invalidate(document.id)
 			
-			# Delete the FAISS index file if it exists
-			if document.faiss_index_path and os.path.exists(document.faiss_index_path):
-				import shutil
-				try:
-					shutil.rmtree(document.faiss_index_path)
-				except:
-					pass
+			# Remove the document's vectors and keyword index, unless an identical upload still shares them
+			if release_index(document):
+				discard_index(document)
 			
-			# Delete the uploaded file if it exists
-			if document.file and os.path.exists(document.file.path):
-				os.remove(document.file.path)
+			# Delete the uploaded file; one that cannot be removed now is left to check_storage
+			if document.file:
+				try:
+					document.file.delete(save=False)
+				except OSError as e:
+					log('WARNING', 'Failed to remove uploaded file', document_id=document.id, error=e)
 			
 			# Delete the document from database
 			document.delete()
@@ -294,5 +646,34 @@ class DocumentDeleteView(APIView):
 		except Document.DoesNotExist:
 			return Response({'error': 'Document not found'}, status=status.HTTP_404_NOT_FOUND)
 		except Exception as e:
+			log('ERROR', 'Failed to delete document', document_id=document_id, error=e)
 			return Response({'error': 'Failed to delete document'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+
+
+class CacheStatsView(APIView):
+	permission_classes = [permissions.IsAdminUser]
+
+	def get(self, request):
+		from .ingestion import get_ingestion_backend
+		return Response({
+			'index_cache': get_index_cache().stats(),
+			'answer_cache': get_answer_cache().stats(),
+			'vector_store': get_vector_store().stats(),
+			'ingestion_queue_depth': get_ingestion_backend().queue_depth(),
+		}, status=status.HTTP_200_OK)
+
+
+class MetricsView(View):
+	"""Prometheus scrape endpoint; requires ``Authorization: Bearer <METRICS_TOKEN>``."""
+
+	def get(self, request):
+		from django.conf import settings
+		if not metrics_enabled():
+			raise Http404
+		token = getattr(settings, 'METRICS_TOKEN', None)
+		if not token:
+			raise ImproperlyConfigured("METRICS_TOKEN must be set when METRICS_ENABLED is on.")
+		if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+			return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+		return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,5 +1,9 @@
 let API_BASE_URL = 'http://localhost:8000/api/qa/' 
 
+// ETag of the last history response per URL, sent back as If-None-Match on the next request
+const historyEtags = {}
+const clearHistoryEtags = () => Object.keys(historyEtags).forEach((url) => delete historyEtags[url])
+
 const handleResponse = async (response) => {
   if (!response.ok) {
     const error = await response.json().catch(() => ({ message: 'Network error' }))
@@ -88,10 +92,19 @@ export const authAPI = {
 
   logout: async () => {
     try {
+      // Revoke the token server-side so cached lookups of it stop working too.
+      if (localStorage.getItem('authToken')) {
+        await fetch(`${API_BASE_URL}logout/`, {
+          method: 'POST',
+          headers: getAuthHeaders()
+        })
+      }
       localStorage.removeItem('authToken')
+      clearHistoryEtags()
       return { message: 'Logged out successfully' }
     } catch (error) {
       localStorage.removeItem('authToken')
+      clearHistoryEtags()
       console.error('Logout error:', error)
       return { message: 'Logged out successfully' }
     }
@@ -127,23 +140,92 @@ export const chatAPI = {
     }
   },
 
-  getChatHistory: async () => {
+  // Stream an answer as server-sent events; onToken is called with each text fragment
+  streamMessage: async (message, documentId = null, onToken = () => {}) => {
+    const requestData = {
+      question: message
+    }
+    
+    if (documentId) {
+      requestData.document_id = documentId
+    }
+
+    const response = await fetch(`${API_BASE_URL}qa/stream/`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        ...(localStorage.getItem('authToken') && { 
+          'Authorization': `Token ${localStorage.getItem('authToken')}`
+        })
+      },
+      body: JSON.stringify(requestData)
+    })
+
+    if (!response.ok) {
+      return await handleResponse(response)
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    let result = null
+
+    while (true) {
+      const { done, value } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+
+      let boundary = buffer.indexOf('\n\n')
+      while (boundary !== -1) {
+        const block = buffer.slice(0, boundary)
+        buffer = buffer.slice(boundary + 2)
+        boundary = buffer.indexOf('\n\n')
+
+        const event = block.match(/^event: (.*)$/m)?.[1]
+        const data = JSON.parse(block.match(/^data: (.*)$/m)?.[1] || '{}')
+        if (event === 'token') {
+          onToken(data.text)
+        } else if (event === 'done') {
+          result = data
+        } else if (event === 'error') {
+          throw new Error(data.error || 'Failed to get response')
+        }
+      }
+    }
+
+    if (!result) {
+      throw new Error('Connection closed before the answer finished')
+    }
+    return result
+  },
+
+  // One page of chat history, oldest first, with the `next` URL of the page before it (or null).
+  // Pass `next` to load older messages, or `since` (created_at of the newest message shown) to
+  // fetch only newer ones; unchanged results come back as `notModified` from the server's ETag.
+  getChatHistory: async ({ next = null, since = null } = {}) => {
     try {
-      console.log('Making getChatHistory request...')
-      const response = await fetch(`${API_BASE_URL}history/`, {
+      const url = next || `${API_BASE_URL}history/${since ? `?since=${encodeURIComponent(since)}` : ''}`
+      const etag = historyEtags[url]
+      const response = await fetch(url, {
         method: 'GET',
         headers: {
           'Content-Type': 'application/json',
           ...(localStorage.getItem('authToken') && { 
             'Authorization': `Token ${localStorage.getItem('authToken')}`
-          })
+          }),
+          ...(etag && { 'If-None-Match': etag })
         }
       })
-      
-      console.log('getChatHistory response status:', response.status)
+
+      if (response.status === 304) {
+        return { results: [], next: null, notModified: true }
+      }
       const data = await handleResponse(response)
-      console.log('getChatHistory data:', data)
-      return data
+      if (response.headers.get('ETag')) {
+        historyEtags[url] = response.headers.get('ETag')
+      }
+      // Pages come newest first; the chat shows messages oldest first.
+      return { results: [...data.results].reverse(), next: data.next, notModified: false }
     } catch (error) {
       console.error('Get chat history error:', error)
       throw error
@@ -172,6 +254,66 @@ export const chatAPI = {
     }
   },
 
+  uploadDocuments: async (files) => {
+    try {
+      const formData = new FormData()
+      Array.from(files).forEach((file) => formData.append('files', file))
+
+      const response = await fetch(`${API_BASE_URL}upload/bulk/`, {
+        method: 'POST',
+        headers: {
+          ...(localStorage.getItem('authToken') && { 
+            'Authorization': `Token ${localStorage.getItem('authToken')}`
+          })
+        },
+        body: formData
+      })
+      
+      return await handleResponse(response)
+    } catch (error) {
+      console.error('Bulk upload error:', error)
+      throw error
+    }
+  },
+
+  getSuggestedQuestions: async (documentId) => {
+    try {
+      const response = await fetch(`${API_BASE_URL}documents/${documentId}/suggestions/`, {
+        method: 'GET',
+        headers: {
+          'Content-Type': 'application/json',
+          ...(localStorage.getItem('authToken') && { 
+            'Authorization': `Token ${localStorage.getItem('authToken')}`
+          })
+        }
+      })
+      
+      return await handleResponse(response)
+    } catch (error) {
+      console.error('Get suggested questions error:', error)
+      throw error
+    }
+  },
+
+  getDocumentStatuses: async (ids) => {
+    try {
+      const response = await fetch(`${API_BASE_URL}documents/status/?ids=${ids.join(',')}`, {
+        method: 'GET',
+        headers: {
+          'Content-Type': 'application/json',
+          ...(localStorage.getItem('authToken') && { 
+            'Authorization': `Token ${localStorage.getItem('authToken')}`
+          })
+        }
+      })
+      
+      return await handleResponse(response)
+    } catch (error) {
+      console.error('Get document statuses error:', error)
+      throw error
+    }
+  },
+
   getDocuments: async () => {
     try {
       const response = await fetch(`${API_BASE_URL}documents/`, {
@@ -191,6 +333,25 @@ export const chatAPI = {
     }
   },
 
+  getDocumentStatus: async (documentId) => {
+    try {
+      const response = await fetch(`${API_BASE_URL}documents/${documentId}/status/`, {
+        method: 'GET',
+        headers: {
+          'Content-Type': 'application/json',
+          ...(localStorage.getItem('authToken') && { 
+            'Authorization': `Token ${localStorage.getItem('authToken')}`
+          })
+        }
+      })
+      
+      return await handleResponse(response)
+    } catch (error) {
+      console.error('Get document status error:', error)
+      throw error
+    }
+  },
+
   // Delete document
   deleteDocument: async (documentId) => {
     try {
@@ -231,6 +392,7 @@ export const apiUtils = {
   // Clear auth data
   clearAuthData: () => {
     localStorage.removeItem('authToken')
+    clearHistoryEtags()
   },
 
   // Set API base URL (useful for different environments)
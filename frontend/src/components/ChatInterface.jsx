@@ -2,21 +2,43 @@ import { useState, useRef, useEffect } from 'react'
 import api from '../api'
 import './ChatInterface.css'
 
+const welcomeMessage = {
+  id: 1,
+  type: 'bot',
+  content: 'Hello! I\'m your QNA assistant. Upload a document and ask questions about it!',
+  timestamp: new Date()
+}
+
+// Chat history rows become a question and an answer message
+const historyMessages = (items) => items.map(item => ([
+  {
+    id: `${item.id}-q`,
+    type: 'user',
+    content: item.question,
+    timestamp: new Date(item.created_at),
+    fromHistory: true
+  },
+  {
+    id: `${item.id}-a`,
+    type: 'bot',
+    content: item.answer,
+    timestamp: new Date(item.created_at),
+    fromHistory: true
+  }
+])).flat()
+
 const ChatInterface = ({ user, onLogout }) => {
-  const [messages, setMessages] = useState([
-    {
-      id: 1,
-      type: 'bot',
-      content: 'Hello! I\'m your QNA assistant. Upload a document and ask questions about it!',
-      timestamp: new Date()
-    }
-  ])
+  const [messages, setMessages] = useState([welcomeMessage])
   const [inputValue, setInputValue] = useState('')
   const [isLoading, setIsLoading] = useState(false)
   const [currentDocument, setCurrentDocument] = useState(null)
   const [uploadedDocuments, setUploadedDocuments] = useState([])
   const [showDocumentManager, setShowDocumentManager] = useState(false)
   const [isLoadingDocuments, setIsLoadingDocuments] = useState(false)
+  const [olderHistoryUrl, setOlderHistoryUrl] = useState(null)
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false)
+  const [suggestedQuestions, setSuggestedQuestions] = useState([])
+  const newestHistoryAt = useRef(null)
   const messagesEndRef = useRef(null)
   const fileInputRef = useRef(null)
   const dropdownRef = useRef(null)
@@ -25,15 +47,32 @@ const ChatInterface = ({ user, onLogout }) => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' })
   }
 
+  const lastMessage = messages[messages.length - 1]
   useEffect(() => {
+    // Only new or growing messages at the bottom scroll; loading older ones does not
     scrollToBottom()
-  }, [messages])
+  }, [lastMessage?.id, lastMessage?.content])
 
   useEffect(() => {
     // Load chat history when component mounts
     loadChatHistory()
   }, [])
 
+  useEffect(() => {
+    // Offer the questions generated for the selected document once it is ready
+    setSuggestedQuestions([])
+    if (!currentDocument || currentDocument.status !== 'ready') return
+    let cancelled = false
+    api.chat.getSuggestedQuestions(currentDocument.id)
+      .then(result => {
+        if (!cancelled) setSuggestedQuestions(result.questions)
+      })
+      .catch(error => console.error('Failed to load suggested questions:', error))
+    return () => {
+      cancelled = true
+    }
+  }, [currentDocument?.id, currentDocument?.status])
+
   useEffect(() => {
     // Handle click outside to close dropdown
     const handleClickOutside = (event) => {
@@ -76,7 +115,7 @@ const ChatInterface = ({ user, onLogout }) => {
           setCurrentDocument(null)
         }
         
-        // Reload chat history to reflect changes
+        // Reload chat history; the document's messages were deleted with it
         await loadChatHistory()
         
         // Show success message
@@ -122,45 +161,60 @@ const ChatInterface = ({ user, onLogout }) => {
     setMessages(prev => [...prev, selectMessage])
   }
 
+  // Show the newest page of history; older pages are loaded on demand
   const loadChatHistory = async () => {
     try {
-      const history = await api.chat.getChatHistory()
-      
-      if (history && history.length > 0) {
-        const formattedHistory = history.map(item => ([
-          {
-            id: `${item.id}-q`,
-            type: 'user',
-            content: item.question,
-            timestamp: new Date(item.created_at)
-          },
-          {
-            id: `${item.id}-a`,
-            type: 'bot',
-            content: item.answer,
-            timestamp: new Date(item.created_at)
-          }
-        ])).flat()
-        
-        const welcomeMessage = {
-          id: 1,
-          type: 'bot',
-          content: 'Hello! I\'m your QNA assistant. Upload a document and ask questions about it!',
-          timestamp: new Date()
-        }
-        
-        setMessages(prev => {
-          if (prev.length <= 1 || formattedHistory.length !== prev.length - 1) {
-            return [welcomeMessage, ...formattedHistory]
-          }
-          return prev
-        })
-      }
+      const page = await api.chat.getChatHistory()
+      setOlderHistoryUrl(page.next)
+      newestHistoryAt.current = page.results.length > 0 ? page.results[page.results.length - 1].created_at : null
+      setMessages([welcomeMessage, ...historyMessages(page.results)])
     } catch (error) {
       console.error('Failed to load chat history:', error)
     }
   }
 
+  const loadOlderHistory = async () => {
+    if (!olderHistoryUrl || isLoadingOlder) return
+    setIsLoadingOlder(true)
+    try {
+      const page = await api.chat.getChatHistory({ next: olderHistoryUrl })
+      setOlderHistoryUrl(page.next)
+      setMessages(prev => {
+        const shown = new Set(prev.map(msg => msg.id))
+        return [prev[0], ...historyMessages(page.results).filter(msg => !shown.has(msg.id)), ...prev.slice(1)]
+      })
+    } catch (error) {
+      console.error('Failed to load older messages:', error)
+    } finally {
+      setIsLoadingOlder(false)
+    }
+  }
+
+  // Fetch only the history saved since the newest message shown
+  const refreshChatHistory = async () => {
+    if (!newestHistoryAt.current) {
+      return loadChatHistory()
+    }
+    try {
+      let page = await api.chat.getChatHistory({ since: newestHistoryAt.current })
+      const items = [...page.results]
+      while (page.next) {
+        page = await api.chat.getChatHistory({ next: page.next })
+        items.unshift(...page.results)
+      }
+      if (page.notModified || items.length === 0) return
+      newestHistoryAt.current = items[items.length - 1].created_at
+      // Saved turns replace the messages shown while they were being sent
+      setMessages(prev => {
+        const kept = prev.filter(msg => msg.id === welcomeMessage.id || msg.fromHistory)
+        const shown = new Set(kept.map(msg => msg.id))
+        return [...kept, ...historyMessages(items).filter(msg => !shown.has(msg.id))]
+      })
+    } catch (error) {
+      console.error('Failed to refresh chat history:', error)
+    }
+  }
+
   const handleSendMessage = async (e) => {
     e.preventDefault()
     if (!inputValue.trim()) return
@@ -176,31 +230,49 @@ const ChatInterface = ({ user, onLogout }) => {
       return
     }
 
+    const question = inputValue
+    setInputValue('')
+    await askQuestion(question)
+  }
+
+  const handleSuggestedQuestion = async (question) => {
+    setSuggestedQuestions(prev => prev.filter(item => item !== question))
+    await askQuestion(question)
+  }
+
+  const askQuestion = async (question) => {
     const userMessage = {
       id: Date.now(),
       type: 'user',
-      content: inputValue,
+      content: question,
       timestamp: new Date()
     }
 
     setMessages(prev => [...prev, userMessage])
-    const question = inputValue
-    setInputValue('')
     setIsLoading(true)
 
+    const botMessageId = Date.now() + 1
     try {
-      const response = await api.chat.sendMessage(question, currentDocument.id)
+      const response = await api.chat.streamMessage(question, currentDocument.id, (token) => {
+        setIsLoading(false)
+        setMessages(prev => {
+          if (!prev.some(msg => msg.id === botMessageId)) {
+            return [...prev, { id: botMessageId, type: 'bot', content: token, timestamp: new Date() }]
+          }
+          return prev.map(msg => (msg.id === botMessageId ? { ...msg, content: msg.content + token } : msg))
+        })
+      })
       
       const botMessage = {
-        id: Date.now() + 1,
+        id: botMessageId,
         type: 'bot',
         content: response.answer,
         timestamp: new Date()
       }
-      setMessages(prev => [...prev, botMessage])
+      setMessages(prev => [...prev.filter(msg => msg.id !== botMessageId), botMessage])
       
       setTimeout(async () => {
-        await loadChatHistory()
+        await refreshChatHistory()
       }, 1000)
       
     } catch (error) {
@@ -211,15 +283,137 @@ const ChatInterface = ({ user, onLogout }) => {
         content: `Error: ${error.message || 'Failed to get response'}`,
         timestamp: new Date()
       }
-      setMessages(prev => [...prev, errorMessage])
+      setMessages(prev => [...prev.filter(msg => msg.id !== botMessageId), errorMessage])
     } finally {
       setIsLoading(false)
     }
   }
 
+  const waitForDocument = async (document, fileName) => {
+    let status = document.status
+    let error = document.error
+    while (status !== 'ready' && status !== 'failed') {
+      await new Promise(resolve => setTimeout(resolve, 2000))
+      try {
+        const result = await api.chat.getDocumentStatus(document.id)
+        status = result.status
+        error = result.error
+      } catch (err) {
+        console.error('Failed to poll document status:', err)
+        return
+      }
+    }
+
+    setCurrentDocument(prev => (prev && prev.id === document.id ? { ...prev, status } : prev))
+    setUploadedDocuments(prev => prev.map(doc => (doc.id === document.id ? { ...doc, status } : doc)))
+
+    const statusMessage = {
+      id: Date.now(),
+      type: 'bot',
+      content: status === 'ready'
+        ? `📄 "${fileName}" is ready. You can now ask questions about it.`
+        : `❌ Failed to process "${fileName}": ${error || 'Unknown error'}`,
+      timestamp: new Date()
+    }
+    setMessages(prev => [...prev, statusMessage])
+  }
+
+  // Follow several uploads with one status request per poll until each is ready or failed
+  const waitForDocuments = async (documents) => {
+    const names = Object.fromEntries(documents.map(doc => [doc.id, doc.filename]))
+    let pending = documents.map(doc => doc.id)
+    const finished = []
+    while (pending.length > 0) {
+      await new Promise(resolve => setTimeout(resolve, 2000))
+      let result
+      try {
+        result = await api.chat.getDocumentStatuses(pending)
+      } catch (err) {
+        console.error('Failed to poll document statuses:', err)
+        return
+      }
+      const done = result.documents.filter(doc => doc.status === 'ready' || doc.status === 'failed')
+      pending = result.documents.filter(doc => !done.includes(doc)).map(doc => doc.id)
+      if (done.length === 0) continue
+
+      const statuses = Object.fromEntries(done.map(doc => [doc.id, doc.status]))
+      setCurrentDocument(prev => (prev && statuses[prev.id] ? { ...prev, status: statuses[prev.id] } : prev))
+      setUploadedDocuments(prev => prev.map(doc => (statuses[doc.id] ? { ...doc, status: statuses[doc.id] } : doc)))
+      finished.push(...done)
+    }
+
+    const ready = finished.filter(doc => doc.status === 'ready').length
+    const failed = finished.filter(doc => doc.status === 'failed')
+    const statusMessage = {
+      id: Date.now(),
+      type: 'bot',
+      content: [
+        `📄 ${ready} of ${finished.length} documents are ready. You can now ask questions about them.`,
+        ...failed.map(doc => `❌ Failed to process "${names[doc.id]}": ${doc.error || 'Unknown error'}`)
+      ].join('\n'),
+      timestamp: new Date()
+    }
+    setMessages(prev => [...prev, statusMessage])
+  }
+
+  // Several files, or zip archives, go through the bulk upload endpoint
+  const handleBulkUpload = async (files) => {
+    const uploadMessage = {
+      id: Date.now(),
+      type: 'user',
+      content: `📎 Uploading: ${files.map(file => file.name).join(', ')}...`,
+      timestamp: new Date(),
+      isFile: true
+    }
+    setMessages(prev => [...prev, uploadMessage])
+
+    try {
+      const response = await api.chat.uploadDocuments(files)
+      const documents = response.results.filter(item => item.status === 'queued').map(item => item.document)
+      const rejected = response.results.filter(item => item.status === 'rejected')
+
+      setCurrentDocument(documents[documents.length - 1])
+      setUploadedDocuments(prev => [...prev, ...documents])
+
+      const successMessage = {
+        id: Date.now() + 1,
+        type: 'bot',
+        content: [
+          `✅ ${documents.length} documents uploaded successfully! Processing them now...`,
+          ...rejected.map(item => `❌ "${item.filename}" was not uploaded: ${item.error}`)
+        ].join('\n'),
+        timestamp: new Date()
+      }
+      setMessages(prev => [
+        ...prev.filter(msg => msg.id !== uploadMessage.id),
+        successMessage
+      ])
+
+      await waitForDocuments(documents)
+    } catch (error) {
+      console.error('Bulk upload error:', error)
+      const errorMessage = {
+        id: Date.now() + 1,
+        type: 'bot',
+        content: `❌ Failed to upload documents: ${error.message}`,
+        timestamp: new Date()
+      }
+      setMessages(prev => [...prev.filter(msg => msg.id !== uploadMessage.id), errorMessage])
+    } finally {
+      if (fileInputRef.current) {
+        fileInputRef.current.value = ''
+      }
+    }
+  }
+
   const handleFileUpload = async (e) => {
     e.preventDefault()
-    const file = e.target.files[0]
+    const files = Array.from(e.target.files)
+    if (files.length > 1 || files[0]?.name.toLowerCase().endsWith('.zip')) {
+      await handleBulkUpload(files)
+      return
+    }
+    const file = files[0]
     if (file) {
       const uploadMessage = {
         id: Date.now(),
@@ -239,7 +433,7 @@ const ChatInterface = ({ user, onLogout }) => {
         const successMessage = {
           id: Date.now() + 1,
           type: 'bot',
-          content: `✅ Document "${file.name}" uploaded successfully! You can now ask questions about it.`,
+          content: `✅ Document "${file.name}" uploaded successfully! Processing it now...`,
           timestamp: new Date()
         }
         
@@ -248,9 +442,7 @@ const ChatInterface = ({ user, onLogout }) => {
           successMessage
         ])
         
-        setTimeout(async () => {
-          await loadChatHistory()
-        }, 1000)
+        await waitForDocument(response, file.name)
         
       } catch (error) {
         console.error('Upload error:', error)
@@ -352,6 +544,11 @@ const ChatInterface = ({ user, onLogout }) => {
 
       {/* Messages Area */}
       <div className="messages-container">
+        {olderHistoryUrl && (
+          <button className="load-older-button" onClick={loadOlderHistory} disabled={isLoadingOlder}>
+            {isLoadingOlder ? 'Loading...' : 'Load earlier messages'}
+          </button>
+        )}
         {messages.map((message) => (
           <div
             key={message.id}
@@ -383,13 +580,28 @@ const ChatInterface = ({ user, onLogout }) => {
 
       {/* Input Area */}
       <div className="input-container">
+        {suggestedQuestions.length > 0 && !isLoading && (
+          <div className="suggested-questions">
+            {suggestedQuestions.map(question => (
+              <button
+                key={question}
+                type="button"
+                className="suggested-question"
+                onClick={() => handleSuggestedQuestion(question)}
+              >
+                {question}
+              </button>
+            ))}
+          </div>
+        )}
         {/* File input outside of form to prevent conflicts */}
         <input
           type="file"
           ref={fileInputRef}
           onChange={handleFileUpload}
           style={{ display: 'none' }}
-          accept=".pdf,.doc,.docx,.txt"
+          accept=".pdf,.doc,.docx,.txt,.zip"
+          multiple
         />
         <form className="input-form" onSubmit={handleSendMessage}>
           <button